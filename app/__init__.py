@@ -8,6 +8,12 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     logging.info("Config loaded. DB_FILE: %s", app.config.get("DB_FILE"))
+    if not app.config.get("SECRET_KEY"):
+        raise RuntimeError("SECRET_KEY is not set. It signs page tokens and must be the same in every worker.")
+
+    # Heavy agent components are shared by all requests and threads of this process.
+    from app.models.agent_registry import AgentRegistry
+    app.extensions["agent_registry"] = AgentRegistry(app.config)
     
     from app import routes
     app.register_blueprint(routes.bp)
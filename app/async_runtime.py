@@ -0,0 +1,162 @@
+# app/async_runtime.py
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+class LLMConcurrencyLimiter:
+    """
+    Async context manager that bounds the number of in-flight LLM calls.
+    One semaphore is kept per event loop; all async pipelines run on the AsyncRuntime
+    loop, so in practice the limit is process-wide.
+    """
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
+        return semaphore
+
+    async def __aenter__(self):
+        await self._semaphore().acquire()
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore().release()
+        return False
+
+llm_limiter = LLMConcurrencyLimiter(Config.LLM_MAX_CONCURRENCY)
+
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(max_workers=Config.DB_THREAD_POOL_SIZE,
+                                                  thread_name_prefix="text2sql-db")
+    return _db_executor
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Runs a blocking call (SQLite execution, Redis context access) on the database thread
+    pool and returns an awaitable for its result.
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context variables (e.g. the request's stage timings) to the thread.
+    context = contextvars.copy_context()
+    return loop.run_in_executor(get_db_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+async def _in_context(context, coro):
+    # The task running this coroutine has its own context copy, so these sets stay local to it.
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+class AsyncRuntime:
+    """
+    A background event loop shared by the whole process. Async pipelines are submitted to
+    it from any thread, so thousands of conversations waiting on Gemini are just suspended
+    coroutines on one loop, all bounded by the same LLM concurrency limit.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="text2sql-async", daemon=True)
+        self._thread.start()
+        logging.info("AsyncRuntime started. LLM_MAX_CONCURRENCY: %s", llm_limiter.max_concurrency)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine on the runtime loop and returns a concurrent.futures.Future.
+        The coroutine sees the submitting thread's context variables.
+        """
+        with self._pending_lock:
+            self.pending += 1
+        future = asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), self.loop)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._pending_lock:
+            self.pending -= 1
+
+    async def run(self, coro):
+        """Awaits a coroutine on the runtime loop from another event loop (e.g. a Flask async view)."""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stats(self) -> dict:
+        return {
+            "llm_in_flight": llm_limiter.in_flight,
+            "llm_max_concurrency": llm_limiter.max_concurrency,
+            "pending": self.pending,
+        }
+
+class Call:
+    """
+    One LLM or blocking call of a pipeline that is written once, as a generator, for both
+    sync and async callers. drive() calls fn; adrive() awaits afn if given (e.g. the
+    backend's agenerate, under the LLM concurrency limit) and otherwise runs fn on the
+    database thread pool.
+    """
+    __slots__ = ("fn", "afn", "args", "kwargs")
+
+    def __init__(self, fn, *args, afn=None, **kwargs):
+        self.fn = fn
+        self.afn = afn
+        self.args = args
+        self.kwargs = kwargs
+
+def drive(steps):
+    """
+    Runs a pipeline generator synchronously: every Call it yields is made in this thread
+    and its result sent back (or its exception raised at the yield). Returns the
+    generator's return value.
+    """
+    result, error = None, None
+    while True:
+        try:
+            call = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = call.fn(*call.args, **call.kwargs), None
+        except Exception as e:
+            result, error = None, e
+
+async def adrive(steps):
+    """Async variant of drive: the yielded calls are awaited, so no thread waits on them."""
+    result, error = None, None
+    while True:
+        try:
+            call = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            if call.afn is not None:
+                result = await call.afn(*call.args, **call.kwargs)
+            else:
+                result = await run_blocking(call.fn, *call.args, **call.kwargs)
+            error = None
+        except Exception as e:
+            result, error = None, e
@@ -0,0 +1,91 @@
+# app/batch.py
+
+import asyncio
+import logging
+from concurrent.futures import as_completed
+from app.contex_store import append_turns
+
+class QueryBatch:
+    """
+    Runs a batch of {"user_id", "query"} items through the async pipeline on the shared
+    AsyncRuntime loop. Items whose normalized queries are identical are translated and
+    executed once; distinct queries run concurrently, at most max_concurrency at a time
+    (and never more Gemini calls than the process-wide LLM limit). Every item reuses the
+    registry's schema snapshot, Gemini client, caches and connection pools.
+    Batch items are independent questions: they are translated without conversation
+    history, and each successful item is appended to its user's context afterwards, in order.
+    """
+    def __init__(self, registry, items: list, max_concurrency: int, **agent_options):
+        self.registry = registry
+        self.items = items
+        self.max_concurrency = max_concurrency
+        # Passed to AgentRegistry.create_agent (read_only, execute_sql, pipeline_mode, budget).
+        self.agent_options = agent_options
+        self._semaphore = None
+        self.groups = self._group()
+        logging.info("QueryBatch created with %s items, %s distinct queries.", len(items), len(self.groups))
+
+    def _group(self) -> dict:
+        """Maps each distinct normalized query to the indexes of the items asking it."""
+        nlp, schema_manager = self.registry.nlp, self.registry.schema_manager
+        groups = {}
+        for index, item in enumerate(self.items):
+            normalized = nlp.normalize_terms(nlp.parse(item["query"]), schema_manager)
+            groups.setdefault(" ".join(normalized.split()), []).append(index)
+        return groups
+
+    async def _run_group(self, index: int) -> dict:
+        # Created on the runtime loop itself; asyncio primitives bind to a loop on Python 3.9.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        item = self.items[index]
+        async with self._semaphore:
+            try:
+                agent = self.registry.create_agent(item["user_id"], **self.agent_options)
+                return await agent.aprocess_query(item["query"], remember=False)
+            except Exception as e:
+                logging.error("Error processing batch item %s: %s", index, e)
+                return {"sql": None, "result": None, "schema": [], "error": str(e)}
+
+    def submit(self) -> dict:
+        """Schedules every distinct query on the runtime loop; returns {future: item indexes}."""
+        runtime = self.registry.async_runtime
+        return {runtime.submit(self._run_group(indexes[0])): indexes for indexes in self.groups.values()}
+
+    def results(self) -> list:
+        """Runs the batch and returns one result per item, in item order."""
+        futures = self.submit()
+        results = [None] * len(self.items)
+        for future, indexes in futures.items():
+            result = future.result()
+            for index in indexes:
+                results[index] = result
+        self.record_turns(results)
+        return results
+
+    def iter_completed(self):
+        """
+        Runs the batch and yields (index, result) pairs as distinct queries complete.
+        Closing the generator early (e.g. a client disconnect) cancels the remaining queries.
+        """
+        futures = self.submit()
+        results = [None] * len(self.items)
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                for index in futures[future]:
+                    results[index] = result
+                    yield index, result
+        finally:
+            for future in futures:
+                future.cancel()
+        self.record_turns(results)
+
+    def record_turns(self, results: list):
+        turns = {}
+        for item, result in zip(self.items, results):
+            if result is not None and "error" not in result:
+                context_id = self.registry.context_id(item["user_id"])
+                turns.setdefault(context_id, []).append({"user": item["query"], "system": result["sql"]})
+        for context_id, context_turns in turns.items():
+            append_turns(context_id, context_turns)
@@ -4,28 +4,347 @@ import redis
 import json
 import os
 import logging
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from config import Config
+from app.metrics import CONTEXT_CACHE, CONTEXT_FALLBACKS
+from app.timings import stage
 
 # Read Redis host and port from environment variables.
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 logging.info("Connecting to Redis at %s:%s", REDIS_HOST, REDIS_PORT)
 
-# Configure the Redis client.
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+# Configure the Redis client. The pool is sized and blocks (up to the socket timeout) when
+# every connection is in use; connecting and every command time out instead of hanging.
+redis_pool = redis.BlockingConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, db=0,
+    max_connections=Config.REDIS_MAX_CONNECTIONS,
+    timeout=Config.REDIS_SOCKET_TIMEOUT,
+    socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT,
+    health_check_interval=30
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
 
-def get_context(user_id: str):
-    """Retrieve the conversation context for a given user_id from Redis."""
-    try:
-        data = redis_client.get(user_id)
+# Each user's turns are a Redis list under this prefix, one encoded turn per element.
+# Older versions stored the whole history as one JSON string under the bare user_id.
+CONTEXT_KEY_PREFIX = "context:"
+
+# Turn encoding: a format byte, then the length-prefixed UTF-8 user input and SQL.
+_TURN_FORMAT = b"\x01"
+_LENGTH = struct.Struct(">I")
+
+def encode_turn(turn: dict) -> bytes:
+    user = (turn.get("user") or "").encode("utf-8")
+    system = (turn.get("system") or "").encode("utf-8")
+    return _TURN_FORMAT + _LENGTH.pack(len(user)) + user + system
+
+def decode_turn(data: bytes) -> dict:
+    if data[:1] != _TURN_FORMAT:
+        return json.loads(data)
+    size = _LENGTH.unpack_from(data, 1)[0]
+    start = 1 + _LENGTH.size
+    return {"user": data[start:start + size].decode("utf-8"), "system": data[start + size:].decode("utf-8")}
+
+def context_key(user_id: str) -> str:
+    return CONTEXT_KEY_PREFIX + user_id
+
+def _tail(turns: list, last: int = None) -> list:
+    return list(turns) if last is None else list(turns)[len(turns) - last:] if last > 0 else []
+
+class ContextBackend(ABC):
+    """
+    Where conversation turns are kept. A backend keeps at most `window` turns per user
+    (0 = all) and forgets a user `ttl_seconds` after their last write (0 = never).
+    """
+    def __init__(self, window: int = 0, ttl_seconds: float = 0):
+        self.window = window
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def get(self, user_id: str, last: int = None) -> list:
+        """The user's last `last` turns, or every stored turn when last is None."""
+
+    @abstractmethod
+    def append(self, user_id: str, turns: list):
+        pass
+
+    @abstractmethod
+    def replace(self, user_id: str, turns: list):
+        pass
+
+class RedisContextBackend(ContextBackend):
+    """
+    Keeps each user's turns in a Redis list. Appending is one transactional pipeline
+    (RPUSH, LTRIM to the window, EXPIRE); reading the last N turns is one LRANGE. With
+    migrate_legacy, the read also fetches the legacy key in the same round trip and
+    migrates a history found there.
+    """
+    def __init__(self, client, window: int = 0, ttl_seconds: float = 0, migrate_legacy: bool = True):
+        super().__init__(window, ttl_seconds)
+        self.client = client
+        self.migrate_legacy = migrate_legacy
+
+    def get(self, user_id: str, last: int = None) -> list:
+        key = context_key(user_id)
+        start = -last if last else 0
+        if not self.migrate_legacy:
+            return [decode_turn(item) for item in self.client.lrange(key, start, -1)]
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lrange(key, start, -1)
+        pipe.get(user_id)
+        data, legacy = pipe.execute(raise_on_error=False)
+        if isinstance(data, Exception):
+            raise data
         if data:
-            return json.loads(data)
+            return [decode_turn(item) for item in data]
+        # A key of another type under the bare user_id (WRONGTYPE) is not a legacy history.
+        if not legacy or isinstance(legacy, Exception):
+            return []
+        return _tail(self._migrate_legacy_context(user_id, legacy), last)
+
+    def _queue_append(self, pipe, key: str, turns: list):
+        pipe.rpush(key, *[encode_turn(turn) for turn in turns])
+        if self.window > 0:
+            pipe.ltrim(key, -self.window, -1)
+        if self.ttl_seconds > 0:
+            pipe.expire(key, int(self.ttl_seconds))
+
+    def append(self, user_id: str, turns: list):
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_append(pipe, context_key(user_id), turns)
+        pipe.execute()
+
+    def replace(self, user_id: str, turns: list):
+        key = context_key(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key)
+        if turns:
+            self._queue_append(pipe, key, turns)
+        pipe.execute()
+
+    def _migrate_legacy_context(self, user_id: str, data: bytes) -> list:
+        """Moves a history stored as one JSON string under the bare user_id to the list format."""
+        try:
+            context = json.loads(data)
+        except ValueError:
+            return []
+        if not isinstance(context, list):
+            return []
+        logging.info("Migrating stored context for user_id %s to the list format.", user_id)
+        self.replace(user_id, context)
+        self.client.delete(user_id)
+        return context[-self.window:] if self.window > 0 else context
+
+class MemoryContextBackend(ContextBackend):
+    """
+    Keeps turns in this process, for single-node deployments and tests without Redis.
+    At most max_users users are kept; the least recently used are forgotten first.
+    """
+    def __init__(self, window: int = 0, ttl_seconds: float = 0, max_users: int = 10000):
+        super().__init__(window, ttl_seconds)
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> (expires_at or None, deque of turns)
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id: str):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return entry
+
+    def get(self, user_id: str, last: int = None) -> list:
+        with self._lock:
+            entry = self._entry(user_id)
+            return _tail(entry[1], last) if entry is not None else []
+
+    def append(self, user_id: str, turns: list):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        with self._lock:
+            entry = self._entry(user_id)
+            history = entry[1] if entry is not None else deque(maxlen=self.window or None)
+            history.extend(dict(turn) for turn in turns)
+            self._users[user_id] = (expires_at, history)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def replace(self, user_id: str, turns: list):
+        with self._lock:
+            self._users.pop(user_id, None)
+        if turns:
+            self.append(user_id, turns)
+
+class ContextStore:
+    """
+    Conversation context for every user, in front of a backend.
+    A small LRU (the L1 cache) keeps recently used users' turns in the process for
+    l1_ttl_seconds; writes go through to the backend and update the L1 entry, so hot users
+    skip the network hop. Another worker's writes only show up here once the entry expires,
+    so create_context_store leaves the L1 cache off unless CONTEXT_L1_SIZE is set.
+    When the backend fails, the store logs it, serves and records turns in the fallback
+    backend instead and retries the backend after retry_seconds.
+    """
+    def __init__(self, backend: ContextBackend, l1_size: int = 1024, l1_ttl_seconds: float = 30,
+                 fallback: ContextBackend = None, retry_seconds: float = 5):
+        self.backend = backend
+        self.fallback = fallback
+        self.l1_size = l1_size
+        self.l1_ttl_seconds = l1_ttl_seconds
+        self.retry_seconds = retry_seconds
+        # user_id -> (expires_at, turns, complete); complete means turns is the whole window.
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._backend_down_until = 0.0
+
+    def _l1_get(self, user_id: str, last: int = None):
+        with self._lock:
+            entry = self._l1.get(user_id)
+            if entry is None:
+                return None
+            expires_at, turns, complete = entry
+            if expires_at <= time.monotonic():
+                del self._l1[user_id]
+                return None
+            if not complete and (last is None or last > len(turns)):
+                return None
+            self._l1.move_to_end(user_id)
+            return _tail(turns, last)
+
+    def _l1_put(self, user_id: str, turns: list, complete: bool):
+        if self.l1_size <= 0:
+            return
+        window = self.backend.window
+        with self._lock:
+            self._l1[user_id] = (time.monotonic() + self.l1_ttl_seconds,
+                                 list(turns[-window:] if window > 0 else turns), complete)
+            self._l1.move_to_end(user_id)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _l1_append(self, user_id: str, turns: list):
+        window = self.backend.window
+        with self._lock:
+            entry = self._l1.get(user_id)
+            if entry is not None:
+                combined = entry[1] + list(turns)
+                self._l1[user_id] = (entry[0], combined[-window:] if window > 0 else combined, entry[2])
+
+    def _call(self, method: str, *args):
+        """Runs a backend method, switching to the fallback backend while the backend fails."""
+        if self.fallback is not None and time.monotonic() < self._backend_down_until:
+            CONTEXT_FALLBACKS.inc()
+            return getattr(self.fallback, method)(*args)
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            logging.error("Context backend unavailable (%s); using the in-memory fallback for %ss.",
+                          e, self.retry_seconds)
+            self._backend_down_until = time.monotonic() + self.retry_seconds
+            CONTEXT_FALLBACKS.inc()
+            return getattr(self.fallback, method)(*args)
+
+    def get(self, user_id: str, last: int = None) -> list:
+        if last is not None and last <= 0:
+            return []
+        turns = self._l1_get(user_id, last)
+        if turns is not None:
+            CONTEXT_CACHE.inc(result="hit")
+            return turns
+        CONTEXT_CACHE.inc(result="miss")
+        turns = self._call("get", user_id, last)
+        # Fewer turns than asked for means the whole history was read.
+        self._l1_put(user_id, turns, complete=last is None or len(turns) < last)
+        return turns
+
+    def append(self, user_id: str, turns: list):
+        if not turns:
+            return
+        self._call("append", user_id, turns)
+        self._l1_append(user_id, turns)
+
+    def replace(self, user_id: str, turns: list):
+        self._call("replace", user_id, turns)
+        self._l1_put(user_id, turns, complete=True)
+
+    def clear_l1(self):
+        with self._lock:
+            self._l1.clear()
+
+def create_context_store(config) -> ContextStore:
+    """
+    Builds the store selected by CONTEXT_BACKEND ("redis" or "memory") from a config class
+    or mapping.
+    """
+    get = config.get if isinstance(config, dict) else lambda name, default=None: getattr(config, name, default)
+    window = get("CONTEXT_WINDOW_TURNS", 50)
+    ttl_seconds = get("CONTEXT_TTL_SECONDS", 0)
+    memory = MemoryContextBackend(window, ttl_seconds, max_users=get("CONTEXT_MEMORY_MAX_USERS", 10000))
+    if get("CONTEXT_BACKEND", "redis") == "memory":
+        backend, fallback = memory, None
+    else:
+        backend = RedisContextBackend(redis_client, window, ttl_seconds,
+                                      migrate_legacy=get("CONTEXT_MIGRATE_LEGACY", True))
+        fallback = memory if get("CONTEXT_FALLBACK", True) else None
+    return ContextStore(backend, l1_size=get("CONTEXT_L1_SIZE", 0),
+                        l1_ttl_seconds=get("CONTEXT_L1_TTL_SECONDS", 30), fallback=fallback)
+
+_context_store = None
+_context_store_lock = threading.Lock()
+
+def get_context_store() -> ContextStore:
+    """The process-wide context store, built from Config on first use."""
+    global _context_store
+    if _context_store is None:
+        with _context_store_lock:
+            if _context_store is None:
+                _context_store = create_context_store(Config)
+    return _context_store
+
+def set_context_store(store: ContextStore):
+    global _context_store
+    _context_store = store
+
+def get_context(user_id: str, last: int = None):
+    """
+    Retrieve the conversation context for a given user_id: its last `last` turns, or the
+    whole stored window (the last CONTEXT_WINDOW_TURNS turns) when last is None.
+    """
+    try:
+        with stage("context_load"):
+            return get_context_store().get(user_id, last)
     except Exception as e:
         logging.error("Error retrieving context for user_id %s: %s", user_id, e)
     return []
 
+def append_turns(user_id: str, turns: list):
+    """
+    Append turns to the user's context, keeping only the last CONTEXT_WINDOW_TURNS turns
+    and restarting the session's CONTEXT_TTL_SECONDS expiry.
+    """
+    try:
+        with stage("context_save"):
+            get_context_store().append(user_id, turns)
+    except Exception as e:
+        logging.error("Error appending context for user_id %s: %s", user_id, e)
+
+def append_turn(user_id: str, user_input: str, system_output: str):
+    append_turns(user_id, [{"user": user_input, "system": system_output}])
+
 def set_context(user_id: str, context):
-    """Store the conversation context for a given user_id into Redis."""
+    """Replace the conversation context for a given user_id."""
     try:
-        redis_client.set(user_id, json.dumps(context))
+        with stage("context_save"):
+            get_context_store().replace(user_id, context)
     except Exception as e:
         logging.error("Error setting context for user_id %s: %s", user_id, e)
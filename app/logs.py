@@ -0,0 +1,176 @@
+# app/logs.py
+
+import json
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+# Stage loggers for the payload-heavy parts of the pipeline, each with its own level:
+# prompt (prompts sent to the LLM), llm (raw LLM outputs), sql (generated and executed SQL),
+# result (result payloads) and context (conversation turns).
+STAGES = ("prompt", "llm", "sql", "result", "context")
+LOGGER_PREFIX = "text2sql."
+SLOW_LOGGER = LOGGER_PREFIX + "slow"
+
+_request_log = ContextVar("request_log", default=None)
+_sampled = ContextVar("log_sampled", default=None)
+
+class _Settings:
+    max_chars = 500
+    sample_rate = 1.0
+    slow_request_ms = 0.0
+
+settings = _Settings()
+_handler = None
+
+def stage_logger(name: str) -> logging.Logger:
+    return logging.getLogger(LOGGER_PREFIX + name)
+
+class Truncated:
+    """
+    A log argument that is only converted to text when a record is actually emitted, and
+    then cut to LOG_MAX_CHARS characters (with the full length noted).
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        limit = settings.max_chars
+        if not limit or len(text) <= limit:
+            return text
+        return f"{text[:limit]}... [{len(text)} chars]"
+
+    __repr__ = __str__
+
+def truncate(value) -> Truncated:
+    return Truncated(value)
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through a LOG_SAMPLE_RATE share of the stage loggers' DEBUG and INFO records.
+    The decision is made once per request (see start_request_log), so a sampled request
+    is logged completely; warnings and errors always pass.
+    """
+    def filter(self, record) -> bool:
+        if record.levelno >= logging.WARNING or settings.sample_rate >= 1:
+            return True
+        sampled = _sampled.get()
+        if sampled is None:
+            return random.random() < settings.sample_rate
+        return sampled
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger and message (plus the exception, if any)."""
+    def format(self, record) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestLog:
+    """
+    The full payloads (prompts, LLM outputs, executed SQL) of one request, kept by reference
+    so that the slow-request log can write them if the request turns out to be slow.
+    """
+    def __init__(self):
+        self.entries = []
+        # The async pipeline also records from database pool threads.
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, value):
+        with self._lock:
+            self.entries.append((kind, value))
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return list(self.entries)
+
+def configure_logging(config):
+    """
+    Configures the root handler (LOG_LEVEL, LOG_FORMAT "text" or "json"), the stage loggers'
+    levels (LOG_STAGE_LEVELS, e.g. "prompt:DEBUG,sql:WARNING"), payload truncation
+    (LOG_MAX_CHARS), sampling (LOG_SAMPLE_RATE) and the slow-request log
+    (SLOW_REQUEST_MS, written to SLOW_REQUEST_LOG_FILE or the root handler).
+    """
+    global _handler
+    get = config.get if isinstance(config, dict) else lambda name, default=None: getattr(config, name, default)
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    _handler = logging.StreamHandler()
+    if get("LOG_FORMAT", "text") == "json":
+        _handler.setFormatter(JsonFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    root.addHandler(_handler)
+    root.setLevel(get("LOG_LEVEL", "INFO").upper())
+
+    settings.max_chars = get("LOG_MAX_CHARS", 500)
+    settings.sample_rate = get("LOG_SAMPLE_RATE", 1.0)
+    settings.slow_request_ms = get("SLOW_REQUEST_MS", 0)
+    levels = {}
+    for item in (get("LOG_STAGE_LEVELS") or "").split(","):
+        if ":" in item:
+            name, level = item.split(":", 1)
+            levels[name.strip()] = level.strip().upper()
+    sampling = SamplingFilter()
+    for name in STAGES:
+        logger = stage_logger(name)
+        logger.setLevel(levels.get(name, "NOTSET"))
+        for existing in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(existing)
+        logger.addFilter(sampling)
+
+    slow_logger = logging.getLogger(SLOW_LOGGER)
+    slow_logger.setLevel(logging.INFO)
+    for existing in list(slow_logger.handlers):
+        slow_logger.removeHandler(existing)
+        existing.close()
+    if get("SLOW_REQUEST_LOG_FILE"):
+        slow_handler = logging.FileHandler(get("SLOW_REQUEST_LOG_FILE"))
+        slow_handler.setFormatter(logging.Formatter("%(message)s"))
+        slow_logger.addHandler(slow_handler)
+        slow_logger.propagate = False
+    else:
+        slow_logger.propagate = True
+
+def start_request_log():
+    """
+    Called when a request starts: draws its sampling decision and, with the slow-request log
+    on, starts capturing its payloads.
+    """
+    _sampled.set(settings.sample_rate >= 1 or random.random() < settings.sample_rate)
+    _request_log.set(RequestLog() if settings.slow_request_ms else None)
+
+def capture(kind: str, value):
+    """Keeps a full payload for the slow-request log; free when the log is off."""
+    request_log = _request_log.get()
+    if request_log is not None:
+        request_log.add(kind, value)
+
+def finish_request_log(endpoint: str, elapsed: float, status: int, timings: dict = None):
+    """
+    Writes the request to the slow-request log (one JSON line with the payloads captured
+    during the request and the stage timings) if it took at least SLOW_REQUEST_MS.
+    """
+    request_log = _request_log.get()
+    if request_log is None or elapsed * 1000 < settings.slow_request_ms:
+        return
+    logging.getLogger(SLOW_LOGGER).warning("%s", json.dumps({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "endpoint": endpoint,
+        "status": status,
+        "latency_ms": round(elapsed * 1000, 3),
+        "timings": timings,
+        "payloads": [{"kind": kind, "value": value} for kind, value in request_log.snapshot()],
+    }, default=str))
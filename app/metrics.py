@@ -0,0 +1,140 @@
+# app/metrics.py
+
+import bisect
+import threading
+
+# Seconds; covers sub-millisecond local stages up to slow LLM calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labelnames, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    A monotonically increasing count, optionally split by labels.
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+class Histogram:
+    """
+    Counts observations in cumulative buckets, plus their sum and count, optionally split by labels.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (the last one is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def samples(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in the Prometheus text exposition format.
+    Each worker process keeps its own counts.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter("text2sql_requests_total", "HTTP requests handled.", ["endpoint", "status"])
+REQUEST_SECONDS = registry.histogram("text2sql_request_duration_seconds", "HTTP request latency.", ["endpoint"])
+STAGE_SECONDS = registry.histogram("text2sql_stage_duration_seconds", "Time spent per pipeline stage.", ["stage"])
+LLM_CALLS = registry.counter("text2sql_llm_calls_total", "LLM backend calls.", ["backend"])
+LLM_CALLS_PER_REQUEST = registry.histogram("text2sql_llm_calls_per_request", "LLM calls made by one request.",
+                                           ["endpoint"], buckets=(0, 1, 2, 3, 4, 6, 8))
+TRANSLATION_CACHE = registry.counter("text2sql_translation_cache_total", "Translation cache lookups.", ["result"])
+VALIDATION_FAILURES = registry.counter("text2sql_validation_failures_total", "Generated or refined SQL rejected by validation.")
+PROMPT_TOKENS = registry.histogram("text2sql_prompt_tokens", "Tokens per LLM prompt.", ["kind"],
+                                   buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+SCHEMA_RETRIEVAL = registry.counter("text2sql_schema_retrieval_total",
+                                    "Prompts built with a pruned or the full schema.", ["result"])
+CONTEXT_CACHE = registry.counter("text2sql_context_cache_total", "Conversation context L1 cache lookups.", ["result"])
+CONTEXT_FALLBACKS = registry.counter("text2sql_context_fallbacks_total",
+                                     "Context reads and writes served by the in-memory fallback backend.")
+SINGLE_FLIGHT = registry.counter("text2sql_single_flight_total",
+                                 "Translations run (leader) or shared from a concurrent identical request.", ["role"])
+RESULT_CACHE = registry.counter("text2sql_result_cache_total", "Executed-query result cache lookups.", ["result"])
+DATABASE_REQUESTS = registry.counter("text2sql_database_requests_total",
+                                     "Requests routed to a named database.", ["database", "endpoint", "status"])
+DATABASE_REQUEST_SECONDS = registry.histogram("text2sql_database_request_duration_seconds",
+                                              "Latency of requests routed to a named database.", ["database"])
+DATABASE_HANDLES = registry.counter("text2sql_database_handles_total",
+                                    "Named databases opened and closed (least recently used first).", ["event"])
+QUERY_RESULTS = registry.counter("text2sql_query_results_total", "Executed queries by result status.", ["status"])
+ROWS_RETURNED = registry.histogram("text2sql_rows_returned", "Rows returned per executed query.",
+                                   buckets=(0, 1, 10, 100, 1000, 10000, 100000))
@@ -0,0 +1,253 @@
+# app/models/agent_registry.py
+
+import atexit
+import logging
+import threading
+from .nlp_processor import NLProcessor
+from .schema_manager import SchemaManager
+from .prompt_builder import PromptBuilder
+from .sql_generator import GeminiSQLGenerator
+from .feedback_module import FeedbackModule
+from .database import SQLiteDatabase, QueryBudget
+from .sql_executor import SQLExecutor
+from .connection_pool import ReplicaPool, get_pool, all_pool_stats
+from .translation_cache import TranslationCache
+from .result_cache import ResultCache
+from .conversion_logger import ConversionLogger
+from .single_flight import SingleFlight
+from .sql_validator import SQLiteValidator
+from .text_to_sql_agent import TextToSQLAgent
+from .llm_backend import LLMBackend, create_llm_backend
+from app.async_runtime import AsyncRuntime
+
+class AgentRegistry:
+    """
+    Process-wide holder for the components shared by every TextToSQLAgent.
+    The LLM backend, schema manager, database layers, executors and feedback module
+    are built lazily on first use and then reused across requests and threads, so a
+    request only pays for its own user state (user_id, overrides and conversation history).
+    """
+    def __init__(self, config):
+        # Flask's app.config (or any mapping); values are read when a component is first built.
+        self.config = config
+        self._lock = threading.RLock()
+        self._components = {}
+        logging.info("AgentRegistry created.")
+
+    def _get(self, name, factory):
+        component = self._components.get(name)
+        if component is None:
+            with self._lock:
+                component = self._components.get(name)
+                if component is None:
+                    component = factory()
+                    self._components[name] = component
+                    logging.info("AgentRegistry built shared component: %s", name)
+        return component
+
+    @property
+    def nlp(self) -> NLProcessor:
+        return self._get("nlp", NLProcessor)
+
+    @property
+    def schema_manager(self) -> SchemaManager:
+        def build():
+            if self.config.get("USE_DYNAMIC_SCHEMA"):
+                return SchemaManager(db_file=self.config.get("DB_FILE"), use_dynamic_schema=True)
+            return SchemaManager(self.config.get("STATIC_SCHEMA_INFO"))
+        return self._get("schema_manager", build)
+
+    @property
+    def llm_backend(self) -> LLMBackend:
+        return self._get("llm_backend", lambda: create_llm_backend(self.config))
+
+    @property
+    def prompt_builder(self) -> PromptBuilder:
+        return self._get("prompt_builder", lambda: PromptBuilder(
+            self.schema_manager,
+            token_budget=self.config.get("PROMPT_TOKEN_BUDGET", 0),
+            history_turns=self.config.get("PROMPT_HISTORY_TURNS", 0),
+            encoding_name=self.config.get("PROMPT_TOKEN_ENCODING", "cl100k_base")
+        ))
+
+    @property
+    def sql_generator(self) -> GeminiSQLGenerator:
+        return self._get("sql_generator", lambda: GeminiSQLGenerator(
+            self.schema_manager, backend=self.llm_backend, prompt_builder=self.prompt_builder
+        ))
+
+    @property
+    def feedback_module(self) -> FeedbackModule:
+        return self._get("feedback_module", lambda: FeedbackModule(self.schema_manager, self.sql_generator))
+
+    @property
+    def translation_cache(self):
+        def build():
+            if not self.config.get("TRANSLATION_CACHE_ENABLED", True):
+                return None
+            redis_client = None
+            if self.config.get("TRANSLATION_CACHE_REDIS"):
+                from app.contex_store import redis_client
+            return TranslationCache(
+                max_entries=self.config.get("TRANSLATION_CACHE_SIZE", 1024),
+                ttl_seconds=self.config.get("TRANSLATION_CACHE_TTL", 3600),
+                redis_client=redis_client
+            )
+        # A disabled cache is remembered as False so the config is only read once.
+        return self._get("translation_cache", lambda: build() or False) or None
+
+    @property
+    def sql_validator(self):
+        # The Gemini validator needs no shared state; only the local one is built here.
+        if self.config.get("SQL_VALIDATOR", "local") != "local":
+            return None
+        return self._get("sql_validator", lambda: SQLiteValidator(self.schema_manager))
+
+    @property
+    def single_flight(self):
+        def build():
+            if not self.config.get("SINGLE_FLIGHT_ENABLED", True):
+                return None
+            redis_client = None
+            if self.config.get("SINGLE_FLIGHT_REDIS"):
+                from app.contex_store import redis_client
+            return SingleFlight(
+                redis_client=redis_client,
+                lease_seconds=self.config.get("SINGLE_FLIGHT_LEASE_SECONDS", 30),
+                wait_seconds=self.config.get("SINGLE_FLIGHT_WAIT_SECONDS", 30)
+            )
+        return self._get("single_flight", lambda: build() or False) or None
+
+    @property
+    def conversion_logger(self):
+        def build():
+            if not self.config.get("CONVERSION_LOG_DB"):
+                return None
+            conversion_logger = ConversionLogger(
+                self.config.get("CONVERSION_LOG_DB"),
+                queue_size=self.config.get("CONVERSION_LOG_QUEUE_SIZE", 10000),
+                batch_size=self.config.get("CONVERSION_LOG_BATCH_SIZE", 200),
+                flush_interval=self.config.get("CONVERSION_LOG_FLUSH_INTERVAL", 1.0),
+                backpressure=self.config.get("CONVERSION_LOG_BACKPRESSURE", "drop"),
+                block_timeout=self.config.get("CONVERSION_LOG_BLOCK_TIMEOUT", 0.05)
+            )
+            # Write what is still queued when the process exits.
+            atexit.register(conversion_logger.close)
+            return conversion_logger
+        # A disabled logger is remembered as False so the config is only read once.
+        return self._get("conversion_logger", lambda: build() or False) or None
+
+    @property
+    def result_cache(self):
+        def build():
+            if not self.config.get("RESULT_CACHE_ENABLED", True):
+                return None
+            return ResultCache(
+                max_bytes=self.config.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+                max_entry_bytes=self.config.get("RESULT_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)
+            )
+        return self._get("result_cache", lambda: build() or False) or None
+
+    @property
+    def async_runtime(self) -> AsyncRuntime:
+        return self._get("async_runtime", AsyncRuntime)
+
+    def get_db_layer(self, read_only: bool) -> SQLiteDatabase:
+        name = "db_layer_ro" if read_only else "db_layer_rw"
+        return self._get(name, lambda: SQLiteDatabase(
+            self.config.get("DB_FILE"), read_only=read_only, pool=self.get_pool(read_only),
+            default_budget=self.default_budget, result_cache=self.result_cache
+        ))
+
+    @property
+    def default_budget(self) -> QueryBudget:
+        return self._get("default_budget", lambda: QueryBudget.from_config(self.config))
+
+    def get_pool(self, read_only: bool):
+        pool = get_pool(
+            self.config.get("DB_FILE"),
+            read_only=read_only,
+            size=self.config.get("DB_POOL_SIZE", 8),
+            timeout=self.config.get("DB_POOL_TIMEOUT", 10),
+            mmap_size=self.config.get("DB_MMAP_SIZE", 0),
+            cache_size=self.config.get("DB_CACHE_SIZE"),
+            wal=self.config.get("DB_WAL", False)
+        )
+        if not read_only or not self.config.get("DB_REPLICA_ENABLED", False):
+            return pool
+        # Read-only queries are served from an in-memory replica, with the disk pool as fallback.
+        return self._get("replica_pool", lambda: ReplicaPool(
+            pool,
+            max_bytes=self.config.get("DB_REPLICA_MAX_BYTES", 512 * 1024 * 1024),
+            check_interval=self.config.get("DB_REPLICA_CHECK_INTERVAL", 5.0),
+            size=self.config.get("DB_POOL_SIZE", 8),
+            timeout=self.config.get("DB_POOL_TIMEOUT", 10)
+        ))
+
+    def get_executor(self, read_only: bool) -> SQLExecutor:
+        name = "executor_ro" if read_only else "executor_rw"
+        return self._get(name, lambda: SQLExecutor(self.get_db_layer(read_only), self.sql_generator))
+
+    @property
+    def databases(self):
+        """Routes requests to the named databases under DATABASES_DIR (see DatabaseRouter)."""
+        def build():
+            from .database_router import DatabaseRouter
+            return DatabaseRouter(self, self.config.get("DATABASES_DIR"), self.config.get("DATABASES_MAX_OPEN", 64))
+        return self._get("databases", build)
+
+    def context_id(self, user_id: str) -> str:
+        """The key under which a user's conversation context is stored."""
+        return user_id
+
+    def create_agent(self, user_id: str, read_only: bool = None, execute_sql: bool = None,
+                     pipeline_mode: str = None, budget: QueryBudget = None) -> TextToSQLAgent:
+        """
+        Builds a lightweight per-request agent that reuses the shared components.
+        """
+        if read_only is None:
+            read_only = self.config.get("READ_ONLY", True)
+        return TextToSQLAgent(
+            schema_info=self.config.get("STATIC_SCHEMA_INFO"),
+            db_file=self.config.get("DB_FILE"),
+            user_id=user_id,
+            read_only=read_only,
+            use_dynamic_schema=self.config.get("USE_DYNAMIC_SCHEMA"),
+            execute_sql=execute_sql,
+            nlp=self.nlp,
+            schema_manager=self.schema_manager,
+            sql_generator=self.sql_generator,
+            feedback_module=self.feedback_module,
+            db_layer=self.get_db_layer(read_only),
+            executor=self.get_executor(read_only),
+            translation_cache=self.translation_cache,
+            pipeline_mode=pipeline_mode or self.config.get("PIPELINE_MODE"),
+            sql_validator=self.sql_validator,
+            budget=budget,
+            single_flight=self.single_flight,
+            context_id=self.context_id(user_id)
+        )
+
+    def stats(self) -> dict:
+        """
+        Returns counters of the shared components for the /stats endpoint.
+        """
+        cache = self.translation_cache
+        # The runtime starts a thread, so it is only reported once something has used it.
+        runtime = self._components.get("async_runtime")
+        conversion_logger = self._components.get("conversion_logger")
+        single_flight = self._components.get("single_flight")
+        result_cache = self._components.get("result_cache")
+        replica_pool = self._components.get("replica_pool")
+        databases = self._components.get("databases")
+        return {
+            "translation_cache": cache.stats() if cache is not None else None,
+            "connection_pools": all_pool_stats(),
+            "llm_backend": self.llm_backend.stats(),
+            "async_runtime": runtime.stats() if runtime is not None else None,
+            "conversion_log": conversion_logger.stats() if conversion_logger else None,
+            "single_flight": single_flight.stats() if single_flight else None,
+            "result_cache": result_cache.stats() if result_cache else None,
+            "replica": replica_pool.stats() if replica_pool is not None else None,
+            "databases": databases.stats() if databases is not None else None,
+        }
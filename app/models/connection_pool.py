@@ -0,0 +1,388 @@
+# app/models/connection_pool.py
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the pool timeout."""
+
+class SQLiteConnectionPool:
+    """
+    A bounded pool of SQLite connections to one database file.
+    A connection is checked out by one thread at a time and returned afterwards, so warm
+    connections (and SQLite's page cache) are reused across requests. Read-only pools open
+    connections through a "file:...?mode=ro" URI and set PRAGMA query_only; read-write pools
+    can switch the database to WAL journal mode. mmap_size and cache_size are applied to
+    every new connection.
+    """
+    def __init__(self, db_file: str, read_only: bool = True, size: int = 8, timeout: float = 10.0,
+                 mmap_size: int = 0, cache_size: int = None, wal: bool = False):
+        self.db_file = os.path.realpath(db_file)
+        self.read_only = read_only
+        self.size = size
+        self.timeout = timeout
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.wal = wal
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.in_use = 0
+        logging.info("SQLiteConnectionPool created. DB_FILE: %s | READ_ONLY: %s | SIZE: %s",
+                     self.db_file, read_only, size)
+
+    def _open(self):
+        if self.read_only:
+            uri = "file:" + pathname2url(self.db_file) + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON;")
+        else:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            if self.wal:
+                conn.execute("PRAGMA journal_mode = WAL;")
+        if self.mmap_size:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)};")
+        if self.cache_size is not None:
+            conn.execute(f"PRAGMA cache_size = {int(self.cache_size)};")
+        return conn
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeoutError(
+                    f"No database connection available for {self.db_file} within {self.timeout}s"
+                )
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                if conn is not None:
+                    self.reused += 1
+            if conn is None:
+                conn = self._open()
+                with self._lock:
+                    self.created += 1
+            with self._lock:
+                self.in_use += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard: bool = False):
+        with self._lock:
+            self.in_use -= 1
+            keep = not discard and not self._closed
+            if keep:
+                self._idle.append(conn)
+            else:
+                self.discarded += 1
+        if not keep:
+            conn.close()
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a connection out for the duration of the block. Any open transaction is
+        rolled back on error; a connection that cannot even roll back is discarded.
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def snapshot_version(self):
+        """Connections see the live file, so there is no snapshot version (see ReplicaPool)."""
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "db_file": self.db_file,
+                "read_only": self.read_only,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self.in_use,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+
+class _Replica:
+    """One in-memory copy of the database: the connection keeping it alive and its idle connections."""
+    def __init__(self, uri: str, keeper, generation: int, size_bytes: int):
+        self.uri = uri
+        self.keeper = keeper
+        self.generation = generation
+        self.size_bytes = size_bytes
+        self.idle = []
+        self.in_use = 0
+
+class ReplicaPool:
+    """
+    Serves read-only connections from an in-memory replica of a database file.
+    The file is copied with Connection.backup into a shared-cache in-memory database at
+    startup and again whenever its PRAGMA data_version changes, which a background thread
+    checks every check_interval seconds. The new replica replaces the old one atomically;
+    connections already checked out finish on the replica they started on, and the old copy
+    is freed once the last of them is returned. While the database is larger than max_bytes
+    (or cannot be copied), connections come from the on-disk pool instead.
+    """
+    def __init__(self, disk_pool: SQLiteConnectionPool, max_bytes: int, check_interval: float = 5.0,
+                 size: int = 8, timeout: float = 10.0):
+        self.disk_pool = disk_pool
+        self.db_file = disk_pool.db_file
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.size = size
+        self.timeout = timeout
+        self._current = None
+        self._generation = 0
+        self._source_version = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.oversized = 0
+        self.errors = 0
+        self.created = 0
+        self.reused = 0
+        self.timeouts = 0
+        self.refresh()
+        self._thread = None
+        if check_interval:
+            self._thread = threading.Thread(target=self._poll, name="sqlite-replica", daemon=True)
+            self._thread.start()
+
+    def _connect_source(self):
+        uri = "file:" + pathname2url(self.db_file) + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def refresh(self) -> bool:
+        """
+        Copies the database into a new replica if it changed since the last copy (or check).
+        Returns True if a new replica was swapped in.
+        """
+        with self._refresh_lock:
+            try:
+                if self._watcher is None:
+                    self._watcher = self._connect_source()
+                version = self._watcher.execute("PRAGMA data_version;").fetchone()[0]
+                if version == self._source_version:
+                    return False
+                page_count = self._watcher.execute("PRAGMA page_count;").fetchone()[0]
+                page_size = self._watcher.execute("PRAGMA page_size;").fetchone()[0]
+                size_bytes = page_count * page_size
+                # Read before copying, so a commit made during the copy triggers another one.
+                self._source_version = version
+                if size_bytes > self.max_bytes:
+                    logging.warning("Database %s is %s bytes, over the replica limit of %s; serving it from disk.",
+                                    self.db_file, size_bytes, self.max_bytes)
+                    self.oversized += 1
+                    self._swap(None)
+                    return False
+                self._generation += 1
+                uri = f"file:text2sql-replica-{id(self)}-{self._generation}?mode=memory&cache=shared"
+                keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                source = self._connect_source()
+                try:
+                    source.backup(keeper)
+                finally:
+                    source.close()
+            except sqlite3.Error as e:
+                logging.error("Error refreshing the in-memory replica of %s: %s", self.db_file, e)
+                self.errors += 1
+                self._source_version = None
+                return False
+            self._swap(_Replica(uri, keeper, self._generation, size_bytes))
+            self.refreshes += 1
+            logging.info("In-memory replica of %s refreshed (%s bytes, generation %s).",
+                         self.db_file, size_bytes, self._generation)
+            return True
+
+    def _swap(self, replica):
+        with self._lock:
+            old, self._current = self._current, replica
+            if old is None:
+                return
+            idle, old.idle = old.idle, []
+            keeper = old.keeper if old.in_use == 0 else None
+            if keeper is not None:
+                old.keeper = None
+        for conn in idle:
+            conn.close()
+        if keeper is not None:
+            keeper.close()
+
+    def _poll(self):
+        while not self._stop.wait(self.check_interval):
+            self.refresh()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a connection to the current replica out for the duration of the block, or one
+        from the on-disk pool when there is no replica.
+        """
+        if self._current is None:
+            with self.disk_pool.connection() as conn:
+                yield conn
+            return
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(f"No replica connection available for {self.db_file} within {self.timeout}s")
+        try:
+            replica, conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        if replica is None:
+            self._slots.release()
+            with self.disk_pool.connection() as conn:
+                yield conn
+            return
+        discard = False
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self._checkin(replica, conn, discard)
+            self._slots.release()
+
+    def _checkout(self):
+        with self._lock:
+            replica = self._current
+            if replica is None:
+                return None, None
+            replica.in_use += 1
+            conn = replica.idle.pop() if replica.idle else None
+            if conn is not None:
+                self.reused += 1
+        if conn is None:
+            try:
+                conn = sqlite3.connect(replica.uri, uri=True, check_same_thread=False)
+                conn.execute("PRAGMA query_only = ON;")
+            except BaseException:
+                self._checkin(replica, None, True)
+                raise
+            with self._lock:
+                self.created += 1
+        return replica, conn
+
+    def _checkin(self, replica: _Replica, conn, discard: bool):
+        with self._lock:
+            replica.in_use -= 1
+            current = replica is self._current
+            keep = conn is not None and not discard and current
+            if keep:
+                replica.idle.append(conn)
+            keeper = replica.keeper if not current and replica.in_use == 0 else None
+            if keeper is not None:
+                replica.keeper = None
+        if conn is not None and not keep:
+            conn.close()
+        if keeper is not None:
+            keeper.close()
+
+    def snapshot_version(self):
+        """
+        Identifies the data queries currently see: the replica's generation, or None when
+        they are served from the file itself.
+        """
+        replica = self._current
+        return ("replica", replica.generation) if replica is not None else None
+
+    def close(self):
+        self._stop.set()
+        self._swap(None)
+        with self._refresh_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            replica = self._current
+            return {
+                "db_file": self.db_file,
+                "in_memory": replica is not None,
+                "generation": replica.generation if replica is not None else None,
+                "size_bytes": replica.size_bytes if replica is not None else None,
+                "max_bytes": self.max_bytes,
+                "idle": len(replica.idle) if replica is not None else 0,
+                "in_use": replica.in_use if replica is not None else 0,
+                "created": self.created,
+                "reused": self.reused,
+                "timeouts": self.timeouts,
+                "refreshes": self.refreshes,
+                "oversized": self.oversized,
+                "errors": self.errors,
+            }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_file: str, read_only: bool = True, **settings) -> SQLiteConnectionPool:
+    """
+    Returns the process-wide pool for a database file and access mode, creating it with
+    the given settings on first use.
+    """
+    key = (os.path.realpath(db_file), bool(read_only))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SQLiteConnectionPool(db_file, read_only=read_only, **settings)
+                _pools[key] = pool
+    return pool
+
+def close_pools(db_file: str):
+    """Closes the process-wide pools of a database file (both access modes) and forgets them."""
+    path = os.path.realpath(db_file)
+    with _pools_lock:
+        pools = [_pools.pop(key) for key in list(_pools) if key[0] == path]
+    for pool in pools:
+        pool.close()
+
+def all_pool_stats() -> list:
+    return [pool.stats() for pool in list(_pools.values())]
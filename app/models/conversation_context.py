@@ -1,6 +1,9 @@
 # app/models/conversation_context.py
 
 import logging
+from app.logs import stage_logger, truncate
+
+context_log = stage_logger("context")
 
 class ConversationContext:
     """
@@ -13,7 +16,7 @@ class ConversationContext:
 
     def add_turn(self, user_input: str, system_output: str):
         self.history.append({"user": user_input, "system": system_output})
-        logging.info("Added conversation turn. User: %s | System: %s", user_input, system_output)
+        context_log.debug("Added conversation turn. User: %s | System: %s", truncate(user_input), truncate(system_output))
 
     def get_context(self):
         return self.history
@@ -0,0 +1,160 @@
+# app/models/conversion_logger.py
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS conversion_log (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    query TEXT,
+    generated_sql TEXT,
+    timestamp DATETIME,
+    endpoint TEXT,
+    status TEXT,
+    error TEXT,
+    cached INTEGER,
+    latency_ms REAL,
+    llm_calls INTEGER,
+    stages_ms TEXT
+)
+"""
+INSERT = (
+    "INSERT INTO conversion_log (user_id, query, generated_sql, timestamp, endpoint, status, error, cached, "
+    "latency_ms, llm_calls, stages_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Backpressure policies when the queue is full.
+BACKPRESSURE_DROP = "drop"
+BACKPRESSURE_BLOCK = "block"
+
+class ConversionLogger:
+    """
+    Write-behind audit log of conversions, kept in its own WAL-mode SQLite database so
+    logging never contends with the queried database.
+    log() only puts the record on a bounded in-memory queue; a background thread writes
+    the queued records with one executemany transaction per batch of up to batch_size
+    records, or every flush_interval seconds. When the queue is full, records are dropped
+    ("drop") or the caller waits up to block_timeout seconds before dropping ("block").
+    If the file cannot be opened, one warning is logged and every record is dropped.
+    """
+    def __init__(self, db_file: str, queue_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0, backpressure: str = BACKPRESSURE_DROP, block_timeout: float = 0.05):
+        if backpressure not in (BACKPRESSURE_DROP, BACKPRESSURE_BLOCK):
+            raise ValueError(f"Unknown backpressure policy: {backpressure}")
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._closed = False
+        self._thread = None
+        try:
+            self._conn = self._connect()
+        except sqlite3.Error as e:
+            logging.warning("Conversion log disabled: cannot open %s (%s).", db_file, e)
+            self._conn = None
+            return
+        self._thread = threading.Thread(target=self._run, name="conversion-logger", daemon=True)
+        self._thread.start()
+        logging.info("ConversionLogger writing to %s. batch_size=%s flush_interval=%ss backpressure=%s",
+                     db_file, batch_size, flush_interval, backpressure)
+
+    def log(self, user_id: str, query: str, generated_sql: str, endpoint: str = None, status: str = None,
+            error: str = None, cached: bool = None, latency_ms: float = None, llm_calls: int = None,
+            stages_ms: dict = None, timestamp: float = None) -> bool:
+        """Queues one record; returns False if it was dropped."""
+        if self._thread is None:
+            with self._lock:
+                self.dropped += 1
+            return False
+        record = (
+            user_id, query, generated_sql,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp if timestamp is not None else time.time())),
+            endpoint, status, error, None if cached is None else int(cached), latency_ms, llm_calls,
+            json.dumps(stages_ms) if stages_ms else None,
+        )
+        try:
+            if self.backpressure == BACKPRESSURE_BLOCK:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.logged += 1
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Waits until every record queued so far is written; returns False on timeout."""
+        if self._thread is None:
+            return False
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        if not self._closed:
+            self._closed = True
+            self.flush(timeout)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(CREATE_TABLE)
+        conn.commit()
+        return conn
+
+    def _run(self):
+        conn = self._conn
+        batch, waiters = [], []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or waiters or time.monotonic() >= deadline):
+                try:
+                    with conn:
+                        conn.executemany(INSERT, batch)
+                    with self._lock:
+                        self.written += len(batch)
+                        self.batches += 1
+                except Exception as e:
+                    logging.error("Error writing %s conversion log records: %s", len(batch), e)
+                    with self._lock:
+                        self.errors += 1
+                batch, deadline = [], None
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self._queue.qsize(), "logged": self.logged, "written": self.written,
+                    "dropped": self.dropped, "batches": self.batches, "errors": self.errors}
@@ -1,6 +1,61 @@
 import sqlite3
+import time
 from abc import ABC, abstractmethod
 import logging
+from config import Config
+from app.logs import capture, stage_logger, truncate
+from .connection_pool import get_pool
+
+sql_log = stage_logger("sql")
+
+# SQLite VM instructions between deadline checks, and rows fetched per fetchmany call.
+PROGRESS_HANDLER_STEPS = 10000
+FETCH_BATCH_SIZE = 500
+
+class QueryTimeoutError(Exception):
+    """Raised when a query is interrupted because it ran past its deadline."""
+
+class QueryBudget:
+    """
+    Per-request execution limits: a wall-clock timeout in seconds, a maximum number of
+    rows and a maximum (estimated) result size in bytes. None or 0 disables a limit.
+    use_cache=False makes the request bypass the result cache.
+    """
+    def __init__(self, timeout: float = None, max_rows: int = None, max_bytes: int = None, use_cache: bool = True):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.use_cache = use_cache
+
+    @classmethod
+    def from_config(cls, config=Config):
+        get = config.get if isinstance(config, dict) else lambda name, default=None: getattr(config, name, default)
+        return cls(
+            timeout=get("QUERY_TIMEOUT_SECONDS"),
+            max_rows=get("QUERY_MAX_ROWS"),
+            max_bytes=get("QUERY_MAX_BYTES")
+        )
+
+    def tightened(self, timeout: float = None, max_rows: int = None, use_cache: bool = None):
+        """
+        Returns a copy with the per-request overrides applied; they can only lower the limits.
+        """
+        def lower(current, requested):
+            if requested is None:
+                return current
+            return min(current, requested) if current else requested
+        return QueryBudget(lower(self.timeout, timeout), lower(self.max_rows, max_rows), self.max_bytes,
+                           self.use_cache if use_cache is None else use_cache)
+
+def estimate_row_size(row) -> int:
+    """Roughly estimates the in-memory/serialized size of a result row in bytes."""
+    size = 16
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value) + 2
+        else:
+            size += 8
+    return size
 
 class DatabaseAbstractionLayer(ABC):
     @abstractmethod
@@ -12,31 +67,164 @@ class SQLiteDatabase(DatabaseAbstractionLayer):
     SQLite implementation of the database abstraction layer.
     Enforces read-only mode to prevent destructive operations.
     Now returns a dictionary containing both result columns and rows.
+    Connections come from a shared per-file pool, so warm connections are reused.
+    With a result cache, complete results of read statements are reused until the data changes.
     """
-    def __init__(self, db_file: str, read_only: bool = True):
+    def __init__(self, db_file: str, read_only: bool = True, pool=None, default_budget: QueryBudget = None,
+                 result_cache=None):
         self.db_file = db_file
+        self.result_cache = result_cache
         self.read_only = read_only
+        self.default_budget = default_budget or QueryBudget.from_config()
+        self.pool = pool or get_pool(
+            db_file,
+            read_only=read_only,
+            size=Config.DB_POOL_SIZE,
+            timeout=Config.DB_POOL_TIMEOUT,
+            mmap_size=Config.DB_MMAP_SIZE,
+            cache_size=Config.DB_CACHE_SIZE,
+            wal=Config.DB_WAL
+        )
         logging.info("SQLiteDatabase initialized. DB_FILE: %s | READ_ONLY: %s", db_file, read_only)
 
-    def execute_query(self, query: str):
+    def check_read_only(self, query: str):
         if self.read_only:
             destructive_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER']
             if any(keyword in query.upper() for keyword in destructive_keywords):
                 logging.error("Attempted destructive operation in read-only mode: %s", query)
                 raise Exception("Destructive operations are not allowed in read-only mode.")
-        logging.info("Executing query: %s", query)
+
+    def execute_query(self, query: str, budget: QueryBudget = None):
+        """
+        Executes a query within a QueryBudget (the layer's default budget if none is given).
+        The result's "status" is "ok", or "truncated" when the row or byte limit cut it
+        short (with "truncated_reason" set); QueryTimeoutError is raised past the deadline.
+        """
+        self.check_read_only(query)
+        budget = budget or self.default_budget
+        cache = self.result_cache if budget.use_cache else None
+        if cache is not None and not cache.cacheable(query):
+            cache = None
+        if cache is not None:
+            # Served from an in-memory replica, results follow the replica's version.
+            version = self.pool.snapshot_version()
+            if version is None:
+                version = cache.data_version(self.db_file)
+            cached = cache.get(self.db_file, query, budget.max_rows, budget.max_bytes, version=version)
+            if cached is not None:
+                sql_log.info("Result cache hit for query: %s", truncate(query))
+                return cached
+        sql_log.info("Executing query: %s", truncate(query))
+        capture("sql", query)
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            # Extract column names from cursor.description (if available)
-            columns = [desc[0] for desc in cursor.description] if cursor.description is not None else []
-            if not self.read_only:
-                conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                deadline = self.set_deadline(conn, budget)
+                try:
+                    cursor.execute(query)
+                    # Extract column names from cursor.description (if available)
+                    columns = [desc[0] for desc in cursor.description] if cursor.description is not None else []
+                    rows, truncated_reason = self.fetch_within_budget(cursor, budget)
+                except sqlite3.OperationalError as e:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise QueryTimeoutError(f"Query exceeded the {budget.timeout}s execution deadline.") from e
+                    raise
+                finally:
+                    conn.set_progress_handler(None, 0)
+                    cursor.close()
+                if not self.read_only:
+                    conn.commit()
             logging.info("Query executed successfully. Rows returned: %s", len(rows))
-            return {"columns": columns, "rows": rows}
+            result = {"columns": columns, "rows": rows, "status": "truncated" if truncated_reason else "ok"}
+            if truncated_reason:
+                logging.warning("Query result truncated (%s) after %s rows.", truncated_reason, len(rows))
+                result["truncated_reason"] = truncated_reason
+            if cache is not None:
+                cache.put(self.db_file, query, result, version)
+            return result
         except Exception as e:
             logging.error("Error executing query: %s", e)
             raise e
+
+    @staticmethod
+    def set_deadline(conn, budget: QueryBudget):
+        """
+        Installs a progress handler that interrupts the statement once the budget's
+        timeout has passed. Returns the deadline (a time.monotonic() value) or None.
+        """
+        if not budget or not budget.timeout:
+            return None
+        deadline = time.monotonic() + budget.timeout
+        conn.set_progress_handler(lambda: 1 if time.monotonic() >= deadline else 0, PROGRESS_HANDLER_STEPS)
+        return deadline
+
+    @staticmethod
+    def fetch_within_budget(cursor, budget: QueryBudget):
+        """
+        Fetches rows until the cursor is exhausted or the row/byte limit is reached.
+        Returns the rows and the reason they were truncated ("max_rows", "max_bytes" or None).
+        """
+        max_rows = budget.max_rows if budget else None
+        max_bytes = budget.max_bytes if budget else None
+        rows = []
+        size = 0
+        while True:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                return rows, None
+            for row in batch:
+                if max_rows and len(rows) >= max_rows:
+                    return rows, "max_rows"
+                if max_bytes:
+                    size += estimate_row_size(row)
+                    if size > max_bytes:
+                        return rows, "max_bytes"
+                rows.append(row)
+
+    def iter_query(self, query: str, batch_size: int = 500, budget: QueryBudget = None):
+        """
+        Executes a query and yields its column names first, then lists of at most batch_size
+        rows fetched with fetchmany, so memory stays bounded however many rows match.
+        The budget's timeout applies to the whole stream (QueryTimeoutError is raised);
+        row and byte limits do not, since memory is bounded anyway.
+        The pooled connection is held until the generator is exhausted or closed.
+        """
+        self.check_read_only(query)
+        budget = budget or self.default_budget
+        sql_log.info("Streaming query: %s", truncate(query))
+        capture("sql", query)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            deadline = self.set_deadline(conn, budget)
+            try:
+                cursor.execute(query)
+                yield [desc[0] for desc in cursor.description] if cursor.description is not None else []
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            except sqlite3.OperationalError as e:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise QueryTimeoutError(f"Query exceeded the {budget.timeout}s execution deadline.") from e
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
+                cursor.close()
+            if not self.read_only:
+                conn.commit()
+
+    def fetch_page(self, query: str, offset: int, limit: int, budget: QueryBudget = None) -> dict:
+        """
+        Returns one page of a SELECT query's result as {"columns", "rows", "has_more"}.
+        SQLite skips the first offset rows itself; one extra row tells whether more follow.
+        """
+        statement = query.strip().rstrip(";")
+        paged = f"SELECT * FROM ({statement}) LIMIT {int(limit) + 1} OFFSET {int(offset)}"
+        result = self.execute_query(paged, budget=budget)
+        rows = result["rows"]
+        return {"columns": result["columns"], "rows": rows[:limit], "has_more": len(rows) > limit,
+                "status": result["status"]}
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
@@ -0,0 +1,136 @@
+# app/models/database_router.py
+
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from app.metrics import DATABASE_HANDLES
+from .agent_registry import AgentRegistry
+from .connection_pool import close_pools, all_pool_stats
+from .schema_cache import schema_cache
+
+# Database names map to files, so they are restricted to characters that cannot escape the directory.
+_DATABASE_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class UnknownDatabaseError(Exception):
+    """Raised for a database name that is malformed or has no file under DATABASES_DIR."""
+
+class DatabaseRegistry(AgentRegistry):
+    """
+    The components of one named database: its own schema manager (with dynamic
+    introspection), prompt builder, SQL generator, feedback module, validator, pools,
+    database layers and executors, built lazily like those of the default registry.
+    Process-wide components (the LLM backend, caches, single-flight, conversion log, async
+    runtime and default budget) come from the parent registry. Conversation context is kept
+    per database, under "<name>:<user_id>".
+    """
+    SHARED = frozenset({"nlp", "llm_backend", "translation_cache", "result_cache", "single_flight",
+                        "conversion_logger", "async_runtime", "default_budget"})
+
+    def __init__(self, parent: AgentRegistry, name: str, db_file: str):
+        config = dict(parent.config)
+        config.update(DB_FILE=db_file, USE_DYNAMIC_SCHEMA=True,
+                      DB_POOL_SIZE=parent.config.get("DATABASES_POOL_SIZE", 2))
+        super().__init__(config)
+        self.parent = parent
+        self.name = name
+        self.db_file = db_file
+
+    def _get(self, name, factory):
+        if name in self.SHARED:
+            return self.parent._get(name, factory)
+        return super()._get(name, factory)
+
+    def context_id(self, user_id: str) -> str:
+        return f"{self.name}:{user_id}"
+
+    def close(self):
+        """Closes the database's pools and drops its schema snapshot and cached results."""
+        replica_pool = self._components.get("replica_pool")
+        if replica_pool is not None:
+            replica_pool.close()
+        close_pools(self.db_file)
+        result_cache = self.parent._components.get("result_cache")
+        if result_cache:
+            result_cache.forget(self.db_file)
+        schema_cache.invalidate(self.db_file)
+
+    def stats(self) -> dict:
+        path = os.path.realpath(self.db_file)
+        replica_pool = self._components.get("replica_pool")
+        return {
+            "db_file": self.db_file,
+            "connection_pools": [stats for stats in all_pool_stats() if stats["db_file"] == path],
+            "replica": replica_pool.stats() if replica_pool is not None else None,
+        }
+
+class DatabaseRouter:
+    """
+    Routes requests to named databases: "<name>" is the file <name>.db in databases_dir.
+    Each database gets a DatabaseRegistry on first use; at most max_open are kept, and the
+    least recently used one is closed when another is opened, which bounds the open file
+    handles (pool connections) and the memory held for schemas and cached results.
+    """
+    def __init__(self, registry: AgentRegistry, databases_dir: str, max_open: int = 64):
+        self.registry = registry
+        self.databases_dir = databases_dir
+        self.max_open = max_open
+        self._open = OrderedDict()  # name -> DatabaseRegistry
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+
+    def path(self, name) -> str:
+        if not self.databases_dir:
+            raise UnknownDatabaseError("Database routing is not configured (DATABASES_DIR)")
+        if not isinstance(name, str) or not _DATABASE_NAME.fullmatch(name):
+            raise UnknownDatabaseError(f"Invalid database name: {name!r}")
+        path = os.path.join(self.databases_dir, name + ".db")
+        if not os.path.isfile(path):
+            raise UnknownDatabaseError(f"Unknown database: {name}")
+        return path
+
+    def get(self, name) -> DatabaseRegistry:
+        """Returns the registry of a named database, opening it if needed."""
+        with self._lock:
+            registry = self._open.get(name)
+            if registry is not None:
+                self._open.move_to_end(name)
+                return registry
+        path = self.path(name)
+        evicted = []
+        with self._lock:
+            registry = self._open.get(name)
+            if registry is not None:
+                self._open.move_to_end(name)
+                return registry
+            registry = self._open[name] = DatabaseRegistry(self.registry, name, path)
+            self.opened += 1
+            while len(self._open) > self.max_open:
+                evicted.append(self._open.popitem(last=False)[1])
+            self.closed += len(evicted)
+        DATABASE_HANDLES.inc(event="opened")
+        for old in evicted:
+            # Requests still using it finish normally; their connections close when returned.
+            logging.info("Closing least recently used database %s.", old.name)
+            old.close()
+            DATABASE_HANDLES.inc(event="closed")
+        return registry
+
+    def close_all(self):
+        with self._lock:
+            registries, self._open = list(self._open.values()), OrderedDict()
+        for registry in registries:
+            registry.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            registries = list(self._open.values())
+        return {
+            "open": len(registries),
+            "max_open": self.max_open,
+            "opened": self.opened,
+            "closed": self.closed,
+            "databases": {registry.name: registry.stats() for registry in registries},
+        }
@@ -1,53 +1,85 @@
 import logging
 from config import Config
+from app.timings import stage
+from app.logs import stage_logger, truncate
+
+sql_log = stage_logger("sql")
 
 class FeedbackModule:
     """
-    Uses the Gemini API (via the provided SQL generator) to refine an existing SQL query based on user feedback.
+    Uses the LLM backend of the provided SQL generator (the Gemini API by default) to refine an existing SQL query based on user feedback.
     """
     def __init__(self, schema_manager, sql_generator):
         self.schema_manager = schema_manager
         self.sql_generator = sql_generator
         logging.info("FeedbackModule initialized using Gemini for refinement.")
 
-    def refine_query(self, current_sql: str, feedback: str, context=None) -> str:
-        # Construct a prompt that includes the current SQL and the feedback.
-        if Config.EXECUTE_SQL:
-            schema = self.schema_manager.get_schema()
-            schema_lines = ["Database Schema:"]
-            for table, info in schema.items():
-                columns = info.get("columns", [])
-                schema_lines.append(f"Table '{table}': {', '.join(columns)}")
-            schema_prompt = "\n".join(schema_lines)
-        else:
-            schema_prompt = ""
-        prompt = (
-            "Never include explaination, just give me the result. The current SQL query is:\n"
-            f"{current_sql}\n\n"
-            "and the schema is:\n"
-            f"{schema_prompt}\n\n"
-            "Based on the following feedback, refine the SQL query for sqllite3:\n"
-            f"Feedback: {feedback}\n\n"
-            "Refined SQL:"
+    def refine_query(self, current_sql: str, feedback: str, context=None, validation_errors=None) -> str:
+        prompt = self.sql_generator.prompt_builder.refinement_prompt(
+            current_sql, feedback, validation_errors, context, include_schema=Config.EXECUTE_SQL
+        )
+        try:
+            # Use the LLM backend shared with the SQL generator.
+            with stage("generate"):
+                raw_refined = self.sql_generator.backend.generate(prompt)
+            return self._clean_refinement(raw_refined)
+        except Exception as e:
+            error_msg = f"Error during refinement: {e}"
+            logging.error(error_msg)
+            return error_msg
+
+    async def arefine_query(self, current_sql: str, feedback: str, context=None, validation_errors=None) -> str:
+        """
+        Async variant of refine_query, bounded by the process-wide LLM concurrency limit.
+        """
+        prompt = self.sql_generator.prompt_builder.refinement_prompt(
+            current_sql, feedback, validation_errors, context, include_schema=Config.EXECUTE_SQL
         )
-        # Optionally add any additional context (e.g., conversation history).
-        # if context:
-        #     prompt = "Context:\n" + "\n".join(context) + "\n\n" + prompt
-        logging.info("Generated refinement prompt: %s", prompt)
         try:
-            # Use the pre-initialized Gemini client from the SQL generator.
-            response = self.sql_generator.client.models.generate_content(
-                model=self.sql_generator.model,
-                contents=prompt
-            )
-            raw_refined = response.text
-            logging.info("Raw Gemini refinement output: %s", raw_refined)
-            refined_sql = self.sql_generator.clean_response(raw_refined)
-            logging.info("Cleaned refined SQL: %s", refined_sql)
-            return refined_sql
+            with stage("generate"):
+                raw_refined = await self.sql_generator.backend.agenerate(prompt)
+            return self._clean_refinement(raw_refined)
         except Exception as e:
             error_msg = f"Error during refinement: {e}"
             logging.error(error_msg)
             return error_msg
 
+    def _clean_refinement(self, raw_refined: str) -> str:
+        refined_sql = self.sql_generator.clean_response(raw_refined)
+        sql_log.info("Cleaned refined SQL: %s", truncate(refined_sql))
+        return refined_sql
 
+    def refine_query_with_verdict(self, current_sql: str, feedback: str, context=None,
+                                  validation_errors=None) -> dict:
+        """
+        Single-round-trip refinement: the refined SQL and its validity verdict come back
+        in one structured response. Returns a dictionary with "sql", "valid" and "validation".
+        """
+        prompt = self.sql_generator.prompt_builder.structured_refinement_prompt(
+            current_sql, feedback, validation_errors, context, include_schema=Config.EXECUTE_SQL
+        )
+        try:
+            with stage("generate"):
+                response_text = self.sql_generator.backend.generate(prompt, json_mode=True)
+            return self.sql_generator.parse_structured_response(response_text)
+        except Exception as e:
+            error_msg = f"Error during refinement: {e}"
+            logging.error(error_msg)
+            return {"sql": error_msg, "valid": False, "validation": error_msg}
+
+    async def arefine_query_with_verdict(self, current_sql: str, feedback: str, context=None,
+                                         validation_errors=None) -> dict:
+        """
+        Async variant of refine_query_with_verdict.
+        """
+        prompt = self.sql_generator.prompt_builder.structured_refinement_prompt(
+            current_sql, feedback, validation_errors, context, include_schema=Config.EXECUTE_SQL
+        )
+        try:
+            with stage("generate"):
+                response_text = await self.sql_generator.backend.agenerate(prompt, json_mode=True)
+            return self.sql_generator.parse_structured_response(response_text)
+        except Exception as e:
+            error_msg = f"Error during refinement: {e}"
+            logging.error(error_msg)
+            return {"sql": error_msg, "valid": False, "validation": error_msg}
@@ -0,0 +1,194 @@
+# app/models/llm_backend.py
+
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from google import genai
+from app.async_runtime import llm_limiter
+from app.metrics import LLM_CALLS
+from app.logs import capture, stage_logger, truncate
+from app.timings import current_timings
+
+prompt_log = stage_logger("prompt")
+llm_log = stage_logger("llm")
+
+class LLMBackendError(Exception):
+    """Raised by a backend when a completion fails (including injected local failures)."""
+
+class LLMBackend(ABC):
+    """
+    Interface between the pipeline and a language model. Every LLM call (generation,
+    validation, cleaning and refinement) goes through generate or agenerate, which take a
+    prompt and return the model's text; json_mode asks for a JSON object response.
+    Backends implement _generate and _agenerate; calls are counted, and prompts and raw
+    outputs logged (stage loggers "prompt" and "llm", at DEBUG) and captured, here.
+    """
+    model = None
+
+    @abstractmethod
+    def _generate(self, prompt: str, json_mode: bool = False) -> str:
+        pass
+
+    @abstractmethod
+    async def _agenerate(self, prompt: str, json_mode: bool = False) -> str:
+        pass
+
+    def _count_call(self, prompt: str):
+        LLM_CALLS.inc(backend=type(self).__name__)
+        timings = current_timings()
+        if timings is not None:
+            timings.count_llm_call()
+        prompt_log.debug("Prompt for %s: %s", type(self).__name__, truncate(prompt))
+        capture("prompt", prompt)
+
+    def _record_output(self, output: str) -> str:
+        llm_log.debug("Raw %s output: %s", type(self).__name__, truncate(output))
+        capture("llm_output", output)
+        return output
+
+    def generate(self, prompt: str, json_mode: bool = False) -> str:
+        self._count_call(prompt)
+        return self._record_output(self._generate(prompt, json_mode))
+
+    async def agenerate(self, prompt: str, json_mode: bool = False) -> str:
+        """Async completion, bounded by the process-wide LLM concurrency limit."""
+        self._count_call(prompt)
+        async with llm_limiter:
+            return self._record_output(await self._agenerate(prompt, json_mode))
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "model": self.model}
+
+class GeminiBackend(LLMBackend):
+    """
+    Calls the Gemini API through Google's Generative AI Python client.
+    """
+    def __init__(self, api_key: str, model: str = None):
+        self.client = genai.Client(api_key=api_key)
+        self.model = model or "gemini-2.0-flash"
+        logging.info("Initialized Gemini API client with model: %s", self.model)
+
+    def _generate(self, prompt: str, json_mode: bool = False) -> str:
+        config = {"response_mime_type": "application/json"} if json_mode else None
+        return self.client.models.generate_content(model=self.model, contents=prompt, config=config).text
+
+    async def _agenerate(self, prompt: str, json_mode: bool = False) -> str:
+        config = {"response_mime_type": "application/json"} if json_mode else None
+        response = await self.client.aio.models.generate_content(model=self.model, contents=prompt, config=config)
+        return response.text
+
+_SCHEMA_TABLE = re.compile(r"^Table '([^']+)':", re.MULTILINE)
+_QUESTION = re.compile(r"Convert the following natural language query into SQL for sqllite3[^:]*:\n(.*?)\n", re.DOTALL)
+_CURRENT_SQL = re.compile(r"The current SQL query is:\n(.*?)\n\n", re.DOTALL)
+_VALIDATED_SQL = re.compile(r"Given the SQL query:\n(.*?)\n\nIs this query valid", re.DOTALL)
+_CLEAN_PREFIX = "return only the cleaned SQL:\n"
+
+class LocalBackend(LLMBackend):
+    """
+    Deterministic offline backend for load testing and profiling without the network.
+    Prompts containing a canned response's "contains" text get that response; any other
+    prompt gets a rule-based answer (a SELECT over the table the question mentions, "yes"
+    for validation, the unchanged SQL for cleaning and refinement). Each call can be delayed
+    by latency seconds plus up to latency_jitter more, and fails with probability error_rate.
+    """
+    def __init__(self, model: str = "local", responses: list = None, latency: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        self.model = model
+        self.responses = responses or []
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        logging.info("Initialized local LLM backend. canned=%s latency=%ss error_rate=%s",
+                     len(self.responses), latency, error_rate)
+
+    @classmethod
+    def from_file(cls, path: str, **settings):
+        """Loads canned responses from a JSON list of {"contains", "response"} objects."""
+        with open(path) as f:
+            return cls(responses=json.load(f), **settings)
+
+    def _next_call(self) -> float:
+        """Counts the call, injects a failure if due, and returns the delay to apply."""
+        with self._lock:
+            self.calls += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if failed:
+            raise LLMBackendError("Injected local backend error")
+        return delay
+
+    def _generate(self, prompt: str, json_mode: bool = False) -> str:
+        delay = self._next_call()
+        if delay:
+            time.sleep(delay)
+        return self.respond(prompt, json_mode)
+
+    async def _agenerate(self, prompt: str, json_mode: bool = False) -> str:
+        delay = self._next_call()
+        if delay:
+            await asyncio.sleep(delay)
+        return self.respond(prompt, json_mode)
+
+    def respond(self, prompt: str, json_mode: bool = False) -> str:
+        for canned in self.responses:
+            if canned["contains"] in prompt:
+                return canned["response"]
+        if _CLEAN_PREFIX in prompt:
+            return prompt.split(_CLEAN_PREFIX, 1)[1]
+        match = _VALIDATED_SQL.search(prompt)
+        if match:
+            return "yes"
+        match = _CURRENT_SQL.search(prompt)
+        if match:
+            sql_query = match.group(1)
+        else:
+            match = _QUESTION.search(prompt)
+            sql_query = self.rule_based_sql(match.group(1) if match else "", _SCHEMA_TABLE.findall(prompt))
+        if json_mode:
+            return json.dumps({"sql": sql_query, "valid": True, "explanation": ""})
+        return sql_query
+
+    @staticmethod
+    def rule_based_sql(question: str, tables: list) -> str:
+        words = set(re.findall(r"\w+", question.lower()))
+        table = next((t for t in tables if t.lower() in words or t.lower() + "s" in words), None)
+        if table is None:
+            if not tables:
+                return "SELECT 1"
+            table = tables[0]
+        if words & {"count", "many", "number"}:
+            return f"SELECT COUNT(*) FROM {table}"
+        return f"SELECT * FROM {table}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(super().stats(), calls=self.calls, errors=self.errors)
+
+def create_llm_backend(config) -> LLMBackend:
+    """
+    Builds the backend selected by LLM_BACKEND ("gemini" or "local") from a config class
+    or mapping.
+    """
+    get = config.get if isinstance(config, dict) else lambda name, default=None: getattr(config, name, default)
+    if get("LLM_BACKEND", "gemini") != "local":
+        return GeminiBackend(api_key=get("GEMINI_API_KEY"), model=get("GEMINI_MODEL"))
+    settings = {
+        "latency": get("LOCAL_LLM_LATENCY", 0.0),
+        "latency_jitter": get("LOCAL_LLM_LATENCY_JITTER", 0.0),
+        "error_rate": get("LOCAL_LLM_ERROR_RATE", 0.0),
+        "seed": get("LOCAL_LLM_SEED"),
+    }
+    if get("LOCAL_LLM_RESPONSES"):
+        return LocalBackend.from_file(get("LOCAL_LLM_RESPONSES"), **settings)
+    return LocalBackend(**settings)
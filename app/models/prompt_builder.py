@@ -0,0 +1,242 @@
+# app/models/prompt_builder.py
+
+import logging
+import threading
+from collections import OrderedDict
+from app.metrics import PROMPT_TOKENS
+from app.timings import current_timings
+from .schema_cache import render_schema_prompt
+from .sql_validator import format_validation_errors
+
+# Response format shared by the single-round-trip generation and refinement prompts.
+STRUCTURED_RESPONSE_INSTRUCTIONS = (
+    "Respond only with a JSON object with the keys \"sql\" (the SQL statement only), "
+    "\"valid\" (true if the statement is valid according to the schema, otherwise false) and "
+    "\"explanation\" (empty if valid, otherwise a brief explanation and a prompt to help the user fix it)."
+)
+
+GENERATION_TEMPLATE = (
+    "{history}{schema}\n\n"
+    "Convert the following natural language query into SQL for sqllite3:\n"
+    "{question}\n"
+    "SQL:"
+)
+STRUCTURED_GENERATION_TEMPLATE = (
+    "{history}{schema}\n\n"
+    "Convert the following natural language query into SQL for sqllite3 and check it against the above schema:\n"
+    "{question}\n\n"
+    "{instructions}"
+)
+REFINEMENT_TEMPLATE = (
+    "{history}Never include explaination, just give me the result. The current SQL query is:\n"
+    "{current_sql}\n\n"
+    "and the schema is:\n"
+    "{schema}\n\n"
+    "{errors}"
+    "Based on the following feedback, refine the SQL query for sqllite3:\n"
+    "Feedback: {feedback}\n\n"
+    "Refined SQL:"
+)
+STRUCTURED_REFINEMENT_TEMPLATE = (
+    "{history}The current SQL query is:\n"
+    "{current_sql}\n\n"
+    "and the schema is:\n"
+    "{schema}\n\n"
+    "{errors}"
+    "Based on the following feedback, refine the SQL query for sqllite3 and check it against the schema:\n"
+    "Feedback: {feedback}\n\n"
+    "{instructions}"
+)
+VALIDATION_TEMPLATE = (
+    "{schema}\n\n"
+    "Given the SQL query:\n{sql}\n\n"
+    "Is this query valid according to the above schema? "
+    "If valid, reply only with 'yes'. If invalid, provide a brief explanation and a prompt to help the user fix it."
+)
+CLEAN_TEMPLATE = (
+    "Return only the SQL statement! Please validate and clean / fix the following SQL query "
+    "and return only the cleaned SQL:\n{sql}"
+)
+
+# tiktoken encodings by name; False where an encoding is unavailable.
+_encodings = {}
+_encoding_lock = threading.Lock()
+
+def _get_encoding(name: str):
+    encoding = _encodings.get(name)
+    if encoding is None:
+        with _encoding_lock:
+            encoding = _encodings.get(name)
+            if encoding is None:
+                try:
+                    import tiktoken
+                    encoding = tiktoken.get_encoding(name)
+                except Exception as e:
+                    # tiktoken downloads its encodings on first use; offline, estimate instead.
+                    logging.warning("tiktoken encoding %s unavailable (%s); estimating tokens as chars/4.", name, e)
+                    encoding = False
+                _encodings[name] = encoding
+    return encoding
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    encoding = _get_encoding(encoding_name)
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def validation_errors_prompt(validation_errors) -> str:
+    """
+    Describes the local validator's errors for the current SQL, so the refinement fixes them.
+    """
+    if not validation_errors:
+        return ""
+    return f"The current SQL query has these problems:\n{format_validation_errors(validation_errors)}\n\n"
+
+class PromptBuilder:
+    """
+    Builds every LLM prompt (generation, refinement, validation and cleaning) in one place.
+    Schema blocks are rendered once per schema version and table selection and memoized
+    with their token counts. With a token budget, the conversation history is trimmed
+    first (oldest turns go first) and then the schema detail (least relevant tables go
+    first); the instructions, question and SQL are never cut. Each prompt's token count
+    is logged, recorded in /metrics and added to the request's debug timings.
+    """
+    def __init__(self, schema_manager, token_budget: int = 0, history_turns: int = 0,
+                 encoding_name: str = "cl100k_base", memo_size: int = 256):
+        self.schema_manager = schema_manager
+        self.token_budget = token_budget
+        self.history_turns = history_turns
+        self.encoding_name = encoding_name
+        self.memo_size = memo_size
+        self._blocks = OrderedDict()
+        self._table_tokens = {}
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text, self.encoding_name)
+
+    def _memoized_block(self, fingerprint: str, tables, render):
+        """Returns (block, tokens) for a schema version and table selection, rendering it once."""
+        key = (fingerprint, tuple(tables) if tables is not None else None)
+        with self._lock:
+            entry = self._blocks.get(key)
+            if entry is not None:
+                self._blocks.move_to_end(key)
+                return entry
+        block = render()
+        entry = (block, self.count_tokens(block))
+        with self._lock:
+            self._blocks[key] = entry
+            if len(self._blocks) > self.memo_size:
+                self._blocks.popitem(last=False)
+        return entry
+
+    def schema_block(self, subject: str = None, budget: int = None) -> str:
+        """
+        The "Database Schema:" block for a prompt about the subject (pruned to the relevant
+        tables on large schemas, see SchemaManager), cut down to fit the budget if given.
+        """
+        return self._schema_entry(subject, budget)[0]
+
+    def _schema_entry(self, subject: str = None, budget: int = None):
+        """schema_block with its (memoized) token count."""
+        snapshot = self.schema_manager.get_snapshot()
+        tables = self.schema_manager.select_tables(subject)
+        block, tokens = self._memoized_block(
+            snapshot.fingerprint, tables,
+            lambda: snapshot.schema_prompt if tables is None else render_schema_prompt(snapshot.schema_info, tables)
+        )
+        if budget is None or tokens <= budget:
+            return block, tokens
+        # Keep the most relevant tables that fit; ties keep schema order.
+        scores = snapshot.retriever.score(subject or "")
+        candidates = tables if tables is not None else snapshot.table_names
+        ranked = sorted(candidates, key=lambda table: -scores.get(table, 0.0))
+        table_tokens = self._table_token_counts(snapshot)
+        used = self.count_tokens("Database Schema:")
+        selected = []
+        for table in ranked:
+            if used + table_tokens[table] > budget:
+                continue
+            selected.append(table)
+            used += table_tokens[table]
+        logging.info("Schema block trimmed to %s of %s tables to fit %s tokens.", len(selected), len(candidates), budget)
+        selected = set(selected)
+        kept = [table for table in snapshot.table_names if table in selected]
+        return self._memoized_block(snapshot.fingerprint, kept, lambda: render_schema_prompt(snapshot.schema_info, kept))
+
+    def _table_token_counts(self, snapshot) -> dict:
+        counts = self._table_tokens.get(snapshot.fingerprint)
+        if counts is None:
+            counts = {table: self.count_tokens("\n" + render_schema_prompt({table: info}).split("\n", 1)[1])
+                      for table, info in snapshot.schema_info.items()}
+            self._table_tokens = {snapshot.fingerprint: counts}
+        return counts
+
+    def history_block(self, context=None, budget: int = None) -> str:
+        """The last history_turns conversation turns, dropping the oldest to fit the budget."""
+        return self._history_entry(context, budget)[0]
+
+    def _history_entry(self, context=None, budget: int = None):
+        """history_block with its token count."""
+        if not self.history_turns or not context:
+            return "", 0
+        turns = [f"User: {turn.get('user')}\nSQL: {turn.get('system')}\n" for turn in context[-self.history_turns:]]
+        while turns:
+            block = "Conversation so far:\n" + "".join(turns) + "\n"
+            tokens = self.count_tokens(block)
+            if budget is None or tokens <= budget:
+                return block, tokens
+            turns.pop(0)
+        return "", 0
+
+    def build(self, kind: str, template: str, subject: str = None, context=None, include_schema: bool = True,
+              **fields) -> str:
+        fixed_tokens = self.count_tokens(template.format(history="", schema="", **fields))
+        budget = max(self.token_budget - fixed_tokens, 0) if self.token_budget else None
+        schema, schema_tokens = self._schema_entry(subject, budget) if include_schema else ("", 0)
+        if budget is not None:
+            budget = max(budget - schema_tokens, 0)
+        history, history_tokens = self._history_entry(context, budget)
+        prompt = template.format(history=history, schema=schema, **fields)
+        # Every part is already counted (the schema block once per version), so the whole
+        # prompt is not tokenized again.
+        self.report(kind, fixed_tokens + schema_tokens + history_tokens)
+        return prompt
+
+    def report(self, kind: str, tokens: int):
+        logging.info("Built %s prompt: %s tokens.", kind, tokens)
+        PROMPT_TOKENS.observe(tokens, kind=kind)
+        timings = current_timings()
+        if timings is not None:
+            timings.add_prompt_tokens(kind, tokens)
+
+    def generation_prompt(self, question: str, context=None, include_schema: bool = True) -> str:
+        return self.build("generate", GENERATION_TEMPLATE, question, context, include_schema, question=question)
+
+    def structured_generation_prompt(self, question: str, context=None, include_schema: bool = True) -> str:
+        return self.build("generate", STRUCTURED_GENERATION_TEMPLATE, question, context, include_schema,
+                          question=question, instructions=STRUCTURED_RESPONSE_INSTRUCTIONS)
+
+    def refinement_prompt(self, current_sql: str, feedback: str, validation_errors=None, context=None,
+                          include_schema: bool = True) -> str:
+        return self.build("refine", REFINEMENT_TEMPLATE, f"{current_sql} {feedback}", context, include_schema,
+                          current_sql=current_sql, feedback=feedback,
+                          errors=validation_errors_prompt(validation_errors))
+
+    def structured_refinement_prompt(self, current_sql: str, feedback: str, validation_errors=None, context=None,
+                                     include_schema: bool = True) -> str:
+        return self.build("refine", STRUCTURED_REFINEMENT_TEMPLATE, f"{current_sql} {feedback}", context,
+                          include_schema, current_sql=current_sql, feedback=feedback,
+                          errors=validation_errors_prompt(validation_errors),
+                          instructions=STRUCTURED_RESPONSE_INSTRUCTIONS)
+
+    def validation_prompt(self, sql_query: str) -> str:
+        return self.build("validate", VALIDATION_TEMPLATE, sql_query, sql=sql_query)
+
+    def clean_prompt(self, sql_query: str) -> str:
+        return self.build("clean", CLEAN_TEMPLATE, include_schema=False, sql=sql_query)
+
+    def history_key(self, context=None) -> str:
+        """The history a generation prompt would include (untrimmed), for translation cache keys."""
+        return self.history_block(context)
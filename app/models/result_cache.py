@@ -0,0 +1,152 @@
+# app/models/result_cache.py
+
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
+from app.metrics import RESULT_CACHE
+from .database import estimate_row_size
+
+# Results of statements calling these can change without the data changing.
+_NONDETERMINISTIC = re.compile(
+    r"\b(random|randomblob|changes|last_insert_rowid|total_changes|date|time|datetime|julianday|unixepoch|"
+    r"strftime|current_date|current_time|current_timestamp)\b",
+    re.IGNORECASE
+)
+_LITERAL_OR_SPACE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+def canonicalize_sql(sql: str) -> str:
+    """Collapses whitespace outside string literals and quoted identifiers and drops a trailing ';'."""
+    canonical = _LITERAL_OR_SPACE.sub(lambda m: " " if m.group().isspace() else m.group(), sql.strip())
+    return canonical.rstrip("; ")
+
+def is_cacheable(sql: str) -> bool:
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return head in ("SELECT", "WITH", "VALUES") and not _NONDETERMINISTIC.search(sql)
+
+def result_size(result: dict) -> int:
+    return 64 + sum(len(column) for column in result["columns"]) + sum(estimate_row_size(row) for row in result["rows"])
+
+class ResultCache:
+    """
+    Caches complete results of read statements, keyed by database file and canonical SQL.
+    Every entry remembers the database's PRAGMA data_version when it was stored; the
+    version is read on a dedicated connection per file, whose data_version changes whenever
+    any other connection (in this or another process) commits, so an entry is only served
+    while the data is unchanged. Entries are evicted least recently used first once their
+    estimated size passes max_bytes; results larger than max_entry_bytes, truncated results
+    and statements using non-deterministic functions are not cached.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()  # (db_file, sql) -> (data_version, size, result)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._watchers = {}  # db_file -> (connection, lock)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        logging.info("ResultCache initialized. max_bytes=%s max_entry_bytes=%s", max_bytes, max_entry_bytes)
+
+    def cacheable(self, sql: str) -> bool:
+        return is_cacheable(sql)
+
+    def data_version(self, db_file: str):
+        """The database's current data version, or None if it cannot be read."""
+        with self._lock:
+            watcher = self._watchers.get(db_file)
+            if watcher is None:
+                try:
+                    uri = "file:" + pathname2url(db_file) + "?mode=ro"
+                    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                except sqlite3.Error as e:
+                    logging.error("Cannot watch %s for data changes: %s", db_file, e)
+                    return None
+                watcher = self._watchers[db_file] = (conn, threading.Lock())
+        conn, lock = watcher
+        try:
+            with lock:
+                return conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error("Error reading data_version of %s: %s", db_file, e)
+            return None
+
+    def get(self, db_file: str, sql: str, max_rows: int = None, max_bytes: int = None, version=None):
+        """
+        Returns a copy of the cached result, or None. A result with more rows or bytes than
+        the request's limits is not served, so the query runs again and is truncated.
+        version is the data version the caller's queries see, if not the file's own.
+        """
+        key = (db_file, canonicalize_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            RESULT_CACHE.inc(result="miss")
+            return None
+        stored_version, size, result = entry
+        if version is None:
+            version = self.data_version(db_file)
+        if stored_version != version:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self._bytes -= size
+                self.invalidations += 1
+            RESULT_CACHE.inc(result="stale")
+            return None
+        if (max_rows and len(result["rows"]) > max_rows) or (max_bytes and size > max_bytes):
+            RESULT_CACHE.inc(result="over_budget")
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        RESULT_CACHE.inc(result="hit")
+        return dict(result, rows=list(result["rows"]))
+
+    def put(self, db_file: str, sql: str, result: dict, version):
+        """
+        Stores a result under the data version read before the query ran, so a commit racing
+        with the query leaves the entry stale rather than serving it.
+        """
+        if version is None or result.get("status") != "ok":
+            return
+        size = result_size(result)
+        if size > self.max_entry_bytes:
+            return
+        key = (db_file, canonicalize_sql(sql))
+        entry = (version, size, {"columns": list(result["columns"]), "rows": list(result["rows"]), "status": "ok"})
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def forget(self, db_file: str):
+        """Drops a database's entries and closes its watcher connection (e.g. when it is closed)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == db_file]:
+                self._bytes -= self._entries.pop(key)[1]
+            watcher = self._watchers.pop(db_file, None)
+        if watcher is not None:
+            with watcher[1]:
+                watcher[0].close()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
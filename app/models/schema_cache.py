@@ -0,0 +1,171 @@
+# app/models/schema_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from config import Config
+from .schema_retriever import SchemaRetriever
+from .term_index import TermIndex
+
+def introspect_schema(conn) -> dict:
+    """
+    Reads every table, its columns/types and its foreign keys from an open SQLite connection.
+    Each foreign key is {"column", "table", "to"}: the local column and the referenced table/column.
+    """
+    schema_info = {}
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    tables = [row[0] for row in cursor.fetchall()]
+    logging.info("Found tables: %s", tables)
+    for table in tables:
+        cursor.execute('PRAGMA table_info("%s");' % table.replace('"', '""'))
+        info = cursor.fetchall()  # Each row: (cid, name, type, notnull, dflt_value, pk)
+        columns = [row[1] for row in info]
+        types = [row[2] for row in info]
+        cursor.execute('PRAGMA foreign_key_list("%s");' % table.replace('"', '""'))
+        # Each row: (id, seq, table, from, to, on_update, on_delete, match)
+        foreign_keys = [{"column": row[3], "table": row[2], "to": row[4]} for row in cursor.fetchall()]
+        schema_info[table] = {"columns": columns, "types": types, "foreign_keys": foreign_keys}
+        logging.debug("Table %s: columns %s", table, columns)
+    return schema_info
+
+def column_affinity(declared_type: str):
+    """
+    SQLite's type affinity for a declared column type ("integer", "text", "blob", "real"
+    or "numeric"), following the rules of https://sqlite.org/datatype3.html; None if undeclared.
+    """
+    declared = (declared_type or "").upper()
+    if not declared:
+        return None
+    if "INT" in declared:
+        return "integer"
+    if "CHAR" in declared or "CLOB" in declared or "TEXT" in declared:
+        return "text"
+    if "BLOB" in declared:
+        return "blob"
+    if "REAL" in declared or "FLOA" in declared or "DOUB" in declared:
+        return "real"
+    return "numeric"
+
+def render_schema_prompt(schema_info: dict, tables: list = None) -> str:
+    """
+    Renders the "Database Schema:" block used in the Gemini prompts, for all tables or
+    only the given ones.
+    """
+    schema_lines = ["Database Schema:"]
+    if tables is not None:
+        tables = set(tables)
+    for table, info in schema_info.items():
+        if tables is not None and table not in tables:
+            continue
+        columns = info.get("columns", [])
+        schema_lines.append(f"Table '{table}': {', '.join(columns)}")
+    return "\n".join(schema_lines)
+
+class SchemaSnapshot:
+    """
+    An immutable view of a schema together with its precomputed derived forms:
+    the table name lists used for fuzzy matching, the rendered prompt block and
+    a fingerprint that changes whenever the tables, columns or types change.
+    The schema retriever, the term index and the column type map are built on first use.
+    """
+    def __init__(self, schema_info: dict, version: int = None):
+        self.schema_info = schema_info
+        self.version = version
+        self.table_names = list(schema_info.keys())
+        self.table_names_lower = [t.lower() for t in self.table_names]
+        self.schema_prompt = render_schema_prompt(schema_info)
+        encoded = json.dumps(schema_info, sort_keys=True).encode("utf-8")
+        self.fingerprint = hashlib.sha1(encoded).hexdigest()[:16]
+        self._retriever = None
+        self._term_index = None
+        self._column_types = None
+
+    @property
+    def retriever(self) -> SchemaRetriever:
+        # Two threads may both build it on first use; either result is equivalent.
+        if self._retriever is None:
+            self._retriever = SchemaRetriever(self.schema_info)
+        return self._retriever
+
+    @property
+    def term_index(self) -> TermIndex:
+        if self._term_index is None:
+            self._term_index = TermIndex(self.schema_info, Config.SCHEMA_SYNONYMS)
+        return self._term_index
+
+    @property
+    def column_types(self) -> dict:
+        """Lower-cased column name -> affinity of its declared type; None where tables disagree."""
+        if self._column_types is None:
+            column_types = {}
+            for info in self.schema_info.values():
+                for column, declared in zip(info.get("columns", []), info.get("types", [])):
+                    affinity = column_affinity(declared)
+                    name = column.lower()
+                    column_types[name] = affinity if column_types.get(name, affinity) == affinity else None
+            self._column_types = column_types
+        return self._column_types
+
+class SchemaCache:
+    """
+    Caches schema snapshots per database file.
+    Each lookup first compares the file's stat signature (inode, size, mtime, plus the
+    WAL file if present); only when that changed is PRAGMA schema_version read, and the
+    tables are re-introspected only when the schema version itself moved.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_token(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        token = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        try:
+            wal = os.stat(path + "-wal")
+            token += (wal.st_size, wal.st_mtime_ns)
+        except OSError:
+            pass
+        return token
+
+    def get(self, db_file: str) -> SchemaSnapshot:
+        path = os.path.realpath(db_file)
+        entry = self._entries.get(path)
+        token = self._stat_token(path)
+        if entry is not None and token is not None and entry[0] == token:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(path)
+            token = self._stat_token(path)
+            if entry is not None and token is not None and entry[0] == token:
+                return entry[1]
+            conn = sqlite3.connect(path)
+            try:
+                version = conn.execute("PRAGMA schema_version;").fetchone()[0]
+                if entry is not None and entry[1].version == version:
+                    snapshot = entry[1]
+                else:
+                    logging.info("Fetching schema from database: %s (schema_version %s)", path, version)
+                    snapshot = SchemaSnapshot(introspect_schema(conn), version=version)
+            finally:
+                conn.close()
+            # The token taken before reading is stored, so a change made meanwhile is seen next time.
+            self._entries[path] = (token, snapshot)
+            return snapshot
+
+    def invalidate(self, db_file: str = None):
+        with self._lock:
+            if db_file is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.realpath(db_file), None)
+
+# Shared by all SchemaManager instances of the process.
+schema_cache = SchemaCache()
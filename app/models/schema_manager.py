@@ -3,50 +3,108 @@
 from difflib import get_close_matches
 import sqlite3
 import logging
+from config import Config
+from app.metrics import SCHEMA_RETRIEVAL
+from app.timings import stage
+from .schema_cache import SchemaSnapshot, introspect_schema, render_schema_prompt, schema_cache as default_schema_cache
 
 class SchemaManager:
     """
     Provides schema information and supports fuzzy matching.
-    If dynamic introspection is enabled, fetches the schema from the database.
+    If dynamic introspection is enabled, fetches the schema from the database through
+    the process-wide SchemaCache, which re-introspects only when the schema changed.
     """
-    def __init__(self, schema_info: dict = None, db_file: str = None, use_dynamic_schema: bool = False):
+    def __init__(self, schema_info: dict = None, db_file: str = None, use_dynamic_schema: bool = False,
+                 schema_cache=None):
+        self.db_file = db_file
+        self.use_dynamic_schema = use_dynamic_schema
         if use_dynamic_schema:
             if not db_file:
                 raise ValueError("db_file is required for dynamic schema introspection")
             logging.info("Using dynamic schema introspection from DB file: %s", db_file)
-            self.schema_info = self.fetch_schema(db_file)
+            self.schema_cache = schema_cache or default_schema_cache
+            self._snapshot = self.schema_cache.get(db_file)
         else:
-            self.schema_info = schema_info or {}
+            self.schema_cache = None
+            self._snapshot = SchemaSnapshot(schema_info or {})
             logging.info("Using static schema information.")
-        logging.debug("SchemaManager initialized with schema: %s", self.schema_info)
+        logging.debug("SchemaManager initialized with schema: %s", self._snapshot.schema_info)
+
+    @property
+    def schema_info(self) -> dict:
+        return self.get_schema()
 
     def fetch_schema(self, db_file: str) -> dict:
-        schema_info = {}
         logging.info("Fetching schema from database: %s", db_file)
         conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall()]
-        logging.info("Found tables: %s", tables)
-        for table in tables:
-            cursor.execute(f"PRAGMA table_info({table});")
-            info = cursor.fetchall()  # Each row: (cid, name, type, notnull, dflt_value, pk)
-            columns = [row[1] for row in info]
-            types = [row[2] for row in info]
-            schema_info[table] = {"columns": columns, "types": types}
-            logging.info("Table %s: columns %s", table, columns)
-        conn.close()
-        return schema_info
+        try:
+            return introspect_schema(conn)
+        finally:
+            conn.close()
+
+    def get_snapshot(self) -> SchemaSnapshot:
+        """
+        Returns the current schema snapshot, revalidating it against the database
+        file when dynamic introspection is enabled.
+        """
+        if self.use_dynamic_schema:
+            self._snapshot = self.schema_cache.get(self.db_file)
+        return self._snapshot
 
     def get_schema(self) -> dict:
-        return self.schema_info
-
-    def correct_term(self, term: str, schema_terms: list) -> str:
-        matches = get_close_matches(term.lower(), [s.lower() for s in schema_terms], n=1, cutoff=0.8)
-        if matches:
-            for s in schema_terms:
-                if s.lower() == matches[0]:
-                    logging.info("Corrected term '%s' to '%s'", term, s)
-                    return s
+        return self.get_snapshot().schema_info
+
+    def select_tables(self, question: str = None):
+        """
+        Returns the tables a prompt about the question (or SQL) should describe: on large
+        schemas, the relevant tables and their foreign-key neighbours. Returns None (the full
+        schema) for small schemas and low-confidence matches.
+        """
+        snapshot = self.get_snapshot()
+        if not question or not Config.SCHEMA_RETRIEVAL or len(snapshot.table_names) <= Config.SCHEMA_RETRIEVAL_MIN_TABLES:
+            return None
+        with stage("schema_retrieval"):
+            tables = snapshot.retriever.select(question, Config.SCHEMA_RETRIEVAL_TOP_K, Config.SCHEMA_RETRIEVAL_MIN_SCORE)
+        if tables is None:
+            logging.info("Schema retrieval confidence too low; using the full schema.")
+            SCHEMA_RETRIEVAL.inc(result="full")
+            return None
+        logging.info("Schema retrieval selected %s of %s tables: %s", len(tables), len(snapshot.table_names), tables)
+        SCHEMA_RETRIEVAL.inc(result="pruned")
+        return tables
+
+    def get_schema_prompt(self, question: str = None) -> str:
+        """
+        Returns the schema block for a prompt about the question (see select_tables).
+        """
+        tables = self.select_tables(question)
+        if tables is None:
+            return self.get_snapshot().schema_prompt
+        return render_schema_prompt(self.get_snapshot().schema_info, tables)
+
+    def get_table_names_lower(self) -> list:
+        return self.get_snapshot().table_names_lower
+
+    def get_fingerprint(self) -> str:
+        return self.get_snapshot().fingerprint
+
+    def get_column_types(self) -> dict:
+        return self.get_snapshot().column_types
+
+    def correct_term(self, term: str, schema_terms: list = None, kind: str = "table") -> str:
+        """
+        Returns the table (or, with kind="column", column) name closest to the term, using the
+        snapshot's trigram index, or the closest of the given schema_terms. Returns the term
+        unchanged when nothing is close enough.
+        """
+        if schema_terms is None:
+            s = self.get_snapshot().term_index.correct(term, kind)
+        else:
+            lowered = [s.lower() for s in schema_terms]
+            matches = get_close_matches(term.lower(), lowered, n=1, cutoff=0.8)
+            s = schema_terms[lowered.index(matches[0])] if matches else None
+        if s is not None:
+            logging.info("Corrected term '%s' to '%s'", term, s)
+            return s
         logging.info("No correction found for term '%s'", term)
         return term
@@ -0,0 +1,88 @@
+# app/models/schema_retriever.py
+
+import math
+import re
+
+TABLE_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.0
+STOPWORDS = {
+    "a", "all", "an", "and", "are", "by", "each", "every", "for", "from", "get", "give", "how", "in",
+    "is", "list", "many", "me", "of", "on", "or", "per", "select", "show", "that", "the", "their",
+    "to", "what", "where", "which", "who", "with",
+}
+
+def tokenize(text: str) -> list:
+    """
+    Splits text or identifiers into lowercase, singularized tokens:
+    "OrderItems", "order_items" and "order items" all give ["order", "item"].
+    """
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9]+", text):
+        word = word.lower()
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+class SchemaRetriever:
+    """
+    Selects the tables relevant to a question from a large schema, so prompts only carry those.
+    An inverted index maps every table and column name token to the tables containing it;
+    a question's tokens score each table by IDF (table-name hits weigh more than column
+    hits), and the foreign-key neighbours of the best tables are added so joins stay possible.
+    Built once per schema snapshot.
+    """
+    def __init__(self, schema_info: dict):
+        self.tables = list(schema_info)
+        postings = {}
+        for table, info in schema_info.items():
+            for token in tokenize(table):
+                postings.setdefault(token, {})[table] = TABLE_WEIGHT
+            for column in info.get("columns", []):
+                for token in tokenize(column):
+                    weights = postings.setdefault(token, {})
+                    weights[table] = max(weights.get(table, 0.0), COLUMN_WEIGHT)
+        count = len(self.tables)
+        # token -> (idf, {table: weight})
+        self.index = {token: (math.log(1 + count / len(weights)), weights) for token, weights in postings.items()}
+        self.neighbours = {table: set() for table in self.tables}
+        for table, info in schema_info.items():
+            for fk in info.get("foreign_keys", []):
+                if fk["table"] in self.neighbours and fk["table"] != table:
+                    self.neighbours[table].add(fk["table"])
+                    self.neighbours[fk["table"]].add(table)
+
+    def score(self, question: str) -> dict:
+        scores = {}
+        for token in set(tokenize(question)) - STOPWORDS:
+            entry = self.index.get(token)
+            if entry is None:
+                continue
+            idf, weights = entry
+            for table, weight in weights.items():
+                scores[table] = scores.get(table, 0.0) + idf * weight
+        return scores
+
+    def select(self, question: str, top_k: int, min_score: float, max_neighbours: int = None):
+        """
+        Returns the relevant tables in schema order, or None when no table scores at least
+        min_score (low confidence), in which case the caller should use the full schema.
+        At most top_k scored tables are taken, plus up to max_neighbours (default top_k)
+        foreign-key neighbours.
+        """
+        scores = self.score(question)
+        ranked = sorted(scores, key=lambda table: -scores[table])[:top_k]
+        if not ranked or scores[ranked[0]] < min_score:
+            return None
+        selected = set(ranked)
+        budget = top_k if max_neighbours is None else max_neighbours
+        for table in ranked:
+            for neighbour in sorted(self.neighbours[table] - selected, key=lambda t: -scores.get(t, 0.0)):
+                if budget <= 0:
+                    break
+                selected.add(neighbour)
+                budget -= 1
+        return [table for table in self.tables if table in selected]
@@ -0,0 +1,209 @@
+# app/models/single_flight.py
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+import weakref
+from app.async_runtime import run_blocking
+from app.metrics import SINGLE_FLIGHT
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the leader) runs the
+    function and every caller arriving while it runs waits for and shares its result.
+    Calls are coalesced across the threads of this process and, separately, across the
+    coroutines of each event loop. With a Redis client, workers also coordinate: the leader
+    holds a lease (SET NX with an expiry) and publishes its result for lease_seconds; other
+    workers poll for it, and run the function themselves if the lease holder gives up or
+    wait_seconds pass. Followers in this process likewise wait at most wait_seconds for a
+    hung leader before running the function themselves. Results must be JSON-serializable
+    dictionaries.
+    """
+    def __init__(self, redis_client=None, lease_seconds: float = 30, wait_seconds: float = 30,
+                 poll_interval: float = 0.05, key_prefix: str = "text2sql:flight:"):
+        self.redis_client = redis_client
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self.key_prefix = key_prefix
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._async_calls = weakref.WeakKeyDictionary()  # loop -> {key: future}
+
+    def do(self, key: str, fn) -> dict:
+        """Runs fn() once per key among concurrent callers and returns (a copy of) its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(self.wait_seconds):
+                logging.warning("Single-flight leader for %s still running after %ss; running it here.",
+                                key, self.wait_seconds)
+                SINGLE_FLIGHT.inc(role="timeout")
+                return fn()
+            SINGLE_FLIGHT.inc(role="follower")
+            if call.error is not None:
+                raise call.error
+            return dict(call.result)
+        try:
+            call.result = self._run_shared(key, fn)
+            return dict(call.result)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn) -> dict:
+        """Async variant of do; fn() returns an awaitable."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        while future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.wait_seconds)
+            except asyncio.TimeoutError:
+                logging.warning("Single-flight leader for %s still running after %ss; running it here.",
+                                key, self.wait_seconds)
+                SINGLE_FLIGHT.inc(role="timeout")
+                return await fn()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled (e.g. its client went away), not this caller:
+                # join the next leader, or lead.
+                logging.info("Single-flight leader for %s was cancelled; retrying.", key)
+                future = calls.get(key)
+                continue
+            SINGLE_FLIGHT.inc(role="follower")
+            return dict(result)
+        future = calls[key] = loop.create_future()
+        try:
+            result = await self._arun_shared(key, fn)
+            future.set_result(result)
+            return dict(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case there are no followers.
+            future.exception()
+            raise
+        finally:
+            del calls[key]
+
+    def _run_shared(self, key: str, fn) -> dict:
+        if self.redis_client is None:
+            SINGLE_FLIGHT.inc(role="leader")
+            return fn()
+        token = self._acquire(key)
+        if token is None:
+            result = self._wait_remote(key)
+            if result is not None:
+                return result
+            token = self._acquire(key)
+        SINGLE_FLIGHT.inc(role="leader")
+        try:
+            result = fn()
+            self._publish(key, result)
+            return result
+        finally:
+            self._release(key, token)
+
+    async def _arun_shared(self, key: str, fn) -> dict:
+        if self.redis_client is None:
+            SINGLE_FLIGHT.inc(role="leader")
+            return await fn()
+        token = await run_blocking(self._acquire, key)
+        if token is None:
+            deadline = time.monotonic() + self.wait_seconds
+            while time.monotonic() < deadline:
+                result, holder = await run_blocking(self._poll_remote, key)
+                if result is not None:
+                    SINGLE_FLIGHT.inc(role="remote")
+                    return result
+                if holder is None:
+                    break
+                await asyncio.sleep(self.poll_interval)
+            token = await run_blocking(self._acquire, key)
+        SINGLE_FLIGHT.inc(role="leader")
+        try:
+            result = await fn()
+            await run_blocking(self._publish, key, result)
+            return result
+        finally:
+            await run_blocking(self._release, key, token)
+
+    # Cross-worker coordination through Redis. Redis errors never fail a call: the worker
+    # then simply runs the function itself.
+
+    def _acquire(self, key: str):
+        """Takes the lease for key; returns its token, or None if another worker holds it."""
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.redis_client.set(self.key_prefix + "lease:" + key, token, nx=True,
+                                             px=int(self.lease_seconds * 1000))
+        except Exception as e:
+            logging.error("Single-flight lease unavailable: %s", e)
+            return ""
+        return token if acquired else None
+
+    def _release(self, key: str, token: str):
+        if not token:
+            return
+        lease = self.key_prefix + "lease:" + key
+        try:
+            # Only delete our own lease; it may have expired and been taken over.
+            current = self.redis_client.get(lease)
+            if current is not None and (current.decode("utf-8") if isinstance(current, bytes) else current) == token:
+                self.redis_client.delete(lease)
+        except Exception as e:
+            logging.error("Error releasing single-flight lease: %s", e)
+
+    def _publish(self, key: str, result: dict):
+        try:
+            self.redis_client.set(self.key_prefix + "result:" + key, json.dumps(result),
+                                  px=int(self.lease_seconds * 1000))
+        except Exception as e:
+            logging.error("Error publishing single-flight result: %s", e)
+
+    def _poll_remote(self, key: str):
+        """Returns (published result or None, lease holder or None)."""
+        try:
+            result, holder = self.redis_client.mget(self.key_prefix + "result:" + key, self.key_prefix + "lease:" + key)
+        except Exception as e:
+            logging.error("Error polling single-flight result: %s", e)
+            return None, None
+        return (json.loads(result) if result is not None else None), holder
+
+    def _wait_remote(self, key: str):
+        """Waits for another worker's result; None if its lease is released or expires first."""
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            result, holder = self._poll_remote(key)
+            if result is not None:
+                SINGLE_FLIGHT.inc(role="remote")
+                return result
+            if holder is None:
+                return None
+            time.sleep(self.poll_interval)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "redis": self.redis_client is not None}
@@ -1,41 +1,96 @@
 import logging
-from google import genai
+from app.async_runtime import run_blocking
+from app.timings import stage
+from .database import QueryTimeoutError
+from app.metrics import QUERY_RESULTS, ROWS_RETURNED
+from app.logs import stage_logger, truncate
+
+sql_log = stage_logger("sql")
 
 class SQLExecutor:
     """
     Executes SQL queries via a provided database abstraction layer.
     First, it uses the Gemini API (through the provided GeminiSQLGenerator) to
     validate and clean up the SQL query. Then it executes the cleaned query.
+    Queries that were already cleaned (e.g. served from the translation cache) can be
+    executed directly with clean=False.
     Returns a dictionary containing the cleaned SQL query and the execution result.
     """
     def __init__(self, db_layer, sql_generator):
         self.db_layer = db_layer
         self.sql_generator = sql_generator
 
-    def execute(self, query: str) -> dict:
+    def clean_query(self, query: str) -> str:
+        validation_prompt = self.sql_generator.prompt_builder.clean_prompt(query)
+        # Call the LLM backend shared with the SQL generator.
+        with stage("clean"):
+            response_text = self.sql_generator.backend.generate(validation_prompt)
+        
+        # Clean the response.
+        cleaned_query = self.sql_generator.clean_response(response_text)
+        
+        sql_log.info("SQLExecutor cleaned query: %s", truncate(cleaned_query))
+        return cleaned_query
+
+    async def aclean_query(self, query: str) -> str:
+        """
+        Async variant of clean_query, bounded by the process-wide LLM concurrency limit.
+        """
+        validation_prompt = self.sql_generator.prompt_builder.clean_prompt(query)
+        with stage("clean"):
+            response_text = await self.sql_generator.backend.agenerate(validation_prompt)
+        cleaned_query = self.sql_generator.clean_response(response_text)
+        sql_log.info("SQLExecutor cleaned query: %s", truncate(cleaned_query))
+        return cleaned_query
+
+    def execute(self, query: str, clean: bool = True, budget=None) -> dict:
         logging.info("SQLExecutor received query for execution.")
         try:
-            # Build a prompt to ask Gemini to validate and clean the SQL query.
-            validation_prompt = (
-                "Return only the SQL statement! Please validate and clean / fix the following SQL query and return only the cleaned SQL:\n" +
-                query
-            )
-            logging.info("Validation prompt for SQLExecutor: %s", validation_prompt)
-            # Call Gemini using the pre-initialized client from the gemini_generator.
-            response = self.sql_generator.client.models.generate_content(
-                model=self.sql_generator.model,
-                contents=validation_prompt
-            )
-            
-            # Clean the response.
-            cleaned_query = self.sql_generator.clean_response(response.text)
-            
-            logging.info("SQLExecutor cleaned query: %s", cleaned_query)
+            cleaned_query = self.clean_query(query) if clean else query
             # Execute the cleaned query using the database layer.
-            result = self.db_layer.execute_query(cleaned_query)
-            logging.info("SQLExecutor executed cleaned query, result: %s", result)
+            with stage("execute"):
+                result = self.db_layer.execute_query(cleaned_query, budget=budget)
+            self.record_result(result)
+            logging.info("SQLExecutor executed cleaned query, rows returned: %s", len(result.get("rows", [])))
             # Return both the cleaned query and the result.
             return result
+        except QueryTimeoutError:
+            QUERY_RESULTS.inc(status="timed_out")
+            raise
         except Exception as e:
             logging.error("SQLExecutor encountered an error: %s", e)
             raise
+
+    async def aexecute(self, query: str, clean: bool = True, budget=None) -> dict:
+        """
+        Async variant of execute: the Gemini clean-up call is awaited on the event loop and
+        the SQLite query runs on the database thread pool.
+        """
+        logging.info("SQLExecutor received query for execution.")
+        try:
+            cleaned_query = await self.aclean_query(query) if clean else query
+            with stage("execute"):
+                result = await run_blocking(self.db_layer.execute_query, cleaned_query, budget=budget)
+            self.record_result(result)
+            logging.info("SQLExecutor executed cleaned query, rows returned: %s", len(result.get("rows", [])))
+            return result
+        except QueryTimeoutError:
+            QUERY_RESULTS.inc(status="timed_out")
+            raise
+        except Exception as e:
+            logging.error("SQLExecutor encountered an error: %s", e)
+            raise
+
+    @staticmethod
+    def record_result(result: dict):
+        QUERY_RESULTS.inc(status=result.get("status", "ok"))
+        ROWS_RETURNED.observe(len(result.get("rows", [])))
+
+    def iter_execute(self, query: str, batch_size: int = 500, budget=None):
+        """
+        Streams an already-cleaned query: yields the column names, then batches of rows.
+        """
+        return self.db_layer.iter_query(query, batch_size=batch_size, budget=budget)
+
+    def fetch_page(self, query: str, offset: int, limit: int, budget=None) -> dict:
+        return self.db_layer.fetch_page(query, offset, limit, budget=budget)
@@ -1,62 +1,125 @@
+import json
 import logging
 from config import Config
-from google import genai
+from app.timings import stage
+from app.logs import stage_logger, truncate
+from .llm_backend import LLMBackend, GeminiBackend
+from .prompt_builder import PromptBuilder
+
+sql_log = stage_logger("sql")
 
 class GeminiSQLGenerator:
     """
-    Uses the Gemini API (via Google's Generative AI Python client) to convert natural
-    language queries into SQL. This version includes schema details in the prompt.
+    Uses an LLM backend (the Gemini API by default) to convert natural language queries
+    into SQL. This version includes schema details in the prompt.
+    The backend and the prompt builder are shared with the feedback module, the executor
+    and the agent's validator.
     """
-    def __init__(self, schema_manager, api_key: str, model: str = None):
+    def __init__(self, schema_manager, api_key: str = None, model: str = None, backend: LLMBackend = None,
+                 prompt_builder: PromptBuilder = None):
         self.schema_manager = schema_manager
-        # Initialize the Gemini client with the API key.
-        self.client = genai.Client(api_key=api_key)
-        # Use the provided model identifier or default to "gemini-2.0-flash"
-        if model is None:
-            model = "gemini-2.0-flash"
-        self.model = model
-        logging.info("Initialized Gemini API client with model: %s", self.model)
+        self.prompt_builder = prompt_builder or PromptBuilder(
+            schema_manager,
+            token_budget=Config.PROMPT_TOKEN_BUDGET,
+            history_turns=Config.PROMPT_HISTORY_TURNS,
+            encoding_name=Config.PROMPT_TOKEN_ENCODING
+        )
+        # Without an explicit backend, call Gemini with the given API key and model.
+        self.backend = backend or GeminiBackend(api_key=api_key, model=model)
+        self.model = self.backend.model
 
     def generate_sql(self, natural_language_query: str, context=None) -> str:
-        prompt = self.create_prompt(natural_language_query)
-        logging.info("Generated prompt for Gemini API: %s", prompt)
+        prompt = self.prompt_builder.generation_prompt(natural_language_query, context,
+                                                       include_schema=Config.EXECUTE_SQL)
+        try:
+            with stage("generate"):
+                raw_sql = self.backend.generate(prompt)
+            sql_query = self.clean_response(raw_sql)
+            sql_log.info("Cleaned SQL: %s", truncate(sql_query))
+            return sql_query
+        except Exception as e:
+            error_msg = f"Error: {e}"
+            logging.error("Error calling Gemini API: %s", e)
+            return error_msg
+
+    async def agenerate_sql(self, natural_language_query: str, context=None) -> str:
+        """
+        Async variant of generate_sql, bounded by the process-wide LLM concurrency limit.
+        """
+        prompt = self.prompt_builder.generation_prompt(natural_language_query, context,
+                                                       include_schema=Config.EXECUTE_SQL)
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt
-            )
-            raw_sql = response.text
-            logging.info("Raw Gemini API output: %s", raw_sql)
+            with stage("generate"):
+                raw_sql = await self.backend.agenerate(prompt)
             sql_query = self.clean_response(raw_sql)
-            logging.info("Cleaned SQL: %s", sql_query)
+            sql_log.info("Cleaned SQL: %s", truncate(sql_query))
             return sql_query
         except Exception as e:
             error_msg = f"Error: {e}"
             logging.error("Error calling Gemini API: %s", e)
             return error_msg
 
-    def create_prompt(self, natural_language_query: str) -> str:
+    def generate_sql_with_verdict(self, natural_language_query: str, context=None) -> dict:
+        """
+        Single-round-trip generation: one structured Gemini response carries both the SQL
+        and a validity verdict against the schema, so no separate validation or cleaning
+        call is needed. Returns a dictionary with the keys "sql", "valid" and "validation".
+        """
+        prompt = self.prompt_builder.structured_generation_prompt(natural_language_query, context,
+                                                                  include_schema=Config.EXECUTE_SQL)
+        try:
+            with stage("generate"):
+                response_text = self.backend.generate(prompt, json_mode=True)
+            return self.parse_structured_response(response_text)
+        except Exception as e:
+            error_msg = f"Error: {e}"
+            logging.error("Error calling Gemini API: %s", e)
+            return {"sql": error_msg, "valid": False, "validation": error_msg}
+
+    async def agenerate_sql_with_verdict(self, natural_language_query: str, context=None) -> dict:
+        """
+        Async variant of generate_sql_with_verdict.
+        """
+        prompt = self.prompt_builder.structured_generation_prompt(natural_language_query, context,
+                                                                  include_schema=Config.EXECUTE_SQL)
+        try:
+            with stage("generate"):
+                response_text = await self.backend.agenerate(prompt, json_mode=True)
+            return self.parse_structured_response(response_text)
+        except Exception as e:
+            error_msg = f"Error: {e}"
+            logging.error("Error calling Gemini API: %s", e)
+            return {"sql": error_msg, "valid": False, "validation": error_msg}
+
+    def parse_structured_response(self, response_text: str) -> dict:
         """
-        Constructs a prompt that includes the database schema (table names and columns)
-        and instructs Gemini to convert the provided natural language query into SQL.
+        Parses a structured {"sql", "valid", "explanation"} response. The SQL is passed
+        through clean_response once, so it can be executed as is.
         """
-        if Config.EXECUTE_SQL:
-            schema = self.schema_manager.get_schema()
-            schema_lines = ["Database Schema:"]
-            for table, info in schema.items():
-                columns = info.get("columns", [])
-                schema_lines.append(f"Table '{table}': {', '.join(columns)}")
-            schema_prompt = "\n".join(schema_lines)
+        text = response_text.strip()
+        if text.startswith("```"):
+            text = text[3:]
+            if text.lower().startswith("json"):
+                text = text[len("json"):]
+            if text.endswith("```"):
+                text = text[:-3]
+        try:
+            data = json.loads(text)
+            if not isinstance(data, dict):
+                raise ValueError("structured response is not a JSON object")
+        except ValueError as e:
+            logging.error("Could not parse structured Gemini response: %s", e)
+            return {"sql": self.clean_response(response_text), "valid": False,
+                    "validation": "Could not parse the structured response from Gemini."}
+        sql_query = self.clean_response(str(data.get("sql") or ""))
+        valid = data.get("valid")
+        valid = valid is True or str(valid).strip().lower() in ("true", "yes")
+        if valid and sql_query:
+            validation = "yes"
         else:
-            schema_prompt = ""
-        prompt = (
-            f"{schema_prompt}\n\n"
-            f"Convert the following natural language query into SQL for sqllite3:\n"
-            f"{natural_language_query}\n"
-            f"SQL:"
-        )
-        print("Prompt: ", prompt)
-        return prompt
+            valid = False
+            validation = str(data.get("explanation") or "The generated SQL query is not valid.")
+        return {"sql": sql_query, "valid": valid, "validation": validation}
 
     def clean_response(self, response_text: str) -> str:
         """
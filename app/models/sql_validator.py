@@ -0,0 +1,128 @@
+# app/models/sql_validator.py
+
+import logging
+import re
+import sqlite3
+import threading
+from app.timings import stage
+
+_ERROR_PATTERNS = [
+    (re.compile(r"^no such table: (.+)$"), "unknown_table"),
+    (re.compile(r"^no such column: (.+)$"), "unknown_column"),
+    (re.compile(r"^ambiguous column name: (.+)$"), "ambiguous_column"),
+    (re.compile(r"^no such function: (.+)$"), "unknown_function"),
+    (re.compile(r'^near "(.*)": syntax error$'), "syntax"),
+]
+
+def format_validation_errors(errors: list) -> str:
+    """
+    Renders structured validation errors as one line per error, for messages and prompts.
+    """
+    lines = []
+    for error in errors:
+        line = f"- {error['message']}"
+        if error.get("position") is not None:
+            line += f" (at character {error['position']})"
+        if error.get("suggestion"):
+            line += f"; did you mean '{error['suggestion']}'?"
+        lines.append(line)
+    return "\n".join(lines)
+
+class SQLiteValidator:
+    """
+    Validates SQL locally by compiling it with EXPLAIN against a schema-only, in-memory
+    clone of the database built from the SchemaManager. Nothing is executed and no data
+    is touched, so validation is deterministic and takes microseconds.
+    Each thread keeps its own clone, rebuilt whenever the schema fingerprint changes.
+    """
+    def __init__(self, schema_manager):
+        self.schema_manager = schema_manager
+        self._local = threading.local()
+
+    def _clone(self):
+        snapshot = self.schema_manager.get_snapshot()
+        clone = getattr(self._local, "clone", None)
+        if clone is not None and clone[0] == snapshot.fingerprint:
+            return clone[1]
+        if clone is not None:
+            clone[1].close()
+        conn = sqlite3.connect(":memory:")
+        for table, info in snapshot.schema_info.items():
+            if table.lower().startswith("sqlite_"):
+                continue  # Internal tables cannot be created explicitly.
+            types = info.get("types") or []
+            columns = []
+            for i, column in enumerate(info.get("columns", [])):
+                column_type = types[i] if i < len(types) and types[i] else ""
+                columns.append(f"{_quote(column)} {column_type}".strip())
+            conn.execute(f"CREATE TABLE {_quote(table)} ({', '.join(columns) or 'rowid_placeholder'})")
+        self._local.clone = (snapshot.fingerprint, conn)
+        logging.info("Built schema-only validation clone with %s tables.", len(snapshot.schema_info))
+        return conn
+
+    def validate(self, sql_query: str) -> dict:
+        """
+        Returns {"valid": bool, "errors": [...], "validation": str}, where "validation" is
+        "yes" for a valid query (matching the Gemini validator) or a readable explanation.
+        Each error has a "type" (unknown_table, unknown_column, ambiguous_column,
+        unknown_function, syntax, multiple_statements, empty or error), a "message" and,
+        where known, the offending "name", its "position" in the query and a "suggestion".
+        """
+        sql = (sql_query or "").strip()
+        if not sql:
+            errors = [{"type": "empty", "message": "The SQL query is empty."}]
+        else:
+            try:
+                with stage("validate"):
+                    self._clone().execute("EXPLAIN " + sql)
+                return {"valid": True, "errors": [], "validation": "yes"}
+            except (sqlite3.Error, sqlite3.Warning, ValueError) as e:
+                errors = [self._describe_error(sql, str(e))]
+        validation = "The SQL query is not valid:\n" + format_validation_errors(errors)
+        logging.info("Local validation failed: %s", errors)
+        return {"valid": False, "errors": errors, "validation": validation}
+
+    def _describe_error(self, sql: str, message: str) -> dict:
+        error = {"type": "error", "message": message}
+        for pattern, error_type in _ERROR_PATTERNS:
+            match = pattern.match(message)
+            if not match:
+                continue
+            name = match.group(1)
+            error["type"] = error_type
+            if error_type == "syntax":
+                error["token"] = name
+            else:
+                error["name"] = name
+            position = _find_token(sql, name.split(".")[-1] if error_type == "unknown_column" else name)
+            if position is not None:
+                error["position"] = position
+            suggestion = self._suggest(error_type, name)
+            if suggestion:
+                error["suggestion"] = suggestion
+            return error
+        if message == "incomplete input":
+            error.update({"type": "syntax", "position": len(sql)})
+        elif "one statement at a time" in message:
+            error["type"] = "multiple_statements"
+        return error
+
+    def _suggest(self, error_type: str, name: str):
+        if error_type == "unknown_table":
+            kind = "table"
+        elif error_type == "unknown_column":
+            name = name.split(".")[-1]
+            kind = "column"
+        else:
+            return None
+        corrected = self.schema_manager.correct_term(name, kind=kind)
+        return corrected if corrected.lower() != name.lower() else None
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _find_token(sql: str, token: str):
+    if not token:
+        return None
+    position = sql.lower().find(token.lower())
+    return position if position >= 0 else None
@@ -0,0 +1,110 @@
+# app/models/term_index.py
+
+import re
+from difflib import SequenceMatcher
+
+_WORD = re.compile(r"\w+")
+
+def plural_forms(name: str) -> set:
+    """The plural spellings of a (lowercase) name: "city" -> {"citys", "cities"}."""
+    if len(name) < 3:
+        # "a" -> "as", "i" -> "is": too short to pluralize safely.
+        return set()
+    forms = {name + "s"}
+    if name.endswith(("s", "x", "z", "ch", "sh")):
+        forms.add(name + "es")
+    elif name.endswith("y") and name[-2] not in "aeiou":
+        forms.add(name[:-1] + "ies")
+    return forms
+
+def trigrams(term: str) -> set:
+    padded = f"  {term.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TermIndex:
+    """
+    Precomputed normalization index for one schema snapshot.
+    Every surface form of a table or column name that differs from the name itself (plurals,
+    the spaced form of snake_case names, configured synonyms) maps to the schema name, so
+    normalize rewrites a question in a single pass over its words whatever the schema size.
+    Table forms win over column forms. A trigram index narrows fuzzy correction to the few
+    names sharing trigrams with the term before they are compared.
+    """
+    def __init__(self, schema_info: dict, synonyms: dict = None):
+        self.tables = list(schema_info)
+        self.columns = sorted({c for info in schema_info.values() for c in info.get("columns", [])})
+        self.forms = {}
+        # Columns first, so table forms overwrite them.
+        for names in (self.columns, self.tables):
+            for name in names:
+                lowered = name.lower()
+                spaced = lowered.replace("_", " ").strip()
+                for base in {lowered, spaced}:
+                    for form in plural_forms(base) | {base}:
+                        if form != lowered:
+                            self.forms[form] = name
+        canonical = {name.lower(): name for name in self.columns + self.tables}
+        # A form that is itself a schema name ("orders" next to an "order" column) stays as is.
+        for lowered in canonical:
+            self.forms.pop(lowered, None)
+        for synonym, target in (synonyms or {}).items():
+            name = canonical.get(target.lower())
+            if name is not None:
+                for form in plural_forms(synonym.lower()) | {synonym.lower()}:
+                    self.forms[form] = name
+        self.max_words = max((form.count(" ") + 1 for form in self.forms), default=1)
+        self._trigrams = {"table": self._build_trigrams(self.tables), "column": self._build_trigrams(self.columns)}
+
+    @staticmethod
+    def _build_trigrams(names: list) -> dict:
+        index = {}
+        for name in names:
+            for gram in trigrams(name):
+                index.setdefault(gram, []).append(name)
+        return index
+
+    def normalize(self, text: str) -> tuple:
+        """
+        Returns the text with every known surface form replaced by its schema name, and the
+        list of (form, name) replacements made. Multi-word forms ("first names") are matched
+        before their words.
+        """
+        words = list(_WORD.finditer(text))
+        pieces, replaced, last, i = [], [], 0, 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                span = words[i:i + n]
+                if any(not text[a.end():b.start()].isspace() for a, b in zip(span, span[1:])):
+                    continue
+                name = self.forms.get(" ".join(word.group().lower() for word in span))
+                if name is not None:
+                    start, end = span[0].start(), span[-1].end()
+                    pieces.append(text[last:start])
+                    pieces.append(name)
+                    replaced.append((text[start:end], name))
+                    last = end
+                    i += n
+                    break
+            else:
+                i += 1
+        pieces.append(text[last:])
+        return "".join(pieces), replaced
+
+    def correct(self, term: str, kind: str = "table", cutoff: float = 0.8, candidates: int = 10):
+        """
+        Returns the table (or column) name closest to the term with a similarity of at least
+        cutoff, as difflib.get_close_matches would, or None.
+        """
+        lowered = term.lower()
+        shared = {}
+        for gram in trigrams(lowered):
+            for name in self._trigrams[kind].get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        best, best_ratio = None, cutoff
+        for name in sorted(shared, key=lambda n: (-shared[n], n))[:candidates]:
+            matcher = SequenceMatcher(None, lowered, name.lower())
+            if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+                ratio = matcher.ratio()
+                if ratio > best_ratio or (ratio == best_ratio and best is None):
+                    best, best_ratio = name, ratio
+        return best
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import re
 import sqlite3
@@ -6,44 +7,80 @@ from .conversation_context import ConversationContext
 from .schema_manager import SchemaManager
 from .sql_generator import GeminiSQLGenerator
 from .feedback_module import FeedbackModule
-from app.contex_store import get_context, set_context
+from app.contex_store import get_context, append_turn
 from config import Config
-from .database import SQLiteDatabase
+from .database import SQLiteDatabase, QueryTimeoutError
 from .sql_executor import SQLExecutor
+from .sql_validator import SQLiteValidator
+from app.async_runtime import Call, drive, adrive
+from app.timings import stage
+from app.metrics import TRANSLATION_CACHE, VALIDATION_FAILURES
+from .llm_backend import create_llm_backend
+from app.logs import stage_logger, truncate
+
+llm_log = stage_logger("llm")
+result_log = stage_logger("result")
+
+# Pipeline modes: "single" asks Gemini for the SQL and its verdict in one structured call;
+# "strict" keeps the separate generate, validate and clean calls.
+PIPELINE_SINGLE = "single"
+PIPELINE_STRICT = "strict"
 
 class TextToSQLAgent:
     """
     Orchestrates the text-to-SQL conversion process, including conversation management
     and query refinement using the Gemini API.
     In conversion-only mode, the SQL is not executed; instead, a simulated result is returned.
-    Before returning a conversion, the agent validates the generated SQL query with Gemini.
+    Before returning a conversion, the agent validates the generated SQL query with Gemini,
+    either in the same structured call ("single" mode) or in a separate call ("strict" mode).
     """
     def __init__(self, schema_info: dict, db_file: str, user_id: str,
                  read_only: bool = True, use_dynamic_schema: bool = False, use_gemini: bool = True, 
-                 execute_sql: bool = None):
+                 execute_sql: bool = None, nlp=None, schema_manager=None, sql_generator=None,
+                 feedback_module=None, db_layer=None, executor=None, translation_cache=None,
+                 pipeline_mode: str = None, sql_validator=None, budget=None, single_flight=None,
+                 context_id: str = None):
+        """
+        Components passed in explicitly (normally by the AgentRegistry) are shared and reused;
+        any component not provided is built for this agent alone.
+        """
         logging.info("Initializing TextToSQLAgent for user_id: %s", user_id)
-        self.nlp = NLProcessor()
+        self.nlp = nlp or NLProcessor()
         self.conversation_context = ConversationContext()
-        if use_dynamic_schema:
+        if schema_manager is not None:
+            self.schema_manager = schema_manager
+        elif use_dynamic_schema:
             logging.info("Using dynamic schema introspection.")
             self.schema_manager = SchemaManager(db_file=db_file, use_dynamic_schema=True)
         else:
             logging.info("Using static schema information.")
             self.schema_manager = SchemaManager(schema_info)
-        logging.info("Using Gemini API for text-to-SQL conversion.")
-        self.sql_generator = GeminiSQLGenerator(
-            self.schema_manager,
-            api_key=Config.GEMINI_API_KEY,
-            model=Config.GEMINI_MODEL
-        )
+        if sql_generator is not None:
+            self.sql_generator = sql_generator
+        else:
+            logging.info("Using the %s LLM backend for text-to-SQL conversion.", Config.LLM_BACKEND)
+            self.sql_generator = GeminiSQLGenerator(self.schema_manager, backend=create_llm_backend(Config))
         self.execute_sql = execute_sql if execute_sql is not None else Config.EXECUTE_SQL
         if self.execute_sql:
-            self.db_layer = SQLiteDatabase(db_file, read_only=read_only)
-            self.executor = SQLExecutor(self.db_layer, self.sql_generator)
+            self.db_layer = db_layer or SQLiteDatabase(db_file, read_only=read_only)
+            self.executor = executor or SQLExecutor(self.db_layer, self.sql_generator)
         else:
             self.executor = None
-        self.feedback_module = FeedbackModule(self.schema_manager, self.sql_generator)
+        self.feedback_module = feedback_module or FeedbackModule(self.schema_manager, self.sql_generator)
+        self.translation_cache = translation_cache
+        if sql_validator is None and Config.SQL_VALIDATOR == "local":
+            sql_validator = SQLiteValidator(self.schema_manager)
+        self.sql_validator = sql_validator
+        # Coalesces concurrent identical translations; None translates every request alone.
+        self.single_flight = single_flight
+        # Execution limits for this request; None uses the database layer's default budget.
+        self.budget = budget
+        self.pipeline_mode = pipeline_mode or Config.PIPELINE_MODE
+        if self.pipeline_mode not in (PIPELINE_SINGLE, PIPELINE_STRICT):
+            raise ValueError(f"Unknown pipeline mode: {self.pipeline_mode}")
         self.user_id = user_id
+        # Key of the user's stored conversation context (scoped per database when routed).
+        self.context_id = context_id or user_id
         logging.info("TextToSQLAgent initialized successfully.")
 
     def simulate_result(self, sql_query: str) -> dict:
@@ -76,107 +113,309 @@ class TextToSQLAgent:
                         row.append(f"dummy_{col}_{i+1}")
                 dummy_rows.append(row)
             simulated_result = {"columns": columns, "rows": dummy_rows}
-            logging.info("Simulated result: %s", simulated_result)
+            result_log.debug("Simulated result: %s", truncate(simulated_result))
             return simulated_result
         else:
             logging.info("Could not parse SELECT clause. Returning empty result.")
             return {"columns": [], "rows": []}
 
+    # The pipeline stages are generators written once for the sync and async entry points:
+    # each LLM or blocking call (Redis context, cache tier, SQLite) is yielded as a Call,
+    # which drive() makes in the calling thread and adrive() awaits, with Gemini calls under
+    # the process-wide LLM concurrency limit and blocking calls on the database thread pool.
+
     def validate_query(self, sql_query: str) -> dict:
         """
-        Validates the generated SQL query using the Gemini API.
-        The prompt includes the database schema and the SQL query.
-        If the query is valid, Gemini should return "yes".
-        Otherwise, Gemini returns a brief explanation and a prompt to help the user.
-        """
-        schema = self.schema_manager.get_schema()
-        schema_lines = ["Database Schema:"]
-        for table, info in schema.items():
-            columns = info.get("columns", [])
-            schema_lines.append(f"Table '{table}': {', '.join(columns)}")
-        schema_prompt = "\n".join(schema_lines)
-        prompt = (
-            f"{schema_prompt}\n\n"
-            f"Given the SQL query:\n{sql_query}\n\n"
-            f"Is this query valid according to the above schema? "
-            f"If valid, reply only with 'yes'. If invalid, provide a brief explanation and a prompt to help the user fix it."
-        )
-        logging.info("Validation prompt: %s", prompt)
+        Validates the generated SQL query.
+        With a local validator the query is compiled against a schema-only clone of the
+        database and structured errors are returned under "errors"; otherwise the Gemini API
+        is asked, with a prompt that includes the database schema and the SQL query.
+        If the query is valid, "validation" is "yes".
+        Otherwise, it holds a brief explanation and a prompt to help the user.
+        """
+        return drive(self._validate_query(sql_query))
+
+    async def avalidate_query(self, sql_query: str) -> dict:
+        return await adrive(self._validate_query(sql_query))
+
+    def _validate_query(self, sql_query: str):
+        # The local validator is fast enough to run inline.
+        if self.sql_validator is not None:
+            return self.sql_validator.validate(sql_query)
+        prompt = self.sql_generator.prompt_builder.validation_prompt(sql_query)
+        backend = self.sql_generator.backend
         try:
-            response = self.sql_generator.client.models.generate_content(
-                model=self.sql_generator.model,
-                contents=prompt
-            )
-            validation_text = response.text.strip()
-            logging.info("Validation response: %s", validation_text)
+            with stage("validate"):
+                validation_text = (yield Call(backend.generate, prompt, afn=backend.agenerate)).strip()
+            llm_log.info("Validation response: %s", truncate(validation_text))
             return {"validation": validation_text}
         except Exception as e:
             error_msg = f"Validation error: {e}"
             logging.error(error_msg)
             return {"validation": error_msg}
 
-    def process_query(self, user_input: str) -> dict:
-        logging.info("Processing query for user_id: %s", self.user_id)
-        self.conversation_context.history = get_context(self.user_id)
-        if self.conversation_context.history:
-            logging.info("Loaded existing conversation context for user_id: %s", self.user_id)
+    def context_turns_needed(self, minimum: int = 0) -> int:
+        """
+        How many of the latest stored turns the prompts use: the configured history, and at
+        least `minimum` (refinement needs the last turn). Nothing is loaded when it is 0.
+        """
+        return max(self.sql_generator.prompt_builder.history_turns, minimum)
+
+    def load_context(self, last: int = None):
+        drive(self._load_context(last))
+
+    def _load_context(self, last: int = None):
+        self.conversation_context.history = yield Call(get_context, self.context_id, last)
+        logging.info("Loaded %s conversation turns for user_id: %s", len(self.conversation_context.history), self.user_id)
+
+    def translate(self, user_input: str) -> dict:
+        """
+        Parses, normalizes and translates a question into validated SQL without executing it.
+        Returns {"sql", "executable_sql", "cached", "cache_key"}, where "executable_sql" is the
+        statement to run (cleaned in strict mode), or an error response containing "error".
+        """
+        return drive(self._translate(user_input))
+
+    async def atranslate(self, user_input: str) -> dict:
+        return await adrive(self._translate(user_input))
+
+    def _translate(self, user_input: str):
+        with stage("parse"):
+            parsed_query = self.nlp.parse(user_input)
+        with stage("normalize"):
+            normalized_query = self.nlp.normalize_terms(parsed_query, self.schema_manager)
+        logging.info("Normalized query: %s", truncate(normalized_query))
+        cache_key = self.translation_cache_key(normalized_query)
+        cached_sql = (yield Call(self.translation_cache.get, cache_key)) if cache_key else None
+        if cache_key:
+            TRANSLATION_CACHE.inc(result="hit" if cached_sql is not None else "miss")
+        if cached_sql is not None:
+            # A cached translation already passed validation, cleaning and execution; skip every LLM call.
+            logging.info("Translation cache hit for user_id: %s", self.user_id)
+            return {"sql": cached_sql, "executable_sql": cached_sql, "cached": True, "cache_key": cache_key}
+        if self.single_flight is None:
+            return (yield from self._generate_translation(normalized_query, cache_key))
+        # Concurrent identical questions share one generation and validation.
+        key = self.flight_key(normalized_query)
+        return (yield Call(
+            lambda: self.single_flight.do(key, lambda: self.generate_translation(normalized_query, cache_key)),
+            afn=lambda: self.single_flight.ado(key, lambda: self.agenerate_translation(normalized_query, cache_key))
+        ))
+
+    def generate_translation(self, normalized_query: str, cache_key: str = None) -> dict:
+        """
+        Generates and validates the SQL for a normalized query with the LLM (see translate).
+        """
+        return drive(self._generate_translation(normalized_query, cache_key))
+
+    async def agenerate_translation(self, normalized_query: str, cache_key: str = None) -> dict:
+        return await adrive(self._generate_translation(normalized_query, cache_key))
+
+    def _generate_translation(self, normalized_query: str, cache_key: str = None):
+        generator = self.sql_generator
+        if self.pipeline_mode == PIPELINE_STRICT:
+            sql_query = yield Call(generator.generate_sql, normalized_query,
+                                   context=self.conversation_context.get_context(), afn=generator.agenerate_sql)
+            if sql_query.startswith("Error:"):
+                logging.error("Gemini API returned an error: %s", sql_query)
+                return {"sql": sql_query, "result": None, "schema": [], "error": sql_query}
+            
+            # Validate the generated SQL query.
+            validation = yield from self._validate_query(sql_query)
+            if validation.get("validation", "").strip().lower() != "yes":
+                # Return an error response with the validation message.
+                logging.error("Validation failed: %s", validation.get("validation"))
+                return self.validation_error_response(sql_query, validation)
+            executable_sql = sql_query
+            if Config.EXECUTE_SQL and self.executor is not None:
+                try:
+                    executable_sql = yield Call(self.executor.clean_query, sql_query, afn=self.executor.aclean_query)
+                except Exception as e:
+                    logging.error("Error cleaning SQL query: %s", e)
+                    return {"sql": sql_query, "result": None, "schema": [], "error": str(e)}
         else:
-            logging.info("No existing conversation context found for user_id: %s", self.user_id)
-        parsed_query = self.nlp.parse(user_input)
-        normalized_query = self.nlp.normalize_terms(parsed_query, self.schema_manager)
-        logging.info("Normalized query: %s", normalized_query)
-        sql_query = self.sql_generator.generate_sql(normalized_query, context=self.conversation_context.get_context())
-        if sql_query.startswith("Error:"):
-            logging.error("Gemini API returned an error: %s", sql_query)
-            return {"sql": sql_query, "result": None, "schema": [], "error": sql_query}
-        
-        # Validate the generated SQL query.
-        validation = self.validate_query(sql_query)
-        if validation.get("validation", "").strip().lower() != "yes":
-            # Return an error response with the validation message.
-            logging.error("Validation failed: %s", validation.get("validation"))
-            return {"sql": sql_query, "result": None, "schema": [], "error": validation.get("validation")}
+            # One structured response carries the SQL and its verdict; it is already cleaned.
+            generation = yield Call(generator.generate_sql_with_verdict, normalized_query,
+                                    context=self.conversation_context.get_context(),
+                                    afn=generator.agenerate_sql_with_verdict)
+            sql_query = generation["sql"]
+            if sql_query.startswith("Error:"):
+                logging.error("Gemini API returned an error: %s", sql_query)
+                return {"sql": sql_query, "result": None, "schema": [], "error": sql_query}
+            if not generation["valid"]:
+                logging.error("Validation failed: %s", generation["validation"])
+                return self.validation_error_response(sql_query, generation)
+            # The local validator is cheap and deterministic, so it double-checks Gemini's verdict.
+            if self.sql_validator is not None:
+                validation = self.sql_validator.validate(sql_query)
+                if not validation["valid"]:
+                    logging.error("Validation failed: %s", validation["validation"])
+                    return self.validation_error_response(sql_query, validation)
+            executable_sql = sql_query
+        return {"sql": sql_query, "executable_sql": executable_sql, "cached": False, "cache_key": cache_key}
+
+    def process_query(self, user_input: str, remember: bool = True) -> dict:
+        """
+        Translates and answers a question. With remember=False the question is answered
+        without the user's conversation history and the turn is not recorded (the caller
+        records it).
+        """
+        return drive(self._process_query(user_input, remember))
+
+    async def aprocess_query(self, user_input: str, remember: bool = True) -> dict:
+        return await adrive(self._process_query(user_input, remember))
+
+    def _process_query(self, user_input: str, remember: bool = True):
+        logging.info("Processing query for user_id: %s", self.user_id)
+        if remember:
+            yield from self._load_context(self.context_turns_needed())
+        translation = yield from self._translate(user_input)
+        if "error" in translation:
+            return translation
+        sql_query = translation["sql"]
         
         # In conversion-only mode, simulate the result; otherwise, execute the query.
-        if not Config.EXECUTE_SQL or self.executor is None:
+        if not self.executes_sql():
             result = self.simulate_result(sql_query)
         else:
             try:
-                result = self.executor.execute(sql_query)
+                result = yield Call(self.executor.execute, translation["executable_sql"], clean=False,
+                                    budget=self.budget, afn=self.executor.aexecute)
+            except QueryTimeoutError as e:
+                logging.error("SQL query timed out: %s", e)
+                return {"sql": sql_query, "result": None, "schema": [], "error": str(e), "status": "timed_out"}
             except Exception as e:
                 logging.error("Error executing SQL query: %s", e)
                 return {"sql": sql_query, "result": None, "schema": [], "error": str(e)}
-        self.conversation_context.add_turn(user_input, sql_query)
-        set_context(self.user_id, self.conversation_context.get_context())
+            # Only SQL that has actually run is cached.
+            yield Call(self.cache_translation, translation)
+        if remember:
+            self.conversation_context.add_turn(user_input, sql_query)
+            yield Call(append_turn, self.context_id, user_input, sql_query)
         schema_for_result = result.get("columns", []) if isinstance(result, dict) else []
         logging.info("Query processed for user_id: %s", self.user_id)
-        return {"sql": sql_query, "result": result, "schema": schema_for_result}
+        return {"sql": sql_query, "result": result, "schema": schema_for_result, "cached": translation["cached"],
+                "status": result.get("status", "ok")}
+
+    def prepare_query(self, user_input: str) -> dict:
+        """
+        Translates a question and records the conversation turn without executing the SQL,
+        for callers that stream or page through the results themselves; they call
+        cache_translation once the SQL has run.
+        Returns the translation (see translate) or an error response.
+        """
+        logging.info("Preparing query for user_id: %s", self.user_id)
+        self.load_context(self.context_turns_needed())
+        translation = self.translate(user_input)
+        if "error" in translation:
+            return translation
+        self.conversation_context.add_turn(user_input, translation["sql"])
+        append_turn(self.context_id, user_input, translation["sql"])
+        return translation
+
+    def cache_translation(self, translation: dict):
+        """Caches a fresh translation; call it only once its SQL has executed successfully."""
+        if not translation.get("cached") and translation.get("cache_key"):
+            self.translation_cache.put(translation["cache_key"], translation["executable_sql"])
+
+    def executes_sql(self) -> bool:
+        return bool(Config.EXECUTE_SQL) and self.executor is not None
+
+    def translation_cache_key(self, normalized_query: str):
+        """
+        Returns the translation cache key for a normalized query, or None when caching is off.
+        Only executed SQL is cached, so there is no key in conversion-only mode.
+        When prompts carry conversation history, the history is part of the key.
+        """
+        if self.translation_cache is None or not self.executes_sql():
+            return None
+        history = self.sql_generator.prompt_builder.history_key(self.conversation_context.get_context())
+        if history:
+            normalized_query = f"{history}{normalized_query}"
+        return self.translation_cache.make_key(
+            normalized_query, self.schema_manager.get_fingerprint(), self.sql_generator.model,
+            pipeline=self.pipeline_mode
+        )
+
+    def flight_key(self, normalized_query: str) -> str:
+        """
+        Key under which concurrent identical translations are coalesced: everything the
+        generated SQL depends on (question, history, schema, model and pipeline).
+        """
+        raw = "\x00".join([
+            self.sql_generator.model, self.pipeline_mode, str(self.executes_sql()), self.schema_manager.get_fingerprint(),
+            self.sql_generator.prompt_builder.history_key(self.conversation_context.get_context()),
+            " ".join(normalized_query.split())
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def validation_error_response(self, sql_query: str, validation: dict) -> dict:
+        VALIDATION_FAILURES.inc()
+        return {"sql": sql_query, "result": None, "schema": [], "error": validation.get("validation"),
+                "validation_errors": validation.get("errors", [])}
+
+    def refine_and_validate(self, current_sql: str, feedback: str, validation_errors=None):
+        """
+        Runs one refinement round in the configured pipeline mode and returns the refined SQL
+        together with its validation result.
+        """
+        return drive(self._refine_and_validate(current_sql, feedback, validation_errors))
+
+    def _refine_and_validate(self, current_sql: str, feedback: str, validation_errors=None):
+        context = self.conversation_context.get_context()
+        feedback_module = self.feedback_module
+        if self.pipeline_mode == PIPELINE_STRICT:
+            refined_sql = yield Call(feedback_module.refine_query, current_sql, feedback, context=context,
+                                     validation_errors=validation_errors, afn=feedback_module.arefine_query)
+            return refined_sql, (yield from self._validate_query(refined_sql))
+        refinement = yield Call(feedback_module.refine_query_with_verdict, current_sql, feedback, context=context,
+                                validation_errors=validation_errors, afn=feedback_module.arefine_query_with_verdict)
+        if refinement["valid"] and self.sql_validator is not None:
+            return refinement["sql"], self.sql_validator.validate(refinement["sql"])
+        return refinement["sql"], refinement
 
     def refine_query(self, feedback: str) -> dict:
-        logging.info("Refining query for user_id: %s with feedback: %s", self.user_id, feedback)
-        self.conversation_context.history = get_context(self.user_id)
-        if self.conversation_context.history:
-            last_turn = self.conversation_context.history[-1]
-            current_sql = last_turn.get("system")
-            refined_sql = self.feedback_module.refine_query(current_sql, feedback, context=self.conversation_context.get_context())
-            # Validate the refined SQL query.
-            validation = self.validate_query(refined_sql)
-            if validation.get("validation", "").strip().lower() != "yes":
-                logging.error("Validation failed for refinement: %s", validation.get("validation"))
-                return {"sql": refined_sql, "result": None, "schema": [], "error": validation.get("validation")}
-            if not Config.EXECUTE_SQL or self.executor is None:
-                result = self.simulate_result(refined_sql)
-            else:
-                try:
-                    result = self.executor.execute(refined_sql)
-                except Exception as e:
-                    logging.error("Error executing SQL query: %s", e)
-                    return {"sql": refined_sql, "result": None, "schema": [], "error": str(e)}
-            self.conversation_context.add_turn(feedback, refined_sql)
-            set_context(self.user_id, self.conversation_context.get_context())
-            schema_for_result = result.get("columns", []) if isinstance(result, dict) else []
-            logging.info("Query refinement complete for user_id: %s", self.user_id)
-            return {"sql": refined_sql, "result": result, "schema": schema_for_result}
-        else:
+        return drive(self._refine_query(feedback))
+
+    async def arefine_query(self, feedback: str) -> dict:
+        return await adrive(self._refine_query(feedback))
+
+    def _refine_query(self, feedback: str):
+        logging.info("Refining query for user_id: %s with feedback: %s", self.user_id, truncate(feedback))
+        yield from self._load_context(self.context_turns_needed(1))
+        if not self.conversation_context.history:
             logging.error("No previous query to refine for user_id: %s", self.user_id)
             return {"sql": None, "result": None, "schema": [], "error": "No previous query to refine."}
+        current_sql = self.conversation_context.history[-1].get("system")
+        # Problems the local validator finds in the current SQL (e.g. after a schema change)
+        # are described in the refinement prompt.
+        validation_errors = self.sql_validator.validate(current_sql)["errors"] if self.sql_validator else None
+        refined_sql, validation = yield from self._refine_and_validate(current_sql, feedback, validation_errors)
+        repair_attempts = Config.VALIDATION_REPAIR_ATTEMPTS
+        while (validation["validation"].strip().lower() != "yes" and validation.get("errors")
+               and not refined_sql.startswith("Error") and repair_attempts > 0):
+            # Give Gemini the structured errors of its own refinement and let it fix them.
+            repair_attempts -= 1
+            logging.info("Repairing refined SQL for user_id: %s", self.user_id)
+            refined_sql, validation = yield from self._refine_and_validate(refined_sql, feedback, validation["errors"])
+        if validation["validation"].strip().lower() != "yes":
+            logging.error("Validation failed for refinement: %s", validation["validation"])
+            return self.validation_error_response(refined_sql, validation)
+        if not Config.EXECUTE_SQL or self.executor is None:
+            result = self.simulate_result(refined_sql)
+        else:
+            try:
+                result = yield Call(self.executor.execute, refined_sql, clean=self.pipeline_mode == PIPELINE_STRICT,
+                                    budget=self.budget, afn=self.executor.aexecute)
+            except QueryTimeoutError as e:
+                logging.error("SQL query timed out: %s", e)
+                return {"sql": refined_sql, "result": None, "schema": [], "error": str(e), "status": "timed_out"}
+            except Exception as e:
+                logging.error("Error executing SQL query: %s", e)
+                return {"sql": refined_sql, "result": None, "schema": [], "error": str(e)}
+        self.conversation_context.add_turn(feedback, refined_sql)
+        yield Call(append_turn, self.context_id, feedback, refined_sql)
+        schema_for_result = result.get("columns", []) if isinstance(result, dict) else []
+        logging.info("Query refinement complete for user_id: %s", self.user_id)
+        return {"sql": refined_sql, "result": result, "schema": schema_for_result,
+                "status": result.get("status", "ok")}
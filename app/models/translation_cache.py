@@ -0,0 +1,90 @@
+# app/models/translation_cache.py
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+class TranslationCache:
+    """
+    Caches natural-language-to-SQL translations that passed validation.
+    Keys combine the normalized query, the schema fingerprint, the model name and the
+    pipeline mode, so a schema change or a model or pipeline switch never serves a stale
+    translation.
+    The first tier is an in-process LRU with a TTL; an optional second tier shares
+    entries between workers through Redis.
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, redis_client=None,
+                 key_prefix: str = "text2sql:sql:"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        logging.info("TranslationCache initialized. max_entries=%s ttl=%ss redis=%s",
+                     max_entries, ttl_seconds, redis_client is not None)
+
+    @staticmethod
+    def make_key(normalized_query: str, schema_fingerprint: str, model: str, pipeline: str = "") -> str:
+        text = " ".join(normalized_query.split())
+        raw = f"{model}\x00{pipeline}\x00{schema_fingerprint}\x00{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        if self.redis_client is not None:
+            try:
+                value = self.redis_client.get(self.key_prefix + key)
+            except Exception as e:
+                logging.error("Error reading translation cache from Redis: %s", e)
+                value = None
+            if value is not None:
+                sql = value.decode("utf-8") if isinstance(value, bytes) else value
+                self._store(key, sql)
+                with self._lock:
+                    self.redis_hits += 1
+                return sql
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, sql: str):
+        self._store(key, sql)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(self.key_prefix + key, sql, ex=max(1, int(self.ttl_seconds)))
+            except Exception as e:
+                logging.error("Error writing translation cache to Redis: %s", e)
+
+    def _store(self, key: str, sql: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, sql)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,157 @@
+# app/result_formats.py
+
+import csv
+import io
+import json
+import logging
+
+# Result formats the conversion endpoints can answer with, chosen by the payload's
+# "format" field or the Accept header.
+FORMAT_JSON = "json"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_CSV = "csv"
+FORMAT_ARROW = "arrow"
+
+MIMETYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_COLUMNAR: "application/vnd.text2sql.columnar+json",
+    FORMAT_CSV: "text/csv",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+ARROW_TYPES = {"integer": "int64", "real": "float64", "text": "string", "blob": "binary", None: "string"}
+
+# Value types a column's declared affinity is trusted for; SQLite itself does not enforce it.
+_COMPATIBLE = {"integer": {"integer"}, "real": {"integer", "real"}, "text": {"text"}, "blob": {"blob"}}
+
+def negotiate_format(requested, accept_mimetypes):
+    """
+    Returns the result format for a request: the payload's "format" if given, otherwise
+    the best match for the Accept header (JSON unless another format is preferred).
+    Returns None if the payload names an unknown format.
+    """
+    if requested is not None:
+        return requested if requested in MIMETYPES else None
+    best = accept_mimetypes.best_match(list(MIMETYPES.values()), default=MIMETYPES[FORMAT_JSON])
+    return next(name for name, mimetype in MIMETYPES.items() if mimetype == best)
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def value_type(value):
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "real"
+    if isinstance(value, str):
+        return "text"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "blob"
+    return None
+
+def column_types(columns: list, rows: list, declared: dict) -> list:
+    """
+    Returns the type of each result column: "integer", "real", "text", "blob", or None when
+    every value is NULL. A column named like a schema column takes that column's declared
+    type (see SchemaSnapshot.column_types) if the values fit it; otherwise the type follows
+    the values in rows (cursor.description carries only the names).
+    """
+    types = []
+    for index, name in enumerate(columns):
+        seen = {value_type(row[index]) for row in rows}
+        seen.discard(None)
+        affinity = declared.get(name.lower())
+        if affinity in _COMPATIBLE and seen <= _COMPATIBLE[affinity]:
+            types.append(affinity)
+        elif not seen:
+            types.append(None)
+        elif len(seen) == 1:
+            types.append(seen.pop())
+        else:
+            types.append("real" if seen == {"integer", "real"} else "text")
+    return types
+
+def columnar_result(columns: list, rows: list, types: list) -> dict:
+    """The result as one list of values per column rather than one list per row."""
+    data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    return {"columns": columns, "types": types, "data": data, "row_count": len(rows)}
+
+def _drain(buffer):
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+def csv_chunks(columns: list, batches):
+    """Encodes a header and batches of rows as CSV, yielding the text of each batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield _drain(buffer)
+    chunk = _drain(buffer)
+    if chunk:
+        yield chunk
+
+def _convert(value, column_type: str):
+    """
+    Converts a value to a column's type where that loses nothing (a whole float or a
+    numeric string to an integer, text to UTF-8 bytes, ...). Returns None if it cannot.
+    """
+    if value is None:
+        return None
+    try:
+        if column_type == "integer":
+            if isinstance(value, float):
+                return int(value) if value.is_integer() else None
+            return int(value) if isinstance(value, (int, str)) else None
+        if column_type == "real":
+            return float(value) if isinstance(value, (int, float, str)) else None
+        if column_type == "blob":
+            if isinstance(value, str):
+                return value.encode("utf-8")
+            return bytes(value) if isinstance(value, (bytes, bytearray, memoryview)) else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return value
+
+def arrow_chunks(columns: list, types: list, batches, metadata: dict = None):
+    """
+    Encodes batches of rows as an Arrow IPC stream with one record batch per batch of rows,
+    yielding the bytes written for each. Metadata values are stored JSON-encoded in the
+    schema metadata. Requires pyarrow.
+    The column types are fixed before the stream starts, while SQLite lets any value into
+    any column: a later value that does not fit its column's type is converted if it can
+    be (see _convert) and sent as null otherwise, with one warning per stream.
+    """
+    import pyarrow as pa
+    fields = [pa.field(name, getattr(pa, ARROW_TYPES[column_type])()) for name, column_type in zip(columns, types)]
+    schema = pa.schema(fields, metadata={key: json.dumps(value) for key, value in (metadata or {}).items()})
+    sink = io.BytesIO()
+    warned = False
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            if not rows:
+                continue
+            arrays = []
+            for values, field, column_type in zip(zip(*rows), fields, types):
+                if column_type in ("text", None):
+                    values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+                try:
+                    array = pa.array(list(values), type=field.type)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+                    if not warned:
+                        logging.warning("Arrow column %r holds values that are not %s; converting them or "
+                                        "sending null.", field.name, column_type)
+                        warned = True
+                    array = pa.array([_convert(value, column_type) for value in values], type=field.type)
+                arrays.append(array)
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            yield _drain(sink)
+    # Closing the writer appends the end-of-stream marker.
+    yield _drain(sink)
@@ -1,14 +1,206 @@
+import json
 import logging
-from flask import Blueprint, request, jsonify, render_template
-from app.models.text_to_sql_agent import TextToSQLAgent
+import time
+from flask import Blueprint, request, jsonify, render_template, current_app, Response, stream_with_context, g
+from app.models.text_to_sql_agent import PIPELINE_SINGLE, PIPELINE_STRICT
+from app.streaming import ndjson_stream, open_stream, encoded_stream, is_pageable, PageTokens, ndjson_line
+from app.result_formats import (
+    FORMAT_ARROW, FORMAT_COLUMNAR, FORMAT_CSV, FORMAT_JSON, MIMETYPES, arrow_available, arrow_chunks,
+    column_types, columnar_result, csv_chunks, negotiate_format
+)
+from app.batch import QueryBatch
+from app.models.database import QueryTimeoutError
+from app.models.database_router import UnknownDatabaseError
+from app.timings import start_timings, current_timings, stage
+from app.logs import start_request_log, finish_request_log, truncate
+from app.metrics import (
+    registry as metrics_registry, REQUESTS, REQUEST_SECONDS, LLM_CALLS_PER_REQUEST, DATABASE_REQUESTS,
+    DATABASE_REQUEST_SECONDS
+)
 from config import Config
 
 bp = Blueprint('routes', __name__)
 
+def get_registry():
+    """Returns the process-wide AgentRegistry created in create_app()."""
+    return current_app.extensions["agent_registry"]
+
+def route_database(name):
+    """
+    Serves the request from the named database (see DatabaseRouter) if one is given.
+    Returns an error response if the name is invalid or unknown, otherwise None.
+    """
+    if name is None:
+        return None
+    try:
+        g.registry = get_registry().databases.get(name)
+    except UnknownDatabaseError as e:
+        logging.error("Cannot route request to database %r: %s", name, e)
+        return jsonify({"error": str(e)}), 404
+    g.database = name
+    return None
+
+def request_registry():
+    """The registry serving the current request: its named database's, or the default one."""
+    return g.get("registry") or get_registry()
+
+def request_budget(data: dict):
+    """
+    Builds the execution budget for a request: the configured limits, lowered by the
+    optional "timeout" (seconds) and "max_rows" payload fields. "result_cache": false
+    bypasses the result cache. Returns None if invalid.
+    """
+    try:
+        timeout = float(data["timeout"]) if data.get("timeout") is not None else None
+        max_rows = int(data["max_rows"]) if data.get("max_rows") is not None else None
+    except (TypeError, ValueError):
+        return None
+    if (timeout is not None and timeout <= 0) or (max_rows is not None and max_rows <= 0):
+        return None
+    use_cache = data.get("result_cache")
+    if use_cache is not None and not isinstance(use_cache, bool):
+        return None
+    return request_registry().default_budget.tightened(timeout=timeout, max_rows=max_rows, use_cache=use_cache)
+
+def agent_options(data: dict):
+    """
+    Reads the optional read_only, execute_sql, pipeline_mode, timeout and max_rows payload
+    fields into AgentRegistry.create_agent keyword arguments.
+    Returns (options, None), or (None, error response) if invalid.
+    """
+    pipeline_mode = data.get("pipeline_mode")
+    if pipeline_mode not in (None, PIPELINE_SINGLE, PIPELINE_STRICT):
+        return None, (jsonify({"error": "pipeline_mode must be 'single' or 'strict'"}), 400)
+    budget = request_budget(data)
+    if budget is None:
+        return None, (jsonify({"error": "timeout and max_rows must be positive numbers"}), 400)
+    options = {"read_only": data.get("read_only", Config.READ_ONLY), "execute_sql": data.get("execute_sql"),
+               "pipeline_mode": pipeline_mode, "budget": budget}
+    return options, None
+
+def agent_from_payload(data: dict):
+    """
+    Builds an agent for the payload's user_id and options (see agent_options).
+    Returns (agent, None), or (None, error response) if invalid.
+    """
+    options, error = agent_options(data)
+    if error:
+        return None, error
+    return request_registry().create_agent(data.get("user_id"), **options), None
+
+def result_format(data: dict):
+    """
+    Negotiates the result format of a conversion endpoint from the payload's "format"
+    ("json", "columnar", "csv" or "arrow") or the Accept header.
+    Returns (format, None), or (None, error response) if invalid or unavailable.
+    """
+    negotiated = negotiate_format(data.get("format"), request.accept_mimetypes)
+    if negotiated is None:
+        return None, (jsonify({"error": "format must be one of " + ", ".join(MIMETYPES)}), 400)
+    if negotiated == FORMAT_ARROW and not arrow_available():
+        return None, (jsonify({"error": "Arrow output requires the pyarrow package"}), 406)
+    return negotiated, None
+
+def serialize(response_data: dict, response_format: str = FORMAT_JSON):
+    """
+    Response for a conversion endpoint in the negotiated format (see result_format).
+    With "debug": true in the payload, the request's per-stage timings (in milliseconds)
+    and LLM call count are included. Responses without a result (errors) are always JSON.
+    """
+    timings = current_timings()
+    if timings is not None and (request.get_json(silent=True) or {}).get("debug"):
+        response_data = dict(response_data, timings=timings.as_dict())
+    with stage("serialize"):
+        result = response_data.get("result")
+        if response_format == FORMAT_JSON or not isinstance(result, dict) or "columns" not in result:
+            return jsonify(response_data), 200
+        return encode_result(response_data, response_format), 200
+
+def encode_result(response_data: dict, response_format: str):
+    """
+    Encodes a conversion result as columnar JSON (the other response fields unchanged), CSV
+    or an Arrow IPC stream. CSV and Arrow carry only the rows; the result status and cached
+    flag are sent as headers and, for Arrow, the SQL as schema metadata as well.
+    """
+    columns, rows = response_data["result"]["columns"], response_data["result"]["rows"]
+    types = column_types(columns, rows, request_registry().schema_manager.get_column_types())
+    if response_format == FORMAT_COLUMNAR:
+        response = jsonify(dict(response_data, result=columnar_result(columns, rows, types)))
+        response.mimetype = MIMETYPES[FORMAT_COLUMNAR]
+        return response
+    status = response_data.get("status", "ok")
+    headers = {"X-Result-Status": status, "X-Result-Cached": json.dumps(response_data.get("cached"))}
+    if response_format == FORMAT_CSV:
+        body = "".join(csv_chunks(columns, [rows]))
+    else:
+        metadata = {"sql": response_data.get("sql"), "status": status, "cached": response_data.get("cached")}
+        body = b"".join(arrow_chunks(columns, types, [rows], metadata))
+    return Response(body, mimetype=MIMETYPES[response_format], headers=headers)
+
+def record_conversion(user_id: str, query: str, response_data: dict):
+    """
+    Marks a conversion for the audit log; it is queued once the response is ready, together
+    with the request's latency, stage timings and LLM call count.
+    """
+    g.conversions.append((user_id, query, response_data))
+
+@bp.before_request
+def begin_stage_timings():
+    g.request_start = time.perf_counter()
+    g.conversions = []
+    start_timings()
+    start_request_log()
+
+@bp.after_request
+def record_request_metrics(response):
+    """
+    Records the request in the /metrics histograms; with STAGE_TIMINGS on, also reports
+    the per-stage durations in a Server-Timing header. Slow requests go to the slow-request log.
+    """
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.request_start
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    database = g.get("database")
+    if database is not None:
+        DATABASE_REQUESTS.inc(database=database, endpoint=endpoint, status=response.status_code)
+        DATABASE_REQUEST_SECONDS.observe(elapsed, database=database)
+    timings = current_timings()
+    if timings is not None:
+        LLM_CALLS_PER_REQUEST.observe(timings.llm_calls, endpoint=endpoint)
+        if current_app.config.get("STAGE_TIMINGS") and timings.durations:
+            response.headers["Server-Timing"] = timings.server_timing()
+    if g.conversions:
+        log_conversions(endpoint, elapsed, timings)
+    finish_request_log(endpoint, elapsed, response.status_code, timings.as_dict() if timings is not None else None)
+    return response
+
+def log_conversions(endpoint: str, elapsed: float, timings):
+    conversion_logger = get_registry().conversion_logger
+    if conversion_logger is None:
+        return
+    measured = timings.as_dict() if timings is not None else {}
+    for user_id, query, response_data in g.conversions:
+        conversion_logger.log(
+            user_id, query, response_data.get("sql"), endpoint=endpoint,
+            status="error" if response_data.get("error") else response_data.get("status", "ok"),
+            error=response_data.get("error"), cached=response_data.get("cached"),
+            latency_ms=round(elapsed * 1000, 3), llm_calls=measured.get("llm_calls"),
+            stages_ms=measured.get("stages_ms")
+        )
+
+@bp.route("/metrics")
+def metrics():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
 @bp.route("/")
 def index():
     return render_template("index.html")
 
+@bp.route("/stats")
+def stats():
+    return jsonify(get_registry().stats()), 200
+
 @bp.route('/query', methods=['POST'])
 def query():
     data = request.get_json()
@@ -18,20 +210,189 @@ def query():
         logging.error("Missing user_id or query parameter in /query request.")
         return jsonify({"error": "Missing user_id or query parameter"}), 400
     logging.info("Received /query request from user_id=%s", user_id)
-    # Optionally override read_only and execute_sql from payload.
-    execute_sql = data.get("execute_sql")
-    read_only = data.get("read_only", Config.READ_ONLY)
-    agent = TextToSQLAgent(
-        schema_info=Config.STATIC_SCHEMA_INFO,
-        db_file=Config.DB_FILE,
-        user_id=user_id,
-        read_only=read_only,
-        use_dynamic_schema=Config.USE_DYNAMIC_SCHEMA,
-        use_gemini=True,
-        execute_sql=execute_sql
-    )
+    error = route_database(data.get("database"))
+    if error:
+        return error
+    # Optionally override read_only, execute_sql, pipeline_mode and the budget from the payload.
+    options, error = agent_options(data)
+    if error:
+        return error
+    response_format, error = result_format(data)
+    if error:
+        return error
+    budget = options["budget"]
+    agent = request_registry().create_agent(user_id, **options)
+    # Large results can be streamed ("stream": true or Accept: application/x-ndjson) as NDJSON,
+    # or as CSV/Arrow straight from the cursor with that format, or paged ("page_size": n, then
+    # GET /query/page with the returned next_page_token).
+    stream = data.get("stream") or request.accept_mimetypes.best == "application/x-ndjson"
+    page_size = data.get("page_size")
+    if page_size is not None:
+        page_size = parse_page_size(page_size)
+        if page_size is None:
+            return jsonify({"error": f"page_size must be an integer between 1 and {Config.MAX_PAGE_SIZE}"}), 400
+    if (stream or page_size) and Config.EXECUTE_SQL and agent.executor is not None:
+        translation = agent.prepare_query(user_query)
+        record_conversion(user_id, user_query, translation)
+        if "error" in translation:
+            return jsonify(translation), 200
+        if stream and response_format in (FORMAT_CSV, FORMAT_ARROW):
+            logging.info("Streaming %s results for user_id=%s. Generated SQL: %s", response_format, user_id,
+                         truncate(translation["sql"]))
+            try:
+                columns, first, batches = open_stream(agent.executor, translation, Config.STREAM_BATCH_SIZE,
+                                                      budget=budget)
+            except Exception as e:
+                logging.error("Error starting %s result stream: %s", response_format, e)
+                return execution_error(translation["sql"], e)
+            agent.cache_translation(translation)
+            chunks = encoded_stream(columns, first, batches, translation, response_format,
+                                    request_registry().schema_manager.get_column_types())
+            headers = {"X-Result-Status": "ok", "X-Result-Cached": json.dumps(translation["cached"])}
+            return Response(stream_with_context(chunks), mimetype=MIMETYPES[response_format], headers=headers)
+        if stream:
+            logging.info("Streaming results for user_id=%s. Generated SQL: %s", user_id, truncate(translation["sql"]))
+            batches = ndjson_stream(agent.executor, translation, Config.STREAM_BATCH_SIZE, budget=budget,
+                                    on_start=lambda: agent.cache_translation(translation))
+            return Response(stream_with_context(batches), mimetype="application/x-ndjson")
+        if is_pageable(translation["executable_sql"]):
+            return page_response(agent.executor, translation["executable_sql"], 0, page_size,
+                                 sql_query=translation["sql"], cached=translation["cached"], budget=budget,
+                                 on_success=lambda: agent.cache_translation(translation))
+        # Not pageable (e.g. PRAGMA): the prepared translation is answered in one response.
+        try:
+            result = agent.executor.execute(translation["executable_sql"], clean=False, budget=budget)
+        except Exception as e:
+            logging.error("Error executing SQL query: %s", e)
+            return execution_error(translation["sql"], e)
+        agent.cache_translation(translation)
+        return serialize({"sql": translation["sql"], "result": result, "schema": result.get("columns", []),
+                          "cached": translation["cached"], "status": result.get("status", "ok")}, response_format)
     response_data = agent.process_query(user_query)
-    logging.info("Processed query for user_id=%s. Generated SQL: %s", user_id, response_data["sql"])
+    record_conversion(user_id, user_query, response_data)
+    logging.info("Processed query for user_id=%s. Generated SQL: %s", user_id, truncate(response_data["sql"]))
+    return serialize(response_data, response_format)
+
+@bp.route('/query/async', methods=['POST'])
+async def query_async():
+    """
+    Same contract as /query (without streaming or paging), served by the async pipeline:
+    the conversion runs on the shared AsyncRuntime loop under the LLM concurrency limit.
+    The pipeline is the one /query runs (see TextToSQLAgent), with its LLM and blocking
+    calls awaited. Under the WSGI worker the request thread still waits for the response.
+    """
+    data = request.get_json()
+    user_id = data.get("user_id")
+    user_query = data.get("query")
+    if not user_id or not user_query:
+        logging.error("Missing user_id or query parameter in /query/async request.")
+        return jsonify({"error": "Missing user_id or query parameter"}), 400
+    logging.info("Received /query/async request from user_id=%s", user_id)
+    error = route_database(data.get("database"))
+    if error:
+        return error
+    agent, error = agent_from_payload(data)
+    if error:
+        return error
+    response_format, error = result_format(data)
+    if error:
+        return error
+    response_data = await request_registry().async_runtime.run(agent.aprocess_query(user_query))
+    record_conversion(user_id, user_query, response_data)
+    logging.info("Processed query for user_id=%s. Generated SQL: %s", user_id, truncate(response_data["sql"]))
+    return serialize(response_data, response_format)
+
+@bp.route('/query/batch', methods=['POST'])
+def query_batch():
+    """
+    Answers a list of {"user_id", "query"} items, sharing one set of components across the
+    batch. Identical normalized queries run once and distinct ones run concurrently.
+    Results come back in item order, or as NDJSON lines in completion order with "stream": true.
+    """
+    data = request.get_json()
+    items = data.get("items")
+    if (not isinstance(items, list) or not items
+            or not all(isinstance(item, dict) and item.get("user_id") and item.get("query") for item in items)):
+        logging.error("Invalid items in /query/batch request.")
+        return jsonify({"error": "items must be a non-empty list of {user_id, query} objects"}), 400
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"A batch may contain at most {Config.BATCH_MAX_ITEMS} items"}), 400
+    error = route_database(data.get("database"))
+    if error:
+        return error
+    options, error = agent_options(data)
+    if error:
+        return error
+    logging.info("Received /query/batch request with %s items", len(items))
+    batch = QueryBatch(request_registry(), items, Config.BATCH_MAX_CONCURRENCY, **options)
+    stream = data.get("stream") or request.accept_mimetypes.best == "application/x-ndjson"
+    if stream:
+        def lines():
+            for index, result in batch.iter_completed():
+                record_conversion(items[index]["user_id"], items[index]["query"], result)
+                yield ndjson_line(dict(result, index=index))
+            yield ndjson_line({"done": True, "count": len(items), "distinct_queries": len(batch.groups)})
+            # The response was already handed over, so the conversions are logged here.
+            log_conversions(request.url_rule.rule, time.perf_counter() - g.request_start, current_timings())
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+    results = batch.results()
+    for item, result in zip(items, results):
+        record_conversion(item["user_id"], item["query"], result)
+    return serialize({"results": results, "distinct_queries": len(batch.groups)})
+
+@bp.route('/query/page', methods=['GET'])
+def query_page():
+    payload = PageTokens(current_app.secret_key).loads(request.args.get("page_token", ""))
+    if payload is None:
+        logging.error("Invalid page_token in /query/page request.")
+        return jsonify({"error": "Invalid page_token"}), 400
+    error = route_database(payload.get("database"))
+    if error:
+        return error
+    # Pages are always read through the read-only layer.
+    executor = request_registry().get_executor(read_only=True)
+    return page_response(executor, payload["sql"], payload["offset"], payload["page_size"])
+
+def execution_error(sql_query: str, error: Exception):
+    """JSON response for a query that failed to execute ("status": "timed_out" past the deadline)."""
+    response_data = {"sql": sql_query, "result": None, "schema": [], "error": str(error)}
+    if isinstance(error, QueryTimeoutError):
+        response_data["status"] = "timed_out"
+    return jsonify(response_data), 200
+
+def parse_page_size(value):
+    """A page size between 1 and MAX_PAGE_SIZE, or None if value is not one."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        page_size = int(value)
+    except ValueError:
+        return None
+    return page_size if 1 <= page_size <= Config.MAX_PAGE_SIZE else None
+
+def page_response(executor, executable_sql: str, offset: int, page_size: int, sql_query: str = None,
+                  cached: bool = None, budget=None, on_success=None):
+    try:
+        page = executor.fetch_page(executable_sql, offset, page_size, budget=budget)
+    except Exception as e:
+        logging.error("Error fetching result page: %s", e)
+        return execution_error(sql_query or executable_sql, e)
+    if on_success is not None:
+        on_success()
+    next_page_token = None
+    if page["has_more"]:
+        next_page_token = PageTokens(current_app.secret_key).dumps(executable_sql, offset + page_size, page_size,
+                                                             database=g.get("database"))
+    response_data = {
+        "sql": sql_query or executable_sql,
+        "result": {"columns": page["columns"], "rows": page["rows"]},
+        "schema": page["columns"],
+        "offset": offset,
+        "next_page_token": next_page_token,
+        "status": page["status"],
+    }
+    if cached is not None:
+        response_data["cached"] = cached
     return jsonify(response_data), 200
 
 @bp.route('/refine', methods=['POST'])
@@ -42,21 +403,49 @@ def refine():
     if not user_id or not feedback:
         logging.error("Missing user_id or feedback parameter in /refine request.")
         return jsonify({"error": "Missing user_id or feedback parameter"}), 400
-    logging.info("Received /refine request from user_id=%s with feedback: %s", user_id, feedback)
-    execute_sql = data.get("execute_sql")
-    read_only = data.get("read_only", Config.READ_ONLY)
-    agent = TextToSQLAgent(
-        schema_info=Config.STATIC_SCHEMA_INFO,
-        db_file=Config.DB_FILE,
-        user_id=user_id,
-        read_only=read_only,
-        use_dynamic_schema=Config.USE_DYNAMIC_SCHEMA,
-        use_gemini=True,
-        execute_sql=execute_sql
-    )
+    logging.info("Received /refine request from user_id=%s with feedback: %s", user_id, truncate(feedback))
+    error = route_database(data.get("database"))
+    if error:
+        return error
+    agent, error = agent_from_payload(data)
+    if error:
+        return error
+    response_format, error = result_format(data)
+    if error:
+        return error
     response_data = agent.refine_query(feedback)
+    record_conversion(user_id, feedback, response_data)
     if response_data.get("sql") is None:
         logging.error("No previous query found to refine for user_id=%s", user_id)
         return jsonify({"error": "No previous query to refine"}), 400
-    logging.info("Refined SQL for user_id=%s: %s", user_id, response_data["sql"])
-    return jsonify(response_data), 200
+    logging.info("Refined SQL for user_id=%s: %s", user_id, truncate(response_data["sql"]))
+    return serialize(response_data, response_format)
+
+@bp.route('/refine/async', methods=['POST'])
+async def refine_async():
+    """
+    Same contract as /refine, served by the async pipeline.
+    """
+    data = request.get_json()
+    user_id = data.get("user_id")
+    feedback = data.get("feedback")
+    if not user_id or not feedback:
+        logging.error("Missing user_id or feedback parameter in /refine/async request.")
+        return jsonify({"error": "Missing user_id or feedback parameter"}), 400
+    logging.info("Received /refine/async request from user_id=%s with feedback: %s", user_id, truncate(feedback))
+    error = route_database(data.get("database"))
+    if error:
+        return error
+    agent, error = agent_from_payload(data)
+    if error:
+        return error
+    response_format, error = result_format(data)
+    if error:
+        return error
+    response_data = await request_registry().async_runtime.run(agent.arefine_query(feedback))
+    record_conversion(user_id, feedback, response_data)
+    if response_data.get("sql") is None:
+        logging.error("No previous query found to refine for user_id=%s", user_id)
+        return jsonify({"error": "No previous query to refine"}), 400
+    logging.info("Refined SQL for user_id=%s: %s", user_id, truncate(response_data["sql"]))
+    return serialize(response_data, response_format)
@@ -0,0 +1,98 @@
+# app/streaming.py
+
+import itertools
+import json
+import logging
+from app.models.database import QueryTimeoutError
+from app.result_formats import FORMAT_CSV, arrow_chunks, column_types, csv_chunks
+from itsdangerous import URLSafeSerializer, BadSignature
+
+def ndjson_line(value) -> str:
+    # Compact separators; non-JSON values (e.g. BLOBs) are rendered as strings.
+    return json.dumps(value, separators=(",", ":"), default=str) + "\n"
+
+def ndjson_stream(executor, translation: dict, batch_size: int, budget=None, on_start=None):
+    """
+    Yields an NDJSON response for an already-translated query: a header line with the SQL
+    and columns, one line per batch of rows, and a final line with the row count (or the
+    error that stopped the stream, with "status": "timed_out" past the deadline).
+    Only one batch is held in memory at a time. on_start is called once the query has run.
+    """
+    row_count = 0
+    try:
+        batches = executor.iter_execute(translation["executable_sql"], batch_size=batch_size, budget=budget)
+        columns = next(batches)
+        if on_start is not None:
+            on_start()
+        yield ndjson_line({"sql": translation["sql"], "columns": columns, "cached": translation["cached"]})
+        for rows in batches:
+            row_count += len(rows)
+            yield ndjson_line({"rows": rows})
+        yield ndjson_line({"done": True, "row_count": row_count, "status": "ok"})
+    except QueryTimeoutError as e:
+        logging.error("Streaming query timed out: %s", e)
+        yield ndjson_line({"done": False, "row_count": row_count, "status": "timed_out", "error": str(e)})
+    except Exception as e:
+        logging.error("Error while streaming query results: %s", e)
+        yield ndjson_line({"done": False, "row_count": row_count, "error": str(e)})
+
+def open_stream(executor, translation: dict, batch_size: int, budget=None):
+    """
+    Starts streaming an already-translated query: returns its columns, its first batch of
+    rows and an iterator over all batches (the first included). Errors before the first
+    batch, including QueryTimeoutError, are raised here, while a normal response can
+    still be sent.
+    """
+    batches = executor.iter_execute(translation["executable_sql"], batch_size=batch_size, budget=budget)
+    try:
+        columns = next(batches)
+        first = next(batches, [])
+    except BaseException:
+        batches.close()
+        raise
+    return columns, first, itertools.chain([first], batches)
+
+def encoded_stream(columns: list, first: list, batches, translation: dict, result_format: str,
+                   declared_types: dict):
+    """
+    Streams a query opened with open_stream as CSV or an Arrow IPC stream, one chunk per
+    batch of rows. Arrow column types are fixed from the first batch.
+    Neither format can carry an error once the response has started, so an error (or the
+    deadline) is logged and re-raised: the transfer is aborted, and an Arrow stream lacks
+    its end-of-stream marker, so clients can tell the result is incomplete.
+    """
+    try:
+        if result_format == FORMAT_CSV:
+            yield from csv_chunks(columns, batches)
+        else:
+            metadata = {"sql": translation["sql"], "cached": translation["cached"]}
+            yield from arrow_chunks(columns, column_types(columns, first, declared_types), batches, metadata)
+    except Exception as e:
+        logging.error("Error while streaming %s query results: %s", result_format, e)
+        raise
+
+def is_pageable(sql_query: str) -> bool:
+    """Only plain SELECT/WITH queries can be wrapped in LIMIT/OFFSET for paging."""
+    return sql_query.lstrip().lower().startswith(("select", "with"))
+
+class PageTokens:
+    """
+    Issues and reads opaque, signed page tokens. A token carries the SQL to page through
+    and the next offset (and the database it runs on, when routed); the signature stops
+    clients from substituting their own SQL.
+    """
+    def __init__(self, secret_key: str):
+        self.serializer = URLSafeSerializer(secret_key, salt="text2sql-page-token")
+
+    def dumps(self, sql_query: str, offset: int, page_size: int, database: str = None) -> str:
+        payload = {"sql": sql_query, "offset": offset, "page_size": page_size}
+        if database is not None:
+            payload["database"] = database
+        return self.serializer.dumps(payload)
+
+    def loads(self, token: str):
+        """Returns the token's payload, or None if the token is malformed or forged."""
+        try:
+            return self.serializer.loads(token)
+        except BadSignature:
+            return None
@@ -0,0 +1,70 @@
+# app/timings.py
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.metrics import STAGE_SECONDS
+
+_current = ContextVar("stage_timings", default=None)
+
+class StageTimings:
+    """
+    Wall-clock time spent in each pipeline stage (parse, normalize, generate, validate,
+    clean, execute, context_load, context_save, serialize) during one request.
+    A stage entered several times (e.g. a refinement repair round) accumulates.
+    Also counts the LLM calls the request made.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.llm_calls = 0
+        self.prompt_tokens = {}
+        # Blocking stages of the async pipeline record from database pool threads.
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def count_llm_call(self):
+        with self._lock:
+            self.llm_calls += 1
+
+    def add_prompt_tokens(self, kind: str, tokens: int):
+        with self._lock:
+            self.prompt_tokens[kind] = self.prompt_tokens.get(kind, 0) + tokens
+
+    def as_dict(self) -> dict:
+        """The durations in milliseconds, LLM call count and prompt tokens, for debug responses."""
+        with self._lock:
+            stages = {name: round(seconds * 1000, 3) for name, seconds in self.durations.items()}
+            return {"stages_ms": stages, "llm_calls": self.llm_calls, "prompt_tokens": dict(self.prompt_tokens)}
+
+    def server_timing(self) -> str:
+        """Renders the durations as a Server-Timing header value, in milliseconds."""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.durations.items())
+
+def start_timings() -> StageTimings:
+    """Starts collecting stage timings for the current request (or task) and returns them."""
+    timings = StageTimings()
+    _current.set(timings)
+    return timings
+
+def current_timings():
+    return _current.get()
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the enclosed block as the named stage: always into the stage duration histogram,
+    and into the current request's timings if they were started.
+    """
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if timings is not None:
+            timings.add(name, elapsed)
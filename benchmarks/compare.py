@@ -0,0 +1,45 @@
+# benchmarks/compare.py
+"""
+Compares two benchmark result files scenario by scenario:
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+
+import argparse
+import json
+
+def change(before, after) -> str:
+    if before is None or after is None:
+        return "n/a"
+    if not before:
+        return f"{after}"
+    return f"{after} ({(after - before) / before * 100:+.1f}%)"
+
+def compare(before: dict, after: dict, metric: str = "p95"):
+    print(f"before: {before.get('commit')}  after: {after.get('commit')}")
+    scenarios = {(s["tables"], s["rows"]): s for s in before["scenarios"]}
+    for new in after["scenarios"]:
+        old = scenarios.get((new["tables"], new["rows"]))
+        if old is None:
+            continue
+        print(f"\n{new['tables']} tables / {new['rows']} rows")
+        print(f"  throughput_rps  {old['throughput_rps']} -> {change(old['throughput_rps'], new['throughput_rps'])}")
+        for section in ("endpoints_ms", "stages_ms"):
+            for name, summary in new[section].items():
+                previous = old[section].get(name, {})
+                print(f"  {name:14}  {metric} {previous.get(metric)} -> {change(previous.get(metric), summary.get(metric))}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--metric", choices=["mean", "p50", "p95", "p99", "max"], default="p95")
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    compare(before, after, args.metric)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# benchmarks/run.py
+"""
+End-to-end benchmark: drives /query and /refine through the Flask app with the offline
+LLM backend against synthetic SQLite databases, and reports throughput plus p50/p95/p99
+latency per endpoint and per pipeline stage (from the Server-Timing header).
+
+    python -m benchmarks.run --tables 5 200 2000 --rows 1000 1000000 --requests 200 --concurrency 8
+
+Results are written as JSON to benchmarks/results/ (compare runs with benchmarks.compare).
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_db import DATA_DIR, build_database, table_name
+from config import Config
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def percentile(sorted_values: list, p: float) -> float:
+    # Nearest-rank percentile.
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+def parse_server_timing(header: str) -> dict:
+    durations = {}
+    for part in filter(None, (p.strip() for p in (header or "").split(","))):
+        name, _, dur = part.partition(";dur=")
+        durations[name] = float(dur)
+    return durations
+
+def questions(tables: int, rng: random.Random):
+    templates = ["list all {t} records", "how many rows are in {t}", "show the {t} entries"]
+    while True:
+        yield rng.choice(templates).format(t=table_name(rng.randrange(tables)))
+
+def make_app(db_file: str, args):
+    from app import create_app
+    config_class = type("BenchmarkConfig", (Config,), {
+        "DB_FILE": db_file,
+        "SECRET_KEY": "benchmark",
+        "USE_DYNAMIC_SCHEMA": True,
+        "READ_ONLY": True,
+        "LLM_BACKEND": "local",
+        "LOCAL_LLM_LATENCY": args.llm_latency,
+        "LOCAL_LLM_LATENCY_JITTER": args.llm_jitter,
+        "LOCAL_LLM_ERROR_RATE": args.llm_error_rate,
+        "LOCAL_LLM_SEED": args.seed,
+        "STAGE_TIMINGS": True,
+        "TRANSLATION_CACHE_ENABLED": args.translation_cache,
+        "PIPELINE_MODE": args.pipeline_mode,
+        "CONVERSION_LOG_DB": os.path.join(DATA_DIR, "conversion_log.db"),
+    })
+    return create_app(config_class)
+
+def run_scenario(tables: int, rows: int, args) -> dict:
+    db_file = build_database(tables, rows)
+    app = make_app(db_file, args)
+    rng = random.Random(args.seed)
+    question_iter = questions(tables, rng)
+    lock = threading.Lock()
+    endpoint_latencies = {"/query": [], "/refine": []}
+    stage_durations = {}
+    errors = 0
+
+    def one(i: int, record: bool):
+        nonlocal errors
+        client = app.test_client()
+        user_id = f"bench-{i % args.users}"
+        with lock:
+            question = next(question_iter)
+            refine = rng.random() < args.refine_ratio
+        calls = [("/query", {"user_id": user_id, "query": question})]
+        if refine:
+            calls.append(("/refine", {"user_id": user_id, "feedback": "only the first 10 rows"}))
+        for path, payload in calls:
+            start = time.perf_counter()
+            response = client.post(path, json=payload)
+            elapsed = (time.perf_counter() - start) * 1000
+            failed = response.status_code != 200 or "error" in (response.get_json() or {})
+            if not record:
+                continue
+            with lock:
+                endpoint_latencies[path].append(elapsed)
+                errors += failed
+                for name, ms in parse_server_timing(response.headers.get("Server-Timing")).items():
+                    stage_durations.setdefault(name, []).append(ms)
+
+    for i in range(args.warmup):
+        one(i, record=False)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda i: one(i, record=True), range(args.requests)))
+    wall = time.perf_counter() - start
+    total = sum(len(v) for v in endpoint_latencies.values())
+    return {
+        "tables": tables,
+        "rows": rows,
+        "requests": args.requests,
+        "http_calls": total,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 2) if wall else None,
+        "errors": errors,
+        "endpoints_ms": {path: summarize(v) for path, v in endpoint_latencies.items()},
+        "stages_ms": {name: summarize(v) for name, v in sorted(stage_durations.items())},
+    }
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True))
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def print_scenario(result: dict):
+    print(f"\n{result['tables']} tables / {result['rows']} rows: {result['throughput_rps']} req/s, "
+          f"{result['errors']} errors")
+    print(f"  {'':14}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for name, summary in list(result["endpoints_ms"].items()) + list(result["stages_ms"].items()):
+        if summary["count"]:
+            print(f"  {name:14}{summary['p50']:>10}{summary['p95']:>10}{summary['p99']:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end text2sql benchmark with an offline LLM.")
+    parser.add_argument("--tables", type=int, nargs="+", default=[5, 200])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="distinct user_ids (conversation contexts)")
+    parser.add_argument("--refine-ratio", type=float, default=0.25, help="share of queries followed by /refine")
+    parser.add_argument("--pipeline-mode", choices=["single", "strict"], default="single")
+    parser.add_argument("--translation-cache", action="store_true", help="keep the translation cache on")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="injected LLM latency (seconds)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--context-store", choices=["memory", "redis"], default="memory",
+                        help="'redis' uses REDIS_HOST/REDIS_PORT like the app")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.context_store == "memory":
+        from app.contex_store import create_context_store, set_context_store
+        set_context_store(create_context_store({"CONTEXT_BACKEND": "memory"}))
+
+    revision = git_revision()
+    results = {
+        **revision,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "scenarios": [],
+    }
+    for tables in args.tables:
+        for rows in args.rows:
+            result = run_scenario(tables, rows, args)
+            results["scenarios"].append(result)
+            print_scenario(result)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{(revision['commit'] or 'unknown')[:8]}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/synthetic_db.py
+
+import logging
+import os
+import random
+import sqlite3
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+CATEGORIES = ["alpha", "beta", "gamma", "delta", "epsilon"]
+INSERT_CHUNK = 50000
+
+def table_name(index: int) -> str:
+    return f"t{index:04d}"
+
+def build_database(tables: int, rows: int, path: str = None, seed: int = 42) -> str:
+    """
+    Creates (once) a synthetic SQLite database with the given number of tables and total
+    number of rows, spread evenly over the tables. Every table has the same columns and a
+    foreign key to the previous table, so joins and schema size both scale with it.
+    Returns the database path; an existing file for the same parameters is reused.
+    """
+    path = path or os.path.join(DATA_DIR, f"synthetic_{tables}t_{rows}r.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    logging.info("Building synthetic database %s (%s tables, %s rows).", path, tables, rows)
+    rng = random.Random(seed)
+    rows_per_table = max(1, rows // tables)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    # The file is only renamed into place once complete, so durability is not needed.
+    conn.execute("PRAGMA journal_mode = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    for index in range(tables):
+        parent = f" REFERENCES {table_name(index - 1)}(id)" if index else ""
+        conn.execute(
+            f"CREATE TABLE {table_name(index)} (id INTEGER PRIMARY KEY, parent_id INTEGER{parent}, "
+            f"name TEXT, category TEXT, amount REAL, created_at TEXT)"
+        )
+        for start in range(0, rows_per_table, INSERT_CHUNK):
+            count = min(INSERT_CHUNK, rows_per_table - start)
+            conn.executemany(
+                f"INSERT INTO {table_name(index)} (parent_id, name, category, amount, created_at) "
+                f"VALUES (?, ?, ?, ?, ?)",
+                (
+                    (rng.randint(1, rows_per_table), f"item {start + i}", rng.choice(CATEGORIES),
+                     round(rng.uniform(0, 1000), 2), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+                    for i in range(count)
+                ),
+            )
+        conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return path
@@ -8,20 +8,176 @@ class Config:
     USE_GEMINI = True
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "<GEMINI API KEY>")
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+    # LLM backend: "gemini" calls the Gemini API; "local" answers offline (canned responses from
+    # the LOCAL_LLM_RESPONSES JSON file, else rule-based SQL) with injected latency and errors.
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+    LOCAL_LLM_RESPONSES = os.getenv("LOCAL_LLM_RESPONSES")
+    LOCAL_LLM_LATENCY = float(os.getenv("LOCAL_LLM_LATENCY", "0"))
+    LOCAL_LLM_LATENCY_JITTER = float(os.getenv("LOCAL_LLM_LATENCY_JITTER", "0"))
+    LOCAL_LLM_ERROR_RATE = float(os.getenv("LOCAL_LLM_ERROR_RATE", "0"))
+    LOCAL_LLM_SEED = int(os.getenv("LOCAL_LLM_SEED")) if os.getenv("LOCAL_LLM_SEED") else None
     
     # Flag: if False, only conversion is performed; generated SQL is not executed.
     EXECUTE_SQL = os.getenv("EXECUTE_SQL", "True") == "True"
     
     # Operational mode: enforce read-only mode.
     READ_ONLY = os.getenv("READ_ONLY", "True") == "True"
+
+    # SQLite connection pool: connections per DB file and access mode, checkout timeout
+    # (seconds) and per-connection PRAGMAs (cache_size < 0 is in KiB).
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+    DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))
+    DB_WAL = os.getenv("DB_WAL", "False") == "True"
+
+    # In-memory replica for read-only queries: the DB file is copied into memory at startup and
+    # again whenever it changes (checked every CHECK_INTERVAL seconds). Files larger than
+    # MAX_BYTES are served from disk.
+    DB_REPLICA_ENABLED = os.getenv("DB_REPLICA_ENABLED", "False") == "True"
+    DB_REPLICA_MAX_BYTES = int(os.getenv("DB_REPLICA_MAX_BYTES", str(512 * 1024 * 1024)))
+    DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+
+    # Multi-database routing: a payload's "database": "<name>" is served from
+    # DATABASES_DIR/<name>.db (names: letters, digits, "_" and "-"; empty DATABASES_DIR disables
+    # routing). At most DATABASES_MAX_OPEN databases keep their schema, pools of
+    # DATABASES_POOL_SIZE connections and cached results; the least recently used is closed.
+    DATABASES_DIR = os.getenv("DATABASES_DIR", "")
+    DATABASES_MAX_OPEN = int(os.getenv("DATABASES_MAX_OPEN", "64"))
+    DATABASES_POOL_SIZE = int(os.getenv("DATABASES_POOL_SIZE", "2"))
+
+    # Execution budget per query: wall-clock timeout (seconds), row cap and estimated result
+    # size cap (bytes). Requests may lower the timeout and row cap with "timeout"/"max_rows".
+    QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+    QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+    QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Logging: root level and format ("text" or "json"); per-stage levels for the payload-heavy
+    # loggers ("prompt", "llm", "sql", "result", "context", e.g. "prompt:DEBUG,sql:WARNING");
+    # payloads are cut to LOG_MAX_CHARS (0 keeps them whole) and a LOG_SAMPLE_RATE share of
+    # requests get their stage INFO/DEBUG records. Requests taking SLOW_REQUEST_MS or longer
+    # (0 disables) are written with full prompts, SQL and timings to SLOW_REQUEST_LOG_FILE
+    # (or the main log).
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+    LOG_STAGE_LEVELS = os.getenv("LOG_STAGE_LEVELS", "")
+    LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", "500"))
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+    SLOW_REQUEST_LOG_FILE = os.getenv("SLOW_REQUEST_LOG_FILE", "")
+
+    # Result cache for executed read statements, keyed by DB file and canonical SQL and
+    # invalidated when the DB's PRAGMA data_version changes. Least recently used results are
+    # evicted past MAX_BYTES; larger results than MAX_ENTRY_BYTES are never cached.
+    # Requests opt out with "result_cache": false.
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "True") == "True"
+    RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+
+    # Large results: NDJSON stream batch size and the largest page served by /query/page.
+    STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "5000"))
+
+    # Async pipeline (/query/async, /refine/async): at most LLM_MAX_CONCURRENCY Gemini calls
+    # in flight per process; blocking SQLite and Redis calls run on DB_THREAD_POOL_SIZE threads.
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+    DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", "8"))
+
+    # Report per-stage durations (parse, generate, validate, execute, ...) in a Server-Timing
+    # response header; used by the benchmarks. They are always recorded for /metrics.
+    STAGE_TIMINGS = os.getenv("STAGE_TIMINGS", "False") == "True"
+
+    # /query/batch: largest accepted batch and how many distinct queries run at once.
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+    # Signs page tokens. Required: every worker must use the same key to read the page tokens
+    # issued by the others, so it cannot be generated per process (see create_app).
+    SECRET_KEY = os.getenv("SECRET_KEY")
     
     # Whether to dynamically introspect the database schema at runtime.
     USE_DYNAMIC_SCHEMA = os.getenv("USE_DYNAMIC_SCHEMA", "True") == "True"
+
+    # Schema retrieval: on schemas with more than SCHEMA_RETRIEVAL_MIN_TABLES tables, prompts
+    # only carry the TOP_K tables most relevant to the question (plus foreign-key neighbours),
+    # or the full schema when no table scores MIN_SCORE.
+    SCHEMA_RETRIEVAL = os.getenv("SCHEMA_RETRIEVAL", "True") == "True"
+    SCHEMA_RETRIEVAL_MIN_TABLES = int(os.getenv("SCHEMA_RETRIEVAL_MIN_TABLES", "30"))
+    SCHEMA_RETRIEVAL_TOP_K = int(os.getenv("SCHEMA_RETRIEVAL_TOP_K", "8"))
+    SCHEMA_RETRIEVAL_MIN_SCORE = float(os.getenv("SCHEMA_RETRIEVAL_MIN_SCORE", "2.0"))
+
+    # Extra words normalized to schema names, e.g. "client:customer,purchase:orders".
+    SCHEMA_SYNONYMS = dict(
+        (word.strip(), name.strip()) for word, _, name in
+        (pair.partition(":") for pair in os.getenv("SCHEMA_SYNONYMS", "").split(",") if ":" in pair)
+    )
+
+    # Prompt building: prompts are cut to PROMPT_TOKEN_BUDGET tokens (0 = unlimited) by dropping
+    # history turns first, then the least relevant tables. PROMPT_HISTORY_TURNS previous turns
+    # are included in generation and refinement prompts (0 = none).
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "32000"))
+    PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", "0"))
+    PROMPT_TOKEN_ENCODING = os.getenv("PROMPT_TOKEN_ENCODING", "cl100k_base")
+
+    # Pipeline mode: "single" generates SQL and its validity verdict in one Gemini call;
+    # "strict" uses separate generate, validate and clean calls.
+    PIPELINE_MODE = os.getenv("PIPELINE_MODE", "single")
+
+    # SQL validator: "local" compiles the SQL against a schema-only in-memory clone of the
+    # database; "gemini" asks the model. Failed refinements get this many repair rounds.
+    SQL_VALIDATOR = os.getenv("SQL_VALIDATOR", "local")
+    VALIDATION_REPAIR_ATTEMPTS = int(os.getenv("VALIDATION_REPAIR_ATTEMPTS", "1"))
     
     # Redis settings for conversation context
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1.0"))
+    REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1.0"))
+    # Conversation context: turns kept per user (0 = all) and idle session expiry in seconds (0 = never).
+    CONTEXT_WINDOW_TURNS = int(os.getenv("CONTEXT_WINDOW_TURNS", "50"))
+    CONTEXT_TTL_SECONDS = int(os.getenv("CONTEXT_TTL_SECONDS", str(7 * 24 * 3600)))
+    # Context backend: "redis", or "memory" for single-node deployments without Redis (at most
+    # CONTEXT_MEMORY_MAX_USERS users). With Redis, CONTEXT_FALLBACK keeps serving from memory
+    # while Redis is unreachable. The per-process L1 cache holds CONTEXT_L1_SIZE users for
+    # CONTEXT_L1_TTL_SECONDS. It is off by default: it is never invalidated by other workers'
+    # writes, so only enable it with a single worker or with users pinned to one worker.
+    CONTEXT_BACKEND = os.getenv("CONTEXT_BACKEND", "redis")
+    CONTEXT_MEMORY_MAX_USERS = int(os.getenv("CONTEXT_MEMORY_MAX_USERS", "10000"))
+    CONTEXT_FALLBACK = os.getenv("CONTEXT_FALLBACK", "True") == "True"
+    # Histories stored by older versions (one JSON string under the bare user_id) are migrated
+    # when read; set to False once no legacy keys remain to skip looking for them.
+    CONTEXT_MIGRATE_LEGACY = os.getenv("CONTEXT_MIGRATE_LEGACY", "True") == "True"
+    CONTEXT_L1_SIZE = int(os.getenv("CONTEXT_L1_SIZE", "0"))
+    CONTEXT_L1_TTL_SECONDS = float(os.getenv("CONTEXT_L1_TTL_SECONDS", "30"))
+
+    # Translation cache: validated NL->SQL translations, in-process LRU plus optional Redis tier.
+    TRANSLATION_CACHE_ENABLED = os.getenv("TRANSLATION_CACHE_ENABLED", "True") == "True"
+    TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "1024"))
+    TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", "3600"))
+    TRANSLATION_CACHE_REDIS = os.getenv("TRANSLATION_CACHE_REDIS", "False") == "True"
     
+    # Single-flight: concurrent identical questions share one generation and validation.
+    # Callers wait up to WAIT_SECONDS for the leader's result before running it themselves.
+    # With SINGLE_FLIGHT_REDIS, workers coordinate through a Redis lease of LEASE_SECONDS and
+    # wait as long for another worker's result.
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "True") == "True"
+    SINGLE_FLIGHT_REDIS = os.getenv("SINGLE_FLIGHT_REDIS", "False") == "True"
+    SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "30"))
+    SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "30"))
+
+    # Conversion audit log (off unless CONVERSION_LOG_DB names its file): written behind the
+    # request path to its own WAL-mode SQLite file, in batches of up to BATCH_SIZE records or
+    # every FLUSH_INTERVAL seconds. When the queue is full, records are dropped ("drop") or the
+    # request waits up to BLOCK_TIMEOUT ("block").
+    CONVERSION_LOG_DB = os.getenv("CONVERSION_LOG_DB", "")
+    CONVERSION_LOG_QUEUE_SIZE = int(os.getenv("CONVERSION_LOG_QUEUE_SIZE", "10000"))
+    CONVERSION_LOG_BATCH_SIZE = int(os.getenv("CONVERSION_LOG_BATCH_SIZE", "200"))
+    CONVERSION_LOG_FLUSH_INTERVAL = float(os.getenv("CONVERSION_LOG_FLUSH_INTERVAL", "1.0"))
+    CONVERSION_LOG_BACKPRESSURE = os.getenv("CONVERSION_LOG_BACKPRESSURE", "drop")
+    CONVERSION_LOG_BLOCK_TIMEOUT = float(os.getenv("CONVERSION_LOG_BLOCK_TIMEOUT", "0.05"))
+
     # Fallback static schema information.
     STATIC_SCHEMA_INFO = {
         "airplane": {
@@ -50,6 +206,7 @@ class Config:
 # Separate configuration for testing.
 class TestConfig(Config):
     DB_FILE = os.getenv("DB_FILE", "test.db")
+    SECRET_KEY = os.getenv("SECRET_KEY", "test-secret-key")
     
     # Gemini API settings
     USE_GEMINI = True
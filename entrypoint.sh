@@ -9,5 +9,12 @@ else
     echo "Database already exists. Skipping initialization."
 fi
 
+# Page tokens must be readable by every worker, so they share one key. Without a configured
+# SECRET_KEY, one is generated for this container (tokens do not survive a restart).
+if [ -z "$SECRET_KEY" ]; then
+    echo "SECRET_KEY not set. Generating one for this container."
+    export SECRET_KEY="$(head -c 32 /dev/urandom | od -An -tx1 | tr -d ' \n')"
+fi
+
 echo "Starting Gunicorn with DEBUG log level..."
-exec gunicorn --timeout 300 --log-level debug --access-logfile - --error-logfile - --bind 0.0.0.0:5000 run:app
+exec gunicorn --timeout 300 --log-level info --access-logfile - --error-logfile - --bind 0.0.0.0:5000 run:app
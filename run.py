@@ -1,9 +1,11 @@
 # run.py
 import logging
 from app import create_app
+from app.logs import configure_logging
+from config import Config
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.debug("Starting the Flask application in DEBUG mode...")
+configure_logging(Config)
+logging.info("Starting the Flask application with LOG_LEVEL %s...", Config.LOG_LEVEL)
 
 app = create_app()
 
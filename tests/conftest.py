@@ -1,6 +1,7 @@
 import pytest
 import sqlite3
 from app import create_app  # Your app factory
+from app.contex_store import ContextStore, MemoryContextBackend, set_context_store
 from config import TestConfig
 import time
 
@@ -60,12 +61,13 @@ def db_file(tmp_path):
     return str(db_file)
 
 @pytest.fixture
-def app(db_file):
+def app(db_file, tmp_path):
     # Override TestConfig.DB_FILE to use our temporary file.
     TestConfig.DB_FILE = db_file
     # Create the Flask app with the testing configuration.
-    test_app = create_app()
+    test_app = create_app(TestConfig)
     test_app.config.from_object(TestConfig)
+    test_app.config["CONVERSION_LOG_DB"] = str(tmp_path / "conversion_log.db")
     
     # Initialize the database using the TEST_SCHEMA.
     with test_app.app_context():
@@ -84,8 +86,17 @@ def app(db_file):
 def client(app):
     return app.test_client()
 
+@pytest.fixture
+def memory_context():
+    # Keeps conversation context in this process, so tests need no Redis server.
+    store = ContextStore(MemoryContextBackend(), l1_size=0)
+    set_context_store(store)
+    yield store
+    set_context_store(None)
+
 @pytest.fixture(autouse=True)
-def delay_between_tests():
-    # Yield to let the test run, then sleep for 5 second after each test.
+def delay_between_tests(request):
+    # Yield to let the test run, then sleep after each test that calls the live Gemini API.
     yield
-    time.sleep(10)  # Adjust the delay (in seconds) as needed.
\ No newline at end of file
+    if request.module.__name__.endswith("test_integration"):
+        time.sleep(10)  # Adjust the delay (in seconds) as needed.
\ No newline at end of file
@@ -0,0 +1,19 @@
+from app.models.agent_registry import AgentRegistry
+
+def test_agents_share_components_but_not_user_state(app, db_file, memory_context):
+    registry = AgentRegistry({"LLM_BACKEND": "local", "DB_FILE": db_file, "USE_DYNAMIC_SCHEMA": True})
+    alice = registry.create_agent("alice")
+    bob = registry.create_agent("bob")
+    for name in ("nlp", "schema_manager", "sql_generator", "feedback_module", "executor", "db_layer",
+                 "translation_cache", "single_flight"):
+        assert getattr(alice, name) is getattr(bob, name), name
+    assert alice.sql_generator.backend is registry.llm_backend
+    assert (alice.user_id, alice.context_id) == ("alice", "alice")
+    assert (bob.user_id, bob.context_id) == ("bob", "bob")
+    assert alice.conversation_context is not bob.conversation_context
+
+    alice.process_query("list all customers")
+    assert alice.conversation_context.get_context() == [{"user": "list all customers",
+                                                          "system": "SELECT * FROM customer"}]
+    assert bob.conversation_context.get_context() == []
+    assert memory_context.get("bob") == []
@@ -0,0 +1,47 @@
+import asyncio
+from app.async_runtime import AsyncRuntime, LLMConcurrencyLimiter, run_blocking
+
+def test_limiter_bounds_concurrent_calls():
+    limiter = LLMConcurrencyLimiter(2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(10)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+def test_runtime_runs_coroutines_from_other_threads_and_loops():
+    runtime = AsyncRuntime()
+
+    async def work(x):
+        return await run_blocking(pow, x, 2)
+
+    assert runtime.submit(work(3)).result(timeout=5) == 9
+    assert asyncio.run(runtime.run(work(4))) == 16
+
+def test_pipeline_generators_run_sync_and_async():
+    from app.async_runtime import Call, adrive, drive
+
+    async def adouble(x):
+        return x * 2
+
+    def fail():
+        raise ValueError("boom")
+
+    def pipeline():
+        doubled = yield Call(lambda x: x * 2, 3, afn=adouble)
+        try:
+            yield Call(fail)
+        except ValueError as e:
+            return doubled, str(e)
+
+    assert drive(pipeline()) == (6, "boom")
+    assert asyncio.run(adrive(pipeline())) == (6, "boom")
@@ -0,0 +1,52 @@
+import json
+from types import SimpleNamespace
+from app.batch import QueryBatch
+from app.models.nlp_processor import NLProcessor
+from app.models.schema_manager import SchemaManager
+
+def test_identical_normalized_queries_are_grouped():
+    schema = {"customer": {"columns": ["id", "city"]}, "orders": {"columns": ["id", "customer_id"]}}
+    registry = SimpleNamespace(nlp=NLProcessor(), schema_manager=SchemaManager(schema))
+    items = [
+        {"user_id": "a", "query": "show all customers"},
+        {"user_id": "b", "query": "  show all   customers"},
+        {"user_id": "a", "query": "count orders"},
+    ]
+    batch = QueryBatch(registry, items, max_concurrency=4)
+    assert list(batch.groups.values()) == [[0, 1], [2]]
+
+ITEMS = [
+    {"user_id": "a", "query": "list all customers"},
+    {"user_id": "b", "query": "how many orders are there"},
+    {"user_id": "b", "query": "  list all   customers"},
+]
+
+def test_batch_endpoint_answers_in_item_order(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    data = client.post("/query/batch", json={"items": ITEMS}).get_json()
+    assert [result["sql"] for result in data["results"]] == [
+        "SELECT * FROM customer", "SELECT COUNT(*) FROM orders", "SELECT * FROM customer"]
+    assert data["results"][1]["result"]["rows"] == [[3]]
+    # The duplicate question ran once.
+    assert data["distinct_queries"] == 2
+    assert app.extensions["agent_registry"].llm_backend.stats()["calls"] == 2
+    # Each item's turn went to its own user's context, in item order.
+    assert [turn["user"] for turn in memory_context.get("a")] == ["list all customers"]
+    assert [turn["system"] for turn in memory_context.get("b")] == [
+        "SELECT COUNT(*) FROM orders", "SELECT * FROM customer"]
+
+def test_batch_endpoint_streams_ndjson(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    response = client.post("/query/batch", json={"items": ITEMS, "stream": True})
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1, 2]
+    assert all(line["sql"] for line in lines[:-1])
+    assert lines[-1] == {"done": True, "count": 3, "distinct_queries": 2}
+
+def test_batch_endpoint_rejects_invalid_items(app, client, monkeypatch):
+    for items in (None, [], [{"user_id": "a"}], ["list all customers"]):
+        assert client.post("/query/batch", json={"items": items}).status_code == 400
+    monkeypatch.setattr("config.Config.BATCH_MAX_ITEMS", 2)
+    response = client.post("/query/batch", json={"items": ITEMS})
+    assert response.status_code == 400 and "at most 2 items" in response.get_json()["error"]
@@ -0,0 +1,127 @@
+import json
+import pytest
+import redis
+from app.contex_store import (
+    ContextStore, MemoryContextBackend, RedisContextBackend, create_context_store, decode_turn, encode_turn
+)
+
+class FakeRedis:
+    """The string and list commands the Redis backend uses, in memory; expiry is ignored."""
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("Redis is down")
+
+    def get(self, key):
+        self._check()
+        value = self.data.get(key)
+        if isinstance(value, list):
+            raise redis.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value.encode("utf-8")
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def lrange(self, key, start, end):
+        self._check()
+        return self.data.get(key, [])[start:]
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data[key][start:]
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self, transaction=True):
+        self._check()
+        commands = []
+        pipe = type("Pipeline", (), {})()
+        for name in ("delete", "rpush", "ltrim", "expire", "lrange", "get"):
+            setattr(pipe, name, lambda *args, name=name: commands.append((getattr(self, name), args)))
+
+        def run(command, args, raise_on_error):
+            try:
+                return command(*args)
+            except redis.ResponseError as e:
+                if raise_on_error:
+                    raise
+                return e
+        pipe.execute = lambda raise_on_error=True: [run(command, args, raise_on_error) for command, args in commands]
+        return pipe
+
+def _turns(*indexes):
+    return [{"user": f"q{i}", "system": f"SELECT {i}"} for i in indexes]
+
+def test_turn_encoding_round_trips():
+    turn = {"user": "wie viele Kunden? ✓", "system": "SELECT COUNT(*) FROM customer"}
+    assert len(encode_turn(turn)) < len(json.dumps(turn))
+    assert decode_turn(encode_turn(turn)) == turn
+    assert decode_turn(b'{"user": "q", "system": "s"}') == {"user": "q", "system": "s"}
+
+@pytest.mark.parametrize("make_backend", [
+    lambda: RedisContextBackend(FakeRedis(), window=3),
+    lambda: MemoryContextBackend(window=3),
+])
+def test_backends_append_and_window(make_backend):
+    backend = make_backend()
+    for i in range(5):
+        backend.append("u1", _turns(i))
+    assert backend.get("u1") == _turns(2, 3, 4)
+    assert backend.get("u1", last=1) == _turns(4)
+    backend.replace("u1", _turns(7))
+    assert backend.get("u1") == _turns(7)
+    assert backend.get("nobody") == []
+
+def test_redis_backend_migrates_legacy_context():
+    client = FakeRedis()
+    client.set("u2", json.dumps(_turns(1)))
+    backend = RedisContextBackend(client)
+    assert backend.get("u2") == _turns(1)
+    assert client.get("u2") is None
+    assert backend.get("u2", last=1) == _turns(1)
+
+def test_redis_backend_ignores_non_string_legacy_keys():
+    client = FakeRedis()
+    client.rpush("u3", b"not a history")
+    assert RedisContextBackend(client).get("u3") == []
+    assert RedisContextBackend(client, migrate_legacy=False).get("u2") == []
+
+def test_memory_backend_evicts_least_recent_user():
+    backend = MemoryContextBackend(max_users=2)
+    for user_id in ("a", "b", "c"):
+        backend.append(user_id, _turns(1))
+    assert backend.get("a") == [] and backend.get("c") == _turns(1)
+
+def test_l1_cache_serves_hot_users_and_writes_through():
+    client = FakeRedis()
+    store = ContextStore(RedisContextBackend(client, window=10))
+    store.append("u1", _turns(1, 2))
+    assert store.get("u1") == _turns(1, 2)
+    store.append("u1", _turns(3))
+    assert client.data["context:u1"][-1] == encode_turn(_turns(3)[0])
+    # Served from L1, including the turn written through after it was cached.
+    client.down = True
+    assert store.get("u1", last=2) == _turns(2, 3)
+
+def test_falls_back_to_memory_while_backend_is_down():
+    client = FakeRedis()
+    client.down = True
+    store = ContextStore(RedisContextBackend(client), l1_size=0, fallback=MemoryContextBackend())
+    store.append("u1", _turns(1))
+    assert store.get("u1") == _turns(1)
+    assert client.data == {}
+
+def test_l1_cache_is_off_by_default():
+    store = create_context_store({"CONTEXT_BACKEND": "memory"})
+    store.append("u1", [{"user": "q", "system": "SELECT 1"}])
+    store.get("u1")
+    assert store.l1_size == 0 and not store._l1
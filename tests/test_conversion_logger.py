@@ -0,0 +1,45 @@
+import sqlite3
+from app.models.conversion_logger import ConversionLogger
+
+def _rows(log_db):
+    conn = sqlite3.connect(log_db)
+    rows = conn.execute("SELECT user_id, query, generated_sql, endpoint, llm_calls, stages_ms FROM conversion_log").fetchall()
+    conn.close()
+    return rows
+
+def test_records_are_written_in_batches(tmp_path):
+    log_db = str(tmp_path / "log.db")
+    conversion_logger = ConversionLogger(log_db, batch_size=3, flush_interval=60)
+    for i in range(7):
+        assert conversion_logger.log("u1", f"q{i}", f"SELECT {i}", llm_calls=1, stages_ms={"generate": 1.5})
+    assert conversion_logger.flush()
+    rows = _rows(log_db)
+    assert [row[1] for row in rows] == [f"q{i}" for i in range(7)]
+    assert rows[0][4:] == (1, '{"generate": 1.5}')
+    assert conversion_logger.stats()["written"] == 7
+    assert sqlite3.connect(log_db).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_full_queue_drops_records(tmp_path):
+    conversion_logger = ConversionLogger(str(tmp_path / "log.db"), queue_size=1, flush_interval=60)
+    # The writer takes at most one record off the queue, so the rest overflow.
+    results = [conversion_logger.log("u1", "q", "SELECT 1") for _ in range(1000)]
+    assert not all(results)
+    assert conversion_logger.stats()["dropped"] == results.count(False)
+
+def test_query_route_logs_the_conversion(app, client, monkeypatch):
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", lambda user_id, last=None: [])
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn", lambda user_id, user, system: None)
+    app.config["LLM_BACKEND"] = "local"
+    client.post("/query", json={"user_id": "log_user", "query": "list all customers"})
+    conversion_logger = app.extensions["agent_registry"].conversion_logger
+    assert conversion_logger.flush()
+    user_id, query, sql, endpoint, llm_calls, stages_ms = _rows(app.config["CONVERSION_LOG_DB"])[-1]
+    assert (user_id, query, sql, endpoint, llm_calls) == ("log_user", "list all customers", "SELECT * FROM customer", "/query", 1)
+    assert "generate" in stages_ms
+
+def test_unwritable_log_is_disabled_with_one_warning(tmp_path, caplog):
+    conversion_logger = ConversionLogger(str(tmp_path / "missing" / "log.db"))
+    assert [record.levelname for record in caplog.records] == ["WARNING"]
+    assert not conversion_logger.log("u1", "q", "SELECT 1")
+    assert not conversion_logger.flush()
+    assert conversion_logger.stats()["dropped"] == 1
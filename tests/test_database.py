@@ -0,0 +1,110 @@
+import sqlite3
+import pytest
+from app.models.connection_pool import SQLiteConnectionPool, PoolTimeoutError, ReplicaPool
+from app.models.database import SQLiteDatabase, QueryBudget, QueryTimeoutError
+
+@pytest.fixture
+def populated_db(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO product (name, price) VALUES (?, ?)",
+                     [("Widget A", 19.99), ("Widget B", 29.99), ("Gadget X", 49.99)])
+    conn.commit()
+    conn.close()
+    return db_file
+
+def test_pool_reuses_connections(populated_db):
+    pool = SQLiteConnectionPool(populated_db, read_only=True, size=2)
+    db = SQLiteDatabase(populated_db, read_only=True, pool=pool)
+    for _ in range(3):
+        assert db.execute_query("SELECT name FROM product ORDER BY id")["rows"][0] == ("Widget A",)
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["reused"] == 2 and stats["in_use"] == 0
+
+def test_read_only_pool_rejects_writes_missed_by_keyword_check(populated_db):
+    db = SQLiteDatabase(populated_db, read_only=True, pool=SQLiteConnectionPool(populated_db, read_only=True))
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute_query("REPLACE INTO product (id, name, price) VALUES (1, 'Hacked', 0)")
+    assert db.execute_query("SELECT name FROM product WHERE id = 1")["rows"] == [("Widget A",)]
+
+def test_read_write_pool_commits(populated_db):
+    pool = SQLiteConnectionPool(populated_db, read_only=False, wal=True)
+    db = SQLiteDatabase(populated_db, read_only=False, pool=pool)
+    db.execute_query("INSERT INTO product (name, price) VALUES ('Gadget Y', 9.99)")
+    conn = sqlite3.connect(populated_db)
+    assert conn.execute("SELECT COUNT(*) FROM product").fetchone()[0] == 4
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+def test_pool_timeout(populated_db):
+    pool = SQLiteConnectionPool(populated_db, size=1, timeout=0.01)
+    with pool.connection():
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+def test_iter_query_streams_in_batches(populated_db):
+    pool = SQLiteConnectionPool(populated_db)
+    db = SQLiteDatabase(populated_db, pool=pool)
+    batches = db.iter_query("SELECT id FROM product ORDER BY id", batch_size=2)
+    assert next(batches) == ["id"]
+    assert pool.stats()["in_use"] == 1
+    assert list(batches) == [[(1,), (2,)], [(3,)]]
+    assert pool.stats()["in_use"] == 0
+
+def test_fetch_page(populated_db):
+    db = SQLiteDatabase(populated_db, pool=SQLiteConnectionPool(populated_db))
+    page = db.fetch_page("SELECT name FROM product ORDER BY id;", offset=1, limit=1)
+    assert page == {"columns": ["name"], "rows": [("Widget B",)], "has_more": True, "status": "ok"}
+    assert not db.fetch_page("SELECT name FROM product ORDER BY id", offset=2, limit=1)["has_more"]
+
+def test_row_and_byte_caps_truncate(populated_db):
+    db = SQLiteDatabase(populated_db, pool=SQLiteConnectionPool(populated_db))
+    result = db.execute_query("SELECT name FROM product ORDER BY id", budget=QueryBudget(max_rows=2))
+    assert result["rows"] == [("Widget A",), ("Widget B",)]
+    assert result["status"] == "truncated" and result["truncated_reason"] == "max_rows"
+    result = db.execute_query("SELECT name FROM product", budget=QueryBudget(max_bytes=40))
+    assert len(result["rows"]) == 1 and result["truncated_reason"] == "max_bytes"
+    assert db.execute_query("SELECT name FROM product", budget=QueryBudget(max_rows=3))["status"] == "ok"
+
+def test_deadline_interrupts_and_releases_connection(populated_db):
+    pool = SQLiteConnectionPool(populated_db, size=1)
+    db = SQLiteDatabase(populated_db, pool=pool)
+    runaway = ("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) "
+               "SELECT COUNT(*) FROM n a, n b")
+    with pytest.raises(QueryTimeoutError):
+        db.execute_query(runaway, budget=QueryBudget(timeout=0.05))
+    assert pool.stats()["in_use"] == 0
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(3,)]
+
+def _insert_product(db_file, name):
+    conn = sqlite3.connect(db_file)
+    conn.execute("INSERT INTO product (name, price) VALUES (?, 1.0)", (name,))
+    conn.commit()
+    conn.close()
+
+def test_replica_serves_from_memory_until_refreshed(populated_db):
+    pool = ReplicaPool(SQLiteConnectionPool(populated_db), max_bytes=1024 * 1024, check_interval=0)
+    db = SQLiteDatabase(populated_db, pool=pool)
+    with pool.connection() as old_conn:
+        assert old_conn.execute("PRAGMA database_list").fetchone()[2] == ""
+        _insert_product(populated_db, "Gadget Y")
+        assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(3,)]
+        assert pool.refresh() and not pool.refresh()
+        assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(4,)]
+        # A connection checked out before the swap keeps reading the old copy.
+        assert old_conn.execute("SELECT COUNT(*) FROM product").fetchone() == (3,)
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute_query("REPLACE INTO product (id, name, price) VALUES (1, 'Hacked', 0)")
+    stats = pool.stats()
+    assert stats["in_memory"] and stats["generation"] == 2 and stats["in_use"] == 0
+    pool.close()
+
+def test_replica_size_guard_falls_back_to_disk(populated_db):
+    pool = ReplicaPool(SQLiteConnectionPool(populated_db), max_bytes=1, check_interval=0)
+    db = SQLiteDatabase(populated_db, pool=pool)
+    _insert_product(populated_db, "Gadget Y")
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(4,)]
+    assert pool.snapshot_version() is None
+    assert not pool.stats()["in_memory"] and pool.stats()["oversized"] == 1
+    pool.close()
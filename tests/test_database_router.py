@@ -0,0 +1,66 @@
+import sqlite3
+import pytest
+from app.models.agent_registry import AgentRegistry
+from app.models.connection_pool import all_pool_stats
+from app.models.database_router import DatabaseRouter, UnknownDatabaseError
+
+def make_database(path, table, rows):
+    conn = sqlite3.connect(str(path))
+    conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany(f"INSERT INTO {table} (name) VALUES (?)", [(name,) for name in rows])
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def databases_dir(tmp_path):
+    directory = tmp_path / "databases"
+    directory.mkdir()
+    make_database(directory / "acme.db", "customer", ["Alice", "Bob"])
+    make_database(directory / "globex.db", "supplier", ["Initech"])
+    return str(directory)
+
+def test_router_opens_each_database_with_its_own_schema(databases_dir, tmp_path):
+    registry = AgentRegistry({"LLM_BACKEND": "local", "DB_FILE": str(tmp_path / "default.db")})
+    router = DatabaseRouter(registry, databases_dir, max_open=1)
+
+    acme = router.get("acme")
+    assert router.get("acme") is acme
+    assert "customer" in acme.schema_manager.get_schema()
+    assert acme.llm_backend is registry.llm_backend
+    assert acme.context_id("u1") == "acme:u1"
+    with acme.get_executor(read_only=True).db_layer.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM customer").fetchone()[0] == 2
+    assert any(stats["db_file"].endswith("acme.db") for stats in all_pool_stats())
+
+    # Opening a second database closes the least recently used one and its pools.
+    globex = router.get("globex")
+    assert "supplier" in globex.schema_manager.get_schema()
+    assert not any(stats["db_file"].endswith("acme.db") for stats in all_pool_stats())
+    stats = router.stats()
+    assert stats["open"] == 1 and stats["opened"] == 2 and stats["closed"] == 1
+    assert list(stats["databases"]) == ["globex"]
+    router.close_all()
+
+@pytest.mark.parametrize("name", ["missing", "../acme", "acme.db", "", None])
+def test_router_rejects_unknown_names(databases_dir, name):
+    router = DatabaseRouter(AgentRegistry({"LLM_BACKEND": "local"}), databases_dir)
+    with pytest.raises(UnknownDatabaseError):
+        router.get(name)
+
+def test_query_routes_to_named_database(app, client, databases_dir, monkeypatch):
+    contexts = []
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", lambda user_id, last=None: [])
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn",
+                        lambda user_id, user, system: contexts.append(user_id))
+    app.config.update(LLM_BACKEND="local", DATABASES_DIR=databases_dir)
+
+    response = client.post("/query", json={"user_id": "u1", "query": "list all customers", "database": "acme"})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert sorted(row[-1] for row in data["result"]["rows"]) == ["Alice", "Bob"]
+    assert contexts == ["acme:u1"]
+
+    response = client.post("/query", json={"user_id": "u1", "query": "list all customers", "database": "nope"})
+    assert response.status_code == 404
+    assert client.get("/stats").get_json()["databases"]["open"] == 1
+    assert 'text2sql_database_requests_total{database="acme"' in client.get("/metrics").get_data(as_text=True)
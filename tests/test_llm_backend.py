@@ -0,0 +1,40 @@
+import asyncio
+import pytest
+from app.models.llm_backend import LocalBackend, LLMBackendError
+from app.models.schema_manager import SchemaManager
+from app.models.sql_generator import GeminiSQLGenerator
+from app.models.text_to_sql_agent import TextToSQLAgent
+
+def test_local_backend_canned_and_rule_based_responses():
+    backend = LocalBackend(responses=[{"contains": "top customers", "response": "SELECT id FROM customer LIMIT 3"}])
+    schema_prompt = "Database Schema:\nTable 'customer': id, city\nTable 'orders': id, quantity"
+    assert backend.generate("...\nShow the top customers\n") == "SELECT id FROM customer LIMIT 3"
+    prompt = f"{schema_prompt}\n\nConvert the following natural language query into SQL for sqllite3:\nHow many orders are there\nSQL:"
+    assert backend.generate(prompt) == "SELECT COUNT(*) FROM orders"
+    assert backend.generate(f"{schema_prompt}\n\nGiven the SQL query:\nSELECT 1\n\nIs this query valid?") == "yes"
+    assert asyncio.run(backend.agenerate(prompt)) == "SELECT COUNT(*) FROM orders"
+    assert backend.stats()["calls"] == 4
+
+def test_local_backend_injects_errors():
+    backend = LocalBackend(error_rate=1.0, seed=1)
+    with pytest.raises(LLMBackendError):
+        backend.generate("anything")
+    assert backend.stats()["errors"] == 1
+
+def test_pipeline_runs_offline(app, db_file, monkeypatch):
+    # Keep the conversation context in memory; this test needs no Redis server either.
+    contexts = {}
+    def get_context(user_id, last=None):
+        turns = contexts.get(user_id, [])
+        return turns if last is None else turns[len(turns) - last:] if last > 0 else []
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", get_context)
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn",
+                        lambda user_id, user, system: contexts.setdefault(user_id, []).append({"user": user, "system": system}))
+    schema_manager = SchemaManager(db_file=db_file, use_dynamic_schema=True)
+    generator = GeminiSQLGenerator(schema_manager, backend=LocalBackend())
+    agent = TextToSQLAgent(None, db_file, "offline_user", schema_manager=schema_manager,
+                           sql_generator=generator, execute_sql=True)
+    response = agent.process_query("List all customers")
+    assert response["sql"] == "SELECT * FROM customer"
+    assert len(response["result"]["rows"]) == 3
+    assert contexts["offline_user"][-1]["system"] == "SELECT * FROM customer"
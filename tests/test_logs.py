@@ -0,0 +1,45 @@
+import json
+import logging
+from app.logs import SLOW_LOGGER, SamplingFilter, settings, stage_logger, start_request_log, truncate
+
+class Loud:
+    """Fails the test if the log argument is ever formatted."""
+    def __str__(self):
+        raise AssertionError("formatted a suppressed record")
+
+def test_truncation_is_lazy(monkeypatch):
+    monkeypatch.setattr(settings, "max_chars", 10)
+    assert str(truncate("x" * 25)) == "xxxxxxxxxx... [25 chars]"
+    assert str(truncate("short")) == "short"
+    logger = stage_logger("prompt")
+    monkeypatch.setattr(logger, "level", logging.INFO)
+    logger.debug("Prompt: %s", truncate(Loud()))
+
+def test_unsampled_request_keeps_only_warnings(monkeypatch):
+    monkeypatch.setattr(settings, "sample_rate", 0.0)
+    start_request_log()
+    sampling = SamplingFilter()
+    info = logging.LogRecord("text2sql.sql", logging.INFO, __file__, 1, "SQL", None, None)
+    warning = logging.LogRecord("text2sql.sql", logging.WARNING, __file__, 1, "SQL", None, None)
+    assert not sampling.filter(info)
+    assert sampling.filter(warning)
+
+def test_slow_request_log_captures_payloads(app, client, monkeypatch, caplog):
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", lambda user_id, last=None: [])
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn", lambda user_id, user, system: None)
+    app.config["LLM_BACKEND"] = "local"
+    monkeypatch.setattr(settings, "slow_request_ms", 1e-6)
+    with caplog.at_level(logging.WARNING, logger=SLOW_LOGGER):
+        client.post("/query", json={"user_id": "slow_user", "query": "list all customers"})
+    records = [record for record in caplog.records if record.name == SLOW_LOGGER]
+    assert len(records) == 1
+    entry = json.loads(records[0].getMessage())
+    kinds = [payload["kind"] for payload in entry["payloads"]]
+    assert entry["endpoint"] == "/query" and "execute" in entry["timings"]["stages_ms"]
+    assert {"prompt", "llm_output", "sql"} <= set(kinds)
+
+    caplog.clear()
+    monkeypatch.setattr(settings, "slow_request_ms", 60000)
+    with caplog.at_level(logging.WARNING, logger=SLOW_LOGGER):
+        client.post("/query", json={"user_id": "slow_user", "query": "list all customers"})
+    assert not [record for record in caplog.records if record.name == SLOW_LOGGER]
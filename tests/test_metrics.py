@@ -0,0 +1,30 @@
+from app.metrics import MetricsRegistry
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["endpoint"])
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    requests.inc(endpoint="/query")
+    requests.inc(endpoint="/query")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{endpoint="/query"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+
+def test_query_debug_timings_and_metrics_route(app, client, monkeypatch):
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", lambda user_id, last=None: [])
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn", lambda user_id, user, system: None)
+    app.config["LLM_BACKEND"] = "local"
+    response = client.post("/query", json={"user_id": "metrics_user", "query": "list all customers", "debug": True})
+    timings = response.get_json()["timings"]
+    assert timings["llm_calls"] == 1
+    assert {"parse", "normalize", "generate", "validate", "execute"} <= set(timings["stages_ms"])
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'text2sql_requests_total{endpoint="/query",status="200"}' in text
+    assert 'text2sql_stage_duration_seconds_count{stage="execute"}' in text
+    assert 'text2sql_llm_calls_total{backend="LocalBackend"}' in text
@@ -0,0 +1,75 @@
+import sys
+import types
+from app.metrics import PROMPT_TOKENS
+from app.models import prompt_builder
+from app.models.prompt_builder import PromptBuilder, count_tokens
+from app.models.schema_manager import SchemaManager
+from app.timings import start_timings
+
+def _schema():
+    schema = {f"archive_{i}": {"columns": ["id", "name", f"field_{i}"]} for i in range(20)}
+    schema["customer"] = {"columns": ["id", "first_name", "city"]}
+    schema["orders"] = {"columns": ["id", "customer_id", "quantity"]}
+    return schema
+
+CONTEXT = [{"user": f"question {i}", "system": f"SELECT {i}"} for i in range(5)]
+
+def test_schema_block_is_memoized():
+    builder = PromptBuilder(SchemaManager(_schema()))
+    first = builder.schema_block("list customers")
+    assert builder.schema_block("list customers") is first
+    assert len(builder._blocks) == 1
+
+def test_budget_keeps_the_most_relevant_tables():
+    builder = PromptBuilder(SchemaManager(_schema()), token_budget=60)
+    prompt = builder.generation_prompt("how many orders per customer")
+    assert "Table 'orders'" in prompt and "Table 'customer'" in prompt
+    assert "Table 'archive_19'" not in prompt
+    assert prompt.endswith("how many orders per customer\nSQL:")
+
+def test_history_drops_oldest_turns_to_fit():
+    builder = PromptBuilder(SchemaManager(_schema()), history_turns=3)
+    assert builder.history_block(CONTEXT) == (
+        "Conversation so far:\n"
+        "User: question 2\nSQL: SELECT 2\n"
+        "User: question 3\nSQL: SELECT 3\n"
+        "User: question 4\nSQL: SELECT 4\n\n"
+    )
+    trimmed = builder.history_block(CONTEXT, budget=builder.count_tokens(builder.history_block(CONTEXT)) - 1)
+    assert "question 2" not in trimmed and "question 4" in trimmed
+    assert PromptBuilder(SchemaManager(_schema())).history_block(CONTEXT) == ""
+
+def test_prompt_tokens_are_reported():
+    builder = PromptBuilder(SchemaManager(_schema()))
+    before = PROMPT_TOKENS.count(kind="clean")
+    timings = start_timings()
+    prompt = builder.clean_prompt("SELECT * FROM customer")
+    assert PROMPT_TOKENS.count(kind="clean") == before + 1
+    assert timings.as_dict()["prompt_tokens"]["clean"] == builder.count_tokens(prompt)
+
+def test_reported_tokens_reuse_memoized_counts(monkeypatch):
+    builder = PromptBuilder(SchemaManager(_schema()), history_turns=2)
+    builder.generation_prompt("list customers", CONTEXT)
+    counted = []
+    monkeypatch.setattr(builder, "count_tokens", lambda text: counted.append(text) or len(text))
+    prompt = builder.generation_prompt("list customers", CONTEXT)
+    # Only the template and the history are counted; the schema block's count is memoized.
+    assert prompt not in counted and builder.schema_block("list customers") not in counted
+
+def test_token_counts_use_the_named_encoding(monkeypatch):
+    class Encoding:
+        def __init__(self, width):
+            self.width = width
+        def encode(self, text, disallowed_special=()):
+            return text[::self.width]
+    widths = {"narrow": 1, "wide": 2}
+    def get_encoding(name):
+        if name not in widths:
+            raise ValueError(name)
+        return Encoding(widths[name])
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(prompt_builder, "_encodings", {})
+    assert count_tokens("abcdefgh", "narrow") == 8
+    assert count_tokens("abcdefgh", "wide") == 4
+    assert count_tokens("abcdefgh", "missing") == 2  # chars/4 estimate
+    assert count_tokens("abcdefgh", "narrow") == 8
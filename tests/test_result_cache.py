@@ -0,0 +1,90 @@
+import sqlite3
+import pytest
+from app.models.connection_pool import SQLiteConnectionPool, ReplicaPool
+from app.models.database import SQLiteDatabase, QueryBudget
+from app.models.result_cache import ResultCache, canonicalize_sql, is_cacheable
+
+@pytest.fixture
+def populated_db(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO product (name, price) VALUES (?, ?)",
+                     [("Widget A", 19.99), ("Widget B", 29.99), ("Gadget X", 49.99)])
+    conn.commit()
+    conn.close()
+    return db_file
+
+def _cached_db(db_file, cache):
+    return SQLiteDatabase(db_file, pool=SQLiteConnectionPool(db_file), result_cache=cache)
+
+def test_canonicalize_sql_keeps_literals():
+    assert canonicalize_sql("SELECT  name\n FROM product ;") == "SELECT name FROM product"
+    assert canonicalize_sql("SELECT 'a  b'  FROM t") == "SELECT 'a  b' FROM t"
+    assert is_cacheable("  with t AS (SELECT 1) SELECT * FROM t")
+    assert not is_cacheable("SELECT date('now')")
+    assert not is_cacheable("INSERT INTO t VALUES (1)")
+
+def test_repeated_query_is_served_from_cache(populated_db):
+    cache = ResultCache()
+    db = _cached_db(populated_db, cache)
+    first = db.execute_query("SELECT COUNT(*) FROM product")
+    second = db.execute_query("SELECT  COUNT(*)\nFROM product;")
+    assert first == second == {"columns": ["COUNT(*)"], "rows": [(3,)], "status": "ok"}
+    assert cache.stats()["hits"] == 1 and db.pool.stats()["created"] == 1 and db.pool.stats()["reused"] == 0
+
+def test_write_from_another_connection_invalidates(populated_db):
+    cache = ResultCache()
+    db = _cached_db(populated_db, cache)
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(3,)]
+    conn = sqlite3.connect(populated_db)
+    conn.execute("INSERT INTO product (name, price) VALUES ('Gadget Y', 9.99)")
+    conn.commit()
+    conn.close()
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(4,)]
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["hits"] == 0
+
+def test_request_can_opt_out(populated_db):
+    cache = ResultCache()
+    db = _cached_db(populated_db, cache)
+    db.execute_query("SELECT name FROM product")
+    db.execute_query("SELECT name FROM product", budget=QueryBudget().tightened(use_cache=False))
+    assert cache.stats()["hits"] == 0
+
+def test_truncated_and_over_budget_results_run_again(populated_db):
+    cache = ResultCache()
+    db = _cached_db(populated_db, cache)
+    assert db.execute_query("SELECT name FROM product", budget=QueryBudget(max_rows=2))["status"] == "truncated"
+    assert cache.stats()["entries"] == 0
+    db.execute_query("SELECT name FROM product")
+    assert db.execute_query("SELECT name FROM product", budget=QueryBudget(max_rows=2))["status"] == "truncated"
+    assert cache.stats()["hits"] == 0
+
+def test_evicts_least_recently_used_past_byte_limit(populated_db):
+    result = {"columns": ["name"], "rows": [("x" * 100,)], "status": "ok"}
+    cache = ResultCache(max_bytes=600, max_entry_bytes=300)
+    version = cache.data_version(populated_db)
+    for i in range(3):
+        cache.put(populated_db, f"SELECT {i}", result, version)
+    cache.get(populated_db, "SELECT 0")
+    cache.put(populated_db, "SELECT 3", result, version)
+    assert cache.get(populated_db, "SELECT 0") is not None
+    assert cache.get(populated_db, "SELECT 1") is None
+    assert cache.stats()["bytes"] <= 600
+    cache.put(populated_db, "SELECT big", {"columns": ["c"], "rows": [("x" * 1000,)], "status": "ok"}, version)
+    assert cache.get(populated_db, "SELECT big") is None
+
+def test_results_from_a_replica_follow_its_version(populated_db):
+    cache = ResultCache()
+    pool = ReplicaPool(SQLiteConnectionPool(populated_db), max_bytes=1024 * 1024, check_interval=0)
+    db = SQLiteDatabase(populated_db, pool=pool, result_cache=cache)
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(3,)]
+    conn = sqlite3.connect(populated_db)
+    conn.execute("INSERT INTO product (name, price) VALUES ('Gadget Y', 9.99)")
+    conn.commit()
+    conn.close()
+    # The replica has not been refreshed, so the cached result still matches what it serves.
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(3,)]
+    assert cache.stats()["hits"] == 1
+    pool.refresh()
+    assert db.execute_query("SELECT COUNT(*) FROM product")["rows"] == [(4,)]
+    pool.close()
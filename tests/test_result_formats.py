@@ -0,0 +1,96 @@
+import csv
+import io
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from app.models.schema_cache import SchemaSnapshot
+from app.models.database import QueryTimeoutError
+from app.streaming import encoded_stream, open_stream
+from app.result_formats import (
+    FORMAT_ARROW, FORMAT_COLUMNAR, FORMAT_CSV, FORMAT_JSON, arrow_chunks, column_types, columnar_result,
+    csv_chunks, negotiate_format
+)
+
+def test_negotiate_format():
+    assert negotiate_format(None, MIMEAccept([("*/*", 1)])) == FORMAT_JSON
+    assert negotiate_format(None, MIMEAccept([("text/csv", 1), ("application/json", 0.5)])) == FORMAT_CSV
+    assert negotiate_format(None, MIMEAccept([("application/vnd.apache.arrow.stream", 1)])) == FORMAT_ARROW
+    assert negotiate_format("columnar", MIMEAccept([("text/csv", 1)])) == FORMAT_COLUMNAR
+    assert negotiate_format("xml", MIMEAccept([])) is None
+
+def test_column_types_prefer_declared_types_that_fit():
+    snapshot = SchemaSnapshot({
+        "product": {"columns": ["id", "name", "price"], "types": ["INTEGER", "VARCHAR(20)", "REAL"]},
+        "orders": {"columns": ["id", "note"], "types": ["INTEGER", "DATE"]},
+    })
+    assert snapshot.column_types == {"id": "integer", "name": "text", "price": "real", "note": "numeric"}
+    rows = [(1, None, 2, "2025-01-01", 3.5), (2, None, 3, None, 4)]
+    types = column_types(["id", "name", "price", "note", "COUNT(*)"], rows, snapshot.column_types)
+    assert types == ["integer", "text", "real", "text", "real"]
+    assert column_types(["name"], [(5,)], snapshot.column_types) == ["integer"]
+
+def test_columnar_and_csv_encodings():
+    rows = [(1, "Widget, A"), (2, None)]
+    assert columnar_result(["id", "name"], rows, ["integer", "text"]) == {
+        "columns": ["id", "name"], "types": ["integer", "text"], "data": [[1, 2], ["Widget, A", None]], "row_count": 2
+    }
+    text = "".join(csv_chunks(["id", "name"], [rows[:1], rows[1:]]))
+    assert list(csv.reader(io.StringIO(text))) == [["id", "name"], ["1", "Widget, A"], ["2", ""]]
+
+def test_arrow_stream_round_trips():
+    pa = pytest.importorskip("pyarrow")
+    chunks = arrow_chunks(["id", "name"], ["integer", "text"], [[(1, "a")], [(2, 3)]], {"sql": "SELECT 1"})
+    table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.column("id").to_pylist() == [1, 2]
+    assert table.column("name").to_pylist() == ["a", "3"]
+    assert table.schema.metadata[b"sql"] == b'"SELECT 1"'
+
+class FailingExecutor:
+    def __init__(self, fail_after: int):
+        self.fail_after = fail_after
+
+    def iter_execute(self, query, batch_size=500, budget=None):
+        yield ["id"]
+        for index in range(self.fail_after):
+            yield [(index,)]
+        raise QueryTimeoutError("deadline")
+
+def test_encoded_stream_surfaces_errors():
+    translation = {"executable_sql": "SELECT id FROM t", "sql": "SELECT id FROM t", "cached": False}
+    with pytest.raises(QueryTimeoutError):
+        open_stream(FailingExecutor(0), translation, 1)
+    columns, first, batches = open_stream(FailingExecutor(2), translation, 1)
+    assert columns == ["id"] and first == [(0,)]
+    chunks = encoded_stream(columns, first, batches, translation, FORMAT_CSV, {})
+    assert next(chunks) == "id\r\n0\r\n"
+    with pytest.raises(QueryTimeoutError):
+        list(chunks)
+
+def test_query_formats(app, client, monkeypatch):
+    monkeypatch.setattr("app.models.text_to_sql_agent.get_context", lambda user_id, last=None: [])
+    monkeypatch.setattr("app.models.text_to_sql_agent.append_turn", lambda user_id, user, system: None)
+    app.config["LLM_BACKEND"] = "local"
+    payload = {"user_id": "format_user", "query": "list all customers"}
+    json_result = client.post("/query", json=payload).get_json()["result"]
+
+    response = client.post("/query", json=dict(payload, format="columnar"))
+    assert response.mimetype == "application/vnd.text2sql.columnar+json"
+    columnar = response.get_json()["result"]
+    assert columnar["columns"] == json_result["columns"]
+    assert columnar["data"] == [list(values) for values in zip(*json_result["rows"])]
+
+    response = client.post("/query", json=payload, headers={"Accept": "text/csv"})
+    assert response.mimetype == "text/csv" and response.headers["X-Result-Status"] == "ok"
+    assert list(csv.reader(io.StringIO(response.get_data(as_text=True))))[0] == json_result["columns"]
+
+    streamed = client.post("/query", json=dict(payload, format="csv", stream=True))
+    assert streamed.get_data(as_text=True) == response.get_data(as_text=True)
+    assert client.post("/query", json=dict(payload, format="xml")).status_code == 400
+
+def test_arrow_stream_converts_values_that_do_not_fit_the_column_type():
+    pa = pytest.importorskip("pyarrow")
+    types = column_types(["id", "price", "data"], [(1, 1.5, b"x")], {})
+    batches = [[(1, 1.5, b"x")], [("2", 2, "y"), (3.0, "n/a", None)], [("three", None, 4)]]
+    table = pa.ipc.open_stream(b"".join(arrow_chunks(["id", "price", "data"], types, batches))).read_all()
+    assert table.column("id").to_pylist() == [1, 2, 3, None]
+    assert table.column("price").to_pylist() == [1.5, 2.0, None, None]
+    assert table.column("data").to_pylist() == [b"x", b"y", None, None]
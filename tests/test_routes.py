@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import pytest
+
+def test_async_query_and_refine(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    response = client.post("/query/async", json={"user_id": "u1", "query": "list all customers"})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data["sql"] == "SELECT * FROM customer" and len(data["result"]["rows"]) == 3
+    assert memory_context.get("u1") == [{"user": "list all customers", "system": "SELECT * FROM customer"}]
+
+    response = client.post("/refine/async", json={"user_id": "u1", "feedback": "keep it as is"})
+    assert response.status_code == 200
+    assert response.get_json()["sql"] == "SELECT * FROM customer"
+    assert len(memory_context.get("u1")) == 2
+
+    assert client.post("/refine/async", json={"user_id": "u2", "feedback": "x"}).status_code == 400
+    assert client.post("/query/async", json={"user_id": "u1"}).status_code == 400
+    assert client.post("/query/async", json={"user_id": "u1", "query": "q", "pipeline_mode": "x"}).status_code == 400
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_query_streams_results(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    payload = {"user_id": "u1", "query": "list all customers", "stream": True}
+    lines = _ndjson(client.post("/query", json=payload))
+    assert lines[0]["sql"] == "SELECT * FROM customer" and lines[0]["columns"][:2] == ["id", "first_name"]
+    assert sum(len(line.get("rows", [])) for line in lines) == 3
+    assert lines[-1] == {"done": True, "row_count": 3, "status": "ok"}
+
+    response = client.post("/query", json=dict(payload, format="csv"))
+    assert response.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:2] == ["id", "first_name"] and len(rows) == 4
+    # Each request recorded its turn once.
+    assert len(memory_context.get("u1")) == 2
+
+def test_query_streams_arrow(app, client, memory_context):
+    pa = pytest.importorskip("pyarrow")
+    app.config["LLM_BACKEND"] = "local"
+    response = client.post("/query", json={"user_id": "u1", "query": "list all customers", "stream": True,
+                                           "format": "arrow"})
+    table = pa.ipc.open_stream(response.get_data()).read_all()
+    assert table.num_rows == 3 and table.column_names[:2] == ["id", "first_name"]
+
+def test_query_pages_results(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    first = client.post("/query", json={"user_id": "u1", "query": "list all customers", "page_size": 2}).get_json()
+    assert len(first["result"]["rows"]) == 2 and first["offset"] == 0
+    second = client.get("/query/page", query_string={"page_token": first["next_page_token"]}).get_json()
+    assert len(second["result"]["rows"]) == 1 and second["offset"] == 2
+    assert second["next_page_token"] is None
+    assert client.get("/query/page", query_string={"page_token": "forged"}).status_code == 400
+    assert len(memory_context.get("u1")) == 1
+
+@pytest.mark.parametrize("page_size", [0, -1, "two", 2.5, True, 10 ** 9])
+def test_query_rejects_bad_page_size_before_translating(app, client, memory_context, page_size):
+    app.config["LLM_BACKEND"] = "local"
+    response = client.post("/query", json={"user_id": "u1", "query": "list all customers", "page_size": page_size})
+    assert response.status_code == 400
+    assert memory_context.get("u1") == []
+
+def test_query_answers_non_pageable_sql_once(app, client, memory_context, tmp_path):
+    responses = tmp_path / "responses.json"
+    responses.write_text(json.dumps([{"contains": "column layout",
+                                      "response": json.dumps({"sql": "PRAGMA table_info(customer)", "valid": True})}]))
+    app.config.update(LLM_BACKEND="local", LOCAL_LLM_RESPONSES=str(responses))
+    response = client.post("/query", json={"user_id": "u1", "query": "show the column layout", "page_size": 2})
+    data = response.get_json()
+    assert data["sql"] == "PRAGMA table_info(customer)" and len(data["result"]["rows"]) == 6
+    assert "next_page_token" not in data
+    assert len(memory_context.get("u1")) == 1
+    assert app.extensions["agent_registry"].llm_backend.stats()["calls"] == 1
+
+def test_translation_cache_keeps_only_executed_sql(app, client, memory_context):
+    app.config["LLM_BACKEND"] = "local"
+    cache = app.extensions["agent_registry"].translation_cache
+    query = {"query": "list all customers"}
+    # Conversion-only answers are never cached, nor served from the cache.
+    assert client.post("/query", json=dict(query, user_id="u1", execute_sql=False)).get_json()["cached"] is False
+    assert cache.stats()["entries"] == 0
+
+    assert client.post("/query", json=dict(query, user_id="u2")).get_json()["cached"] is False
+    assert client.post("/query", json=dict(query, user_id="u3")).get_json()["cached"] is True
+    assert client.post("/query", json=dict(query, user_id="u4", execute_sql=False)).get_json()["cached"] is False
+    # The pipeline mode is part of the key.
+    strict = client.post("/query", json=dict(query, user_id="u5", pipeline_mode="strict")).get_json()
+    assert strict["cached"] is False
+    assert cache.stats()["entries"] == 2
+
+def test_translation_cache_skips_sql_that_failed_to_run(app, client, memory_context, tmp_path):
+    responses = tmp_path / "responses.json"
+    # Valid SQL that only fails when run (integer overflow).
+    failing = "SELECT abs(-9223372036854775808) FROM customer"
+    responses.write_text(json.dumps([{"contains": "overflow",
+                                      "response": json.dumps({"sql": failing, "valid": True})}]))
+    app.config.update(LLM_BACKEND="local", LOCAL_LLM_RESPONSES=str(responses))
+    for payload in ({}, {"page_size": 2}, {"stream": True, "format": "csv"}):
+        response = client.post("/query", json=dict(payload, user_id="u1", query="cause an overflow"))
+        assert "overflow" in response.get_json()["error"]
+    assert app.extensions["agent_registry"].translation_cache.stats()["entries"] == 0
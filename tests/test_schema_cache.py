@@ -0,0 +1,41 @@
+import sqlite3
+from app.models.schema_cache import SchemaCache
+from app.models.schema_manager import SchemaManager
+
+def _create_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE customer (id INTEGER PRIMARY KEY, first_name TEXT, city TEXT)")
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, quantity INTEGER)")
+    conn.commit()
+    conn.close()
+
+def test_snapshot_reused_until_schema_changes(db_file):
+    _create_db(db_file)
+    cache = SchemaCache()
+    first = cache.get(db_file)
+    assert cache.get(db_file) is first
+    assert first.table_names_lower == ["customer", "orders"]
+    assert first.schema_prompt.splitlines()[0] == "Database Schema:"
+    assert "Table 'customer': id, first_name, city" in first.schema_prompt
+
+    # A data-only change bumps the file mtime but not the schema version.
+    conn = sqlite3.connect(db_file)
+    conn.execute("INSERT INTO customer (first_name, city) VALUES ('Alice', 'Paris')")
+    conn.commit()
+    conn.close()
+    assert cache.get(db_file) is first
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("ALTER TABLE customer ADD COLUMN age INTEGER")
+    conn.close()
+    second = cache.get(db_file)
+    assert second is not first
+    assert second.schema_info["customer"]["columns"][-1] == "age"
+    assert second.fingerprint != first.fingerprint
+
+def test_schema_manager_uses_cache(db_file):
+    _create_db(db_file)
+    cache = SchemaCache()
+    manager = SchemaManager(db_file=db_file, use_dynamic_schema=True, schema_cache=cache)
+    assert manager.get_snapshot() is cache.get(db_file)
+    assert manager.correct_term("customers") == "customer"
@@ -0,0 +1,42 @@
+import sqlite3
+from app.models.schema_cache import introspect_schema
+from app.models.schema_manager import SchemaManager
+from app.models.schema_retriever import SchemaRetriever, tokenize
+from config import Config
+
+def _schema():
+    schema = {f"archive_{i}": {"columns": ["id", "name", f"field_{i}"]} for i in range(40)}
+    schema["customer"] = {"columns": ["id", "first_name", "city"]}
+    schema["orders"] = {"columns": ["id", "customer_id", "quantity"],
+                        "foreign_keys": [{"column": "customer_id", "table": "customer", "to": "id"}]}
+    schema["product"] = {"columns": ["id", "name", "price"]}
+    return schema
+
+def test_tokenize_splits_and_singularizes_identifiers():
+    assert tokenize("OrderItems") == ["order", "item"]
+    assert tokenize("order_items categories") == ["order", "item", "category"]
+
+def test_selects_relevant_tables_with_foreign_key_neighbours():
+    retriever = SchemaRetriever(_schema())
+    assert retriever.select("total quantity of orders", top_k=1, min_score=2.0) == ["customer", "orders"]
+    assert retriever.select("average product price", top_k=2, min_score=2.0)[0] == "product"
+    # Nothing specific matches: the caller falls back to the full schema.
+    assert retriever.select("show me everything", top_k=3, min_score=2.0) is None
+
+def test_schema_prompt_is_pruned_for_large_schemas(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEMA_RETRIEVAL_MIN_TABLES", 10)
+    manager = SchemaManager(_schema())
+    prompt = manager.get_schema_prompt("how many orders per customer")
+    assert prompt.splitlines() == [
+        "Database Schema:",
+        "Table 'customer': id, first_name, city",
+        "Table 'orders': id, customer_id, quantity",
+    ]
+    assert manager.get_schema_prompt("show me everything") == manager.get_schema_prompt()
+
+def test_introspection_reads_foreign_keys(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE customer (id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customer(id))")
+    assert introspect_schema(conn)["orders"]["foreign_keys"] == [{"column": "customer_id", "table": "customer", "to": "id"}]
+    conn.close()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+import pytest
+from app.models.single_flight import SingleFlight
+
+class FakeRedis:
+    """SET NX/PX, GET, MGET and DELETE in memory; expiry is ignored."""
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value.encode("utf-8")
+            return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    def translate():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"sql": "SELECT 1"}
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", translate))) for _ in range(8)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"sql": "SELECT 1"}] * 8
+    # Each caller gets its own copy.
+    assert len({id(result) for result in results}) == 8
+    assert flight.do("k", lambda: {"sql": "SELECT 2"}) == {"sql": "SELECT 2"}
+
+def test_followers_stop_waiting_for_a_hung_leader():
+    flight = SingleFlight(wait_seconds=0.05)
+    release = threading.Event()
+    started = threading.Event()
+    def hung():
+        started.set()
+        release.wait(5)
+        return {"sql": "SELECT 1"}
+    leader = threading.Thread(target=lambda: flight.do("k", hung))
+    leader.start()
+    started.wait()
+    assert flight.do("k", lambda: {"sql": "SELECT 2"}) == {"sql": "SELECT 2"}
+    release.set()
+    leader.join()
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight.stats()["in_flight"] == 0
+
+def test_async_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    async def translate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"sql": "SELECT 1"}
+    async def main():
+        return await asyncio.gather(*[flight.ado("k", translate) for _ in range(5)])
+    assert asyncio.run(main()) == [{"sql": "SELECT 1"}] * 5
+    assert len(calls) == 1
+
+def test_followers_outlive_a_cancelled_leader():
+    flight = SingleFlight()
+    calls = []
+    async def translate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"sql": "SELECT 1"}
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("k", translate))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.ado("k", translate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return leader, await asyncio.gather(*followers)
+    leader, results = asyncio.run(main())
+    assert leader.cancelled()
+    assert results == [{"sql": "SELECT 1"}] * 3
+    # One follower took over as leader; the others joined it.
+    assert len(calls) == 2
+
+def test_waits_for_another_workers_result():
+    client = FakeRedis()
+    flight = SingleFlight(redis_client=client, poll_interval=0.01)
+    other_worker = SingleFlight(redis_client=client)
+    token = other_worker._acquire("k")
+    def finish():
+        time.sleep(0.1)
+        other_worker._publish("k", {"sql": "SELECT 1"})
+        other_worker._release("k", token)
+    threading.Thread(target=finish).start()
+    assert flight.do("k", lambda: {"sql": "not used"}) == {"sql": "SELECT 1"}
+    # Once the lease is released, the next caller runs the function itself.
+    assert flight.do("k", lambda: {"sql": "SELECT 2"}) == {"sql": "SELECT 2"}
+
+def test_identical_questions_share_one_llm_call(app, db_file):
+    from app.models.llm_backend import LocalBackend
+    from app.models.schema_manager import SchemaManager
+    from app.models.sql_generator import GeminiSQLGenerator
+    from app.models.text_to_sql_agent import TextToSQLAgent
+    schema_manager = SchemaManager(db_file=db_file, use_dynamic_schema=True)
+    backend = LocalBackend(latency=0.2)
+    generator = GeminiSQLGenerator(schema_manager, backend=backend)
+    flight = SingleFlight()
+    results = {}
+    def ask(user_id):
+        agent = TextToSQLAgent(None, db_file, user_id, schema_manager=schema_manager, sql_generator=generator,
+                               execute_sql=False, single_flight=flight)
+        results[user_id] = agent.translate("List all customers")
+    threads = [threading.Thread(target=ask, args=(f"user{i}",)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.stats()["calls"] == 1
+    assert {result["sql"] for result in results.values()} == {"SELECT * FROM customer"}
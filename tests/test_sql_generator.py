@@ -0,0 +1,46 @@
+import json
+import pytest
+from app.models.llm_backend import LocalBackend
+from app.models.schema_manager import SchemaManager
+from app.models.sql_generator import GeminiSQLGenerator
+from app.models.text_to_sql_agent import TextToSQLAgent
+
+@pytest.fixture
+def generator():
+    return GeminiSQLGenerator(SchemaManager({"customer": {"columns": ["id", "city"]}}), backend=LocalBackend())
+
+def test_parse_structured_response_strips_fences(generator):
+    text = '```json\n{"sql": "```sql\\nSELECT id FROM customer\\n```", "valid": true}\n```'
+    assert generator.parse_structured_response(text) == {"sql": "SELECT id FROM customer", "valid": True,
+                                                         "validation": "yes"}
+
+@pytest.mark.parametrize("text", ['{"sql": "SELECT 1", "valid": tru', '["SELECT 1"]', "SELECT 1"])
+def test_parse_structured_response_rejects_malformed_json(generator, text):
+    parsed = generator.parse_structured_response(text)
+    assert parsed["valid"] is False
+    assert parsed["validation"] == "Could not parse the structured response from Gemini."
+
+def test_parse_structured_response_reads_string_verdicts(generator):
+    parsed = generator.parse_structured_response(json.dumps({"sql": "SELECT id FROM customer", "valid": "false",
+                                                             "explanation": "No such column."}))
+    assert parsed == {"sql": "SELECT id FROM customer", "valid": False, "validation": "No such column."}
+    assert generator.parse_structured_response('{"sql": "SELECT 1", "valid": "Yes"}')["valid"] is True
+
+@pytest.mark.parametrize("data", [{"sql": "SELECT 1"}, {"valid": True}, {}])
+def test_parse_structured_response_treats_missing_keys_as_invalid(generator, data):
+    parsed = generator.parse_structured_response(json.dumps(data))
+    assert parsed["valid"] is False
+    assert parsed["validation"] == "The generated SQL query is not valid."
+
+def test_single_mode_makes_one_llm_call(app, db_file, memory_context, monkeypatch):
+    schema_manager = SchemaManager(db_file=db_file, use_dynamic_schema=True)
+    backend = LocalBackend()
+    generator = GeminiSQLGenerator(schema_manager, backend=backend)
+    agent = TextToSQLAgent(None, db_file, "u1", schema_manager=schema_manager, sql_generator=generator,
+                           execute_sql=True, pipeline_mode="single")
+    cleaned = []
+    monkeypatch.setattr(agent.executor, "clean_query", lambda *args, **kwargs: cleaned.append(args))
+    response = agent.process_query("List all customers")
+    assert response["sql"] == "SELECT * FROM customer" and len(response["result"]["rows"]) == 3
+    assert backend.stats()["calls"] == 1
+    assert cleaned == []
@@ -0,0 +1,32 @@
+from app.models.schema_manager import SchemaManager
+from app.models.sql_validator import SQLiteValidator
+from config import TestConfig
+
+def _validator():
+    return SQLiteValidator(SchemaManager(TestConfig.STATIC_SCHEMA_INFO))
+
+def test_valid_query():
+    result = _validator().validate("SELECT c.first_name, o.quantity FROM customer c JOIN orders o ON o.customer_id = c.id")
+    assert result == {"valid": True, "errors": [], "validation": "yes"}
+
+def test_unknown_table_and_column():
+    validator = _validator()
+    error = validator.validate("SELECT * FROM customers")["errors"][0]
+    assert error["type"] == "unknown_table"
+    assert error["name"] == "customers" and error["suggestion"] == "customer"
+    assert error["position"] == 14
+
+    error = validator.validate("SELECT nme FROM product")["errors"][0]
+    assert error["type"] == "unknown_column" and error["suggestion"] == "name"
+
+def test_syntax_errors():
+    validator = _validator()
+    result = validator.validate("SELEC * FROM customer")
+    assert not result["valid"]
+    assert result["errors"][0]["type"] == "syntax" and result["errors"][0]["position"] == 0
+    assert validator.validate("SELECT 1; SELECT 2")["errors"][0]["type"] == "multiple_statements"
+
+def test_destructive_statements_are_not_executed():
+    validator = _validator()
+    assert validator.validate("DROP TABLE orders")["valid"]
+    assert validator.validate("SELECT * FROM orders")["valid"]
@@ -0,0 +1,28 @@
+from app.models.nlp_processor import NLProcessor
+from app.models.schema_manager import SchemaManager
+from app.models.term_index import TermIndex
+
+SCHEMA = {
+    "customer": {"columns": ["id", "first_name", "city"]},
+    "orders": {"columns": ["id", "customer_id", "quantity"]},
+    "category": {"columns": ["id", "name"]},
+}
+
+def test_normalizes_tables_columns_and_synonyms():
+    index = TermIndex(SCHEMA, synonyms={"client": "customer"})
+    text, replaced = index.normalize("First names and cities of Customers, clients and categories")
+    assert text == "first_name and city of customer, customer and category"
+    assert ("First names", "first_name") in replaced
+    # Names that are already canonical, and short words, are left alone.
+    assert index.normalize("orders is an order")[0] == "orders is an order"
+
+def test_normalize_terms_uses_the_snapshot_index():
+    manager = SchemaManager(SCHEMA)
+    assert NLProcessor().normalize_terms("How many customers per city", manager) == "How many customer per city"
+    assert manager.get_snapshot().term_index is manager.get_snapshot().term_index
+
+def test_fuzzy_correction():
+    manager = SchemaManager(SCHEMA)
+    assert manager.correct_term("custmer") == "customer"
+    assert manager.correct_term("quantty", kind="column") == "quantity"
+    assert manager.correct_term("unrelated") == "unrelated"
@@ -0,0 +1,19 @@
+import asyncio
+from app.async_runtime import AsyncRuntime, run_blocking
+from app.timings import start_timings, stage
+
+def test_stage_timings_follow_the_request_into_the_runtime():
+    runtime = AsyncRuntime()
+    timings = start_timings()
+
+    def blocking():
+        with stage("execute"):
+            return True
+
+    async def work():
+        with stage("generate"):
+            await asyncio.sleep(0)
+        return await run_blocking(blocking)
+
+    assert runtime.submit(work()).result(timeout=5)
+    assert set(timings.durations) == {"generate", "execute"}
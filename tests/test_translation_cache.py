@@ -0,0 +1,22 @@
+from app.models.translation_cache import TranslationCache
+
+def test_key_depends_on_schema_model_and_pipeline():
+    key = TranslationCache.make_key("show  all customer ", "abc", "gemini-2.0-flash")
+    assert key == TranslationCache.make_key("show all customer", "abc", "gemini-2.0-flash")
+    assert key != TranslationCache.make_key("show all customer", "def", "gemini-2.0-flash")
+    assert key != TranslationCache.make_key("show all customer", "abc", "gemini-1.5-pro")
+    assert key != TranslationCache.make_key("show all customer", "abc", "gemini-2.0-flash", pipeline="strict")
+
+def test_lru_eviction_and_ttl():
+    cache = TranslationCache(max_entries=2, ttl_seconds=3600)
+    cache.put("a", "SELECT 1")
+    cache.put("b", "SELECT 2")
+    assert cache.get("a") == "SELECT 1"
+    cache.put("c", "SELECT 3")  # evicts "b", the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("c") == "SELECT 3"
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+    expired = TranslationCache(ttl_seconds=0)
+    expired.put("a", "SELECT 1")
+    assert expired.get("a") is None